@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Runs workflows through a batch scheduler such as Slurm or PBS."""
+
+import shlex
+import signal
+import subprocess
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from .workflow import Executor, Workflow
+
+# The file in the workflow directory that contains the job script.
+JOB_SCRIPT = "log.job"
+# The file in which the job script writes the exit code of the workflow.
+EXIT_CODE_FILE = "log.exit"
+
+
+class BatchExecutor(Executor):
+    """
+    Submits each workflow as a job with command templates, like
+    ``sbatch {script}`` or ``qsub {script}``. The workflow command is written
+    to a job script that writes stdout and stderr to the logs of the workflow
+    and its exit code to a file. The workflow has finished when that file
+    exists, so the workflow directory must be shared with the nodes that
+    run the jobs.
+
+    The templates can use {script}, {name}, {cwd}, {stdout}, {stderr},
+    {cpus}, {memory} (in bytes) and {memory_mb}. The poll and cancel
+    templates can also use {job_id}. All values are shell quoted.
+    """
+
+    def __init__(self, submit_command: str,
+                 poll_command: Optional[str] = None,
+                 cancel_command: Optional[str] = None,
+                 poll_interval: float = 5.0):
+        """
+        :param submit_command: Submits the job script. The last word it
+        prints to stdout is used as the job id.
+        :param poll_command: Checks whether the job is still known to the
+        scheduler. A non-zero exit code means it is not. Used to detect jobs
+        that were removed before they could write their exit code. None
+        means only the exit code file is checked.
+        :param cancel_command: Cancels the job. None means jobs can not be
+        cancelled, so timeouts only take effect when the job ends.
+        :param poll_interval: The number of seconds between two polls.
+        """
+        self.submit_command = submit_command
+        self.poll_command = poll_command
+        self.cancel_command = cancel_command
+        self.poll_interval = poll_interval
+        self._job_ids: Dict[Workflow, str] = {}
+        # Jobs that disappeared without writing an exit code.
+        self._lost: Set[Workflow] = set()
+
+    @staticmethod
+    def exit_code_file(workflow: Workflow) -> Path:
+        return workflow.cwd / EXIT_CODE_FILE
+
+    def job_script(self, workflow: Workflow) -> str:
+        """Creates the job script for a workflow. The command is not run by
+        a shell, the same as when it runs locally."""
+        command = shlex.join(shlex.split(workflow.command))
+        exit_code_file = shlex.quote(str(self.exit_code_file(workflow)))
+        environment = " ".join(
+            f"{variable}={shlex.quote(value)}"
+            for variable, value in workflow.environment().items())
+        return (
+            f"#!/bin/sh\n"
+            f"export {environment}\n"
+            f"cd {shlex.quote(str(workflow.cwd.absolute()))} && "
+            f"{command} > {shlex.quote(str(workflow.stdout_file.absolute()))}"
+            f" 2> {shlex.quote(str(workflow.stderr_file.absolute()))}\n"
+            f"echo $? > {exit_code_file}.tmp\n"
+            f"mv {exit_code_file}.tmp {exit_code_file}\n")
+
+    def _format(self, template: str, workflow: Workflow) -> str:
+        values = dict(
+            script=workflow.cwd.absolute() / JOB_SCRIPT,
+            name=workflow.name,
+            cwd=workflow.cwd.absolute(),
+            stdout=workflow.stdout_file.absolute(),
+            stderr=workflow.stderr_file.absolute(),
+            cpus=workflow.cpus,
+            memory=workflow.memory,
+            memory_mb=-(-workflow.memory // 2 ** 20),
+            job_id=self._job_ids.get(workflow, ""))
+        return template.format(**{key: shlex.quote(str(value))
+                                  for key, value in values.items()})
+
+    def submit(self, workflow: Workflow):
+        script = workflow.cwd / JOB_SCRIPT
+        script.write_text(self.job_script(workflow))
+        script.chmod(0o755)
+        self.exit_code_file(workflow).unlink(missing_ok=True)
+        # Create the logs, so they exist even when the job never starts.
+        workflow.stdout_file.touch()
+        workflow.stderr_file.touch()
+        result = subprocess.run(
+            shlex.split(self._format(self.submit_command, workflow)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        words = result.stdout.decode(errors="replace").split()
+        if not words:
+            raise ValueError(f"No job id was printed when '{workflow.name}' "
+                             f"was submitted.")
+        self._job_ids[workflow] = words[-1]
+
+    def poll(self, workflow: Workflow) -> bool:
+        if self.exit_code_file(workflow).exists():
+            return True
+        if self.poll_command is None:
+            return False
+        result = subprocess.run(
+            shlex.split(self._format(self.poll_command, workflow)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            return False
+        # The job may have written its exit code just before it ended.
+        if self.exit_code_file(workflow).exists():
+            return True
+        self._lost.add(workflow)
+        return True
+
+    def cancel(self, workflow: Workflow):
+        if self.cancel_command is None or workflow not in self._job_ids:
+            return
+        subprocess.run(
+            shlex.split(self._format(self.cancel_command, workflow)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def exit_code(self, workflow: Workflow) -> int:
+        if workflow in self._lost:
+            # The scheduler removed the job, for instance because it
+            # exceeded its time or memory limit. Report it like a process
+            # that was killed.
+            return -signal.SIGKILL
+        return int(self.exit_code_file(workflow).read_text())
@@ -22,12 +22,12 @@ once."""
 import functools
 import gzip
 import re
-import threading
 from pathlib import Path
 from typing import Iterable, Optional, Set
 
 import pytest
 
+from .scanner import ContentScanner
 from .schema import ContentTest
 from .workflow import Workflow
 
@@ -75,7 +75,8 @@ class ContentTestCollector(pytest.Collector):
                  filepath: Path,
                  content_test: ContentTest,
                  workflow: Workflow,
-                 content_name: Optional[str] = None):
+                 content_name: Optional[str] = None,
+                 scanner: Optional[ContentScanner] = None):
         """
         Creates a content test collector
         :param name: Name of the thing which contents are tested
@@ -85,6 +86,8 @@ class ContentTestCollector(pytest.Collector):
         :param workflow: the workflow is running.
         :param content_name: The name of the content that will be displayed if
         the test fails. Defaults to filepath.
+        :param scanner: A scanner that searched the content while the
+        workflow was running. When given, the file is not read again.
         """
         super().__init__(name, parent=parent)
         self.filepath = filepath
@@ -92,19 +95,29 @@ class ContentTestCollector(pytest.Collector):
         self.workflow = workflow
         self.found_strings = None
         self.found_patterns = None
-        self.thread = None
+        # Whether the content was searched already.
+        self.searched = False
         # We check the contents of files. Sometimes files are not there. Then
         # content can not be checked. We save FileNotFoundErrors in this
         # boolean.
         self.file_not_found = False
         self.content_name = content_name or str(filepath)
+        self.scanner = scanner
 
     def find_strings(self):
-        """Find the strings that are looked for in the given file
+        """Find the strings that are looked for in the given file. The file
+        is only searched the first time this is called.
 
         When a file we test is not produced, we save the FileNotFoundError so
         we can give an accurate repr_failure."""
+        if self.searched:
+            return
+        self.searched = True
         self.workflow.wait()
+        if self.scanner is not None:
+            self.found_strings = self.scanner.found_strings
+            self.found_patterns = self.scanner.found_patterns
+            return
         strings_to_check = (self.content_test.contains +
                             self.content_test.must_not_contain)
         patterns_to_check = (self.content_test.contains_regex +
@@ -124,11 +137,9 @@ class ContentTestCollector(pytest.Collector):
             self.file_not_found = True
 
     def collect(self):
-        # A thread is started that looks for the strings and collection can go
-        # on without hindrance. The thread is passed to the items, so they can
-        # wait on the thread to complete.
-        self.thread = threading.Thread(target=self.find_strings)
-        self.thread.start()
+        # The content is searched by the first item that runs. All workflows
+        # have finished by then, so there is nothing to gain from searching
+        # in a background thread.
         test_items = []
 
         test_items += [
@@ -182,9 +193,8 @@ class ContentTestItem(pytest.Item):
         """
         Create a ContentTestItem
         :param parent: A ContentTestCollector. We use a ContentTestCollector
-        here and not just any pytest collector because we now can wait on the
-        thread in the parent, and get its found strings when its thread is
-        finished.
+        here and not just any pytest collector because the parent searches
+        the content once for all its items.
         :param string: The string that was searched for.
         :param should_contain: Whether the string should have been there
         :param regex: Wether we are looking for a regex
@@ -202,14 +212,15 @@ class ContentTestItem(pytest.Item):
 
     def runtest(self):
         """Only after a workflow is finished the contents of files and logs are
-        read. The ContentTestCollector parent reads each file once. This is
-        done in its thread. We wait for this thread to complete. Then we check
-        all the found strings in the parent.
+        read. The ContentTestCollector parent reads each file once, or uses
+        the results of scanning the output while the workflow ran. Then we
+        check all the found strings in the parent.
         This way we do not have to read each file one time per ContentTestItem
         this makes content checking much faster on big files (NGS > 1 GB files)
         were we are looking for multiple words (variants / sequences). """
-        # Wait for thread to complete.
-        self.parent.thread.join()
+        self.parent.find_strings()
+        if self.parent.workflow.skip_reason is not None:
+            pytest.skip(self.parent.workflow.skip_reason)
         if not self.parent.workflow.matching_exitcode():
             pytest.skip(f"'{self.parent.workflow.name}' did not exit with"
                         f"desired exit code.")
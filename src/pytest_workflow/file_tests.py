@@ -111,6 +111,8 @@ class FileExists(pytest.Item):
         # Wait for the workflow process to finish before checking if the file
         # exists.
         self.workflow.wait()
+        if self.workflow.skip_reason is not None:
+            pytest.skip(self.workflow.skip_reason)
         if not self.workflow.matching_exitcode():
             pytest.skip(f"'{self.parent.workflow.name}' did not exit with"
                         f"desired exit code.")
@@ -148,6 +150,8 @@ class FileMd5(pytest.Item):
     def runtest(self):
         # Wait for the workflow to finish before we check the md5sum of a file.
         self.workflow.wait()
+        if self.workflow.skip_reason is not None:
+            pytest.skip(self.workflow.skip_reason)
         if not self.workflow.matching_exitcode():
             pytest.skip(f"'{self.parent.workflow.name}' did not exit with"
                         f"desired exit code.")
@@ -0,0 +1,139 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Keeps track of workflow durations and performance across sessions in
+pytest's cache."""
+
+import json
+import statistics
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .workflow import ResourceUsage
+
+DURATIONS_CACHE_KEY = "pytest_workflow/durations"
+BASELINE_CACHE_KEY = "pytest_workflow/perf_baseline"
+
+
+class WorkflowHistory(object):
+    """Durations of workflows from earlier sessions. These are used to
+    estimate how long a workflow will take."""
+
+    def __init__(self, cache: Optional[Any] = None):
+        """
+        :param cache: A pytest cache object (config.cache). When None is
+        given, for instance when the cacheprovider plugin is disabled, the
+        history is only kept for this session.
+        """
+        self.cache = cache
+        self.durations: Dict[str, float] = (
+            dict(cache.get(DURATIONS_CACHE_KEY, {})) if cache is not None
+            else {})
+        # The medians of the durations, by the key of a group of similar
+        # workflows. None is the key of all workflows. Computing a median for
+        # each workflow of a large matrix would take quadratic time.
+        self._medians: Dict[Optional[str], Optional[float]] = {}
+
+    @property
+    def default_estimate(self) -> float:
+        """The estimate for workflows that have not run before. The median of
+        the known durations is used, so a new workflow is neither put in front
+        of nor behind all the others."""
+        if None not in self._medians:
+            self._medians[None] = self._median(self.durations)
+        return self._medians[None] or 0.0
+
+    def _median(self, names: Iterable[str]) -> Optional[float]:
+        durations = [self.durations[name] for name in names
+                     if name in self.durations]
+        return statistics.median(durations) if durations else None
+
+    def estimate(self, name: str, similar: Iterable[str] = (),
+                 similar_key: Optional[str] = None) -> float:
+        """
+        Returns the estimated duration in seconds of a workflow.
+        :param name: The name of the workflow
+        :param similar: Names of workflows that are expected to take about
+        as long, such as the other variants of a matrix. The median of their
+        durations is used when the workflow has not run before.
+        :param similar_key: Identifies the similar workflows, such as the
+        name of the matrix, so their median is only computed once.
+        """
+        if name in self.durations:
+            return self.durations[name]
+        if similar_key is None:
+            median = self._median(similar)
+        else:
+            if similar_key not in self._medians:
+                self._medians[similar_key] = self._median(similar)
+            median = self._medians[similar_key]
+        if median is not None:
+            return median
+        return self.default_estimate
+
+    def record(self, name: str, duration: float):
+        """Records the duration of a workflow in this session."""
+        self.durations[name] = duration
+        self._medians.clear()
+
+    def save(self):
+        """Writes the durations to the cache."""
+        if self.cache is not None:
+            self.cache.set(DURATIONS_CACHE_KEY, self.durations)
+
+
+class PerformanceBaseline(object):
+    """The CPU and wall time of workflows in a reference session. Stored in
+    pytest's cache or in a JSON file."""
+
+    def __init__(self, cache: Optional[Any] = None,
+                 path: Optional[Path] = None):
+        """
+        :param cache: A pytest cache object (config.cache). Used when no path
+        is given.
+        :param path: A JSON file to store the baseline in. Useful for keeping
+        the baseline under version control.
+        """
+        self.cache = cache
+        self.path = path
+        self.times: Dict[str, Dict[str, float]] = {}
+        if path is not None:
+            if path.exists():
+                self.times = json.loads(path.read_text())
+        elif cache is not None:
+            self.times = dict(cache.get(BASELINE_CACHE_KEY, {}))
+
+    def get(self, name: str, metric: str) -> Optional[float]:
+        """
+        Returns the baseline value of a workflow.
+        :param name: The name of the workflow
+        :param metric: 'cpu_time' or 'wall_time'
+        :return: The value in seconds or None if there is no baseline
+        """
+        return self.times.get(name, {}).get(metric)
+
+    def record(self, name: str, resource_usage: ResourceUsage):
+        """Records the CPU and wall time of a workflow as its baseline."""
+        self.times[name] = dict(cpu_time=resource_usage.cpu_time,
+                                wall_time=resource_usage.wall_time)
+
+    def save(self):
+        """Writes the baseline to the file or the cache."""
+        if self.path is not None:
+            self.path.write_text(json.dumps(self.times, indent=2,
+                                            sort_keys=True))
+        elif self.cache is not None:
+            self.cache.set(BASELINE_CACHE_KEY, self.times)
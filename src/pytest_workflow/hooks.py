@@ -0,0 +1,31 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Hooks that can be implemented in a conftest.py or a plugin to change how
+pytest-workflow runs workflows."""
+
+import pytest
+
+
+@pytest.hookspec(firstresult=True)
+def pytest_workflow_executor(config: pytest.Config):
+    """
+    Returns the executor that runs the workflows. Implement this hook to run
+    workflows on another backend. The executor should be an instance of a
+    subclass of pytest_workflow.workflow.Executor.
+    :param config: The pytest config
+    :return: An executor or None to let the next implementation decide.
+    """
@@ -0,0 +1,242 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Placement of the processes of workflows on the cpus and disks of the
+machine. Running workflows get disjoint sets of cpus, a nice level, an I/O
+scheduling class and optionally a cgroup of their own, so workflows that
+share a machine do not disturb each others timings."""
+
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import os
+import platform
+import re
+import warnings
+from pathlib import Path
+from typing import (Dict, Iterable, List, Optional, Set, TYPE_CHECKING,
+                    Tuple)
+
+from .util import replace_whitespace
+
+if TYPE_CHECKING:  # The workflow module uses this module.
+    from .workflow import Workflow
+
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# Python has no binding for ioprio_set, so the system call is made directly.
+# Its number differs per architecture.
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i386": 289, "i686": 289,
+                       "aarch64": 30, "riscv64": 30, "armv7l": 314,
+                       "ppc64": 273, "ppc64le": 273, "s390x": 282}
+# The period in microseconds of the cpu.max quota of a cgroup.
+CPU_MAX_PERIOD = 100000
+DEFAULT_IO_WEIGHT = 100
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def parse_ionice(ionice: str) -> Tuple[int, int]:
+    """
+    Converts an I/O scheduling class as given to the ionice program into the
+    class and level for ioprio_set.
+    :param ionice: 'idle', or 'best-effort' or 'realtime' with an optional
+    level from 0 (highest priority) to 7 (lowest), for example
+    'best-effort:7'.
+    :return: A tuple of the class and the level
+    """
+    match = re.fullmatch(r"(realtime|best-effort|idle)(?::([0-7]))?", ionice)
+    if match is None:
+        raise ValueError(f"Invalid I/O scheduling class: '{ionice}'. Use "
+                         f"'idle', 'best-effort' or 'realtime', optionally "
+                         f"followed by a level from 0 to 7, such as "
+                         f"'best-effort:7'.")
+    ioprio_class, level = match.groups()
+    if ioprio_class == "idle" and level is not None:
+        raise ValueError("The idle I/O scheduling class has no levels.")
+    # 4 is the level the kernel uses for processes without a set priority.
+    return IOPRIO_CLASSES[ioprio_class], int(level or 4)
+
+
+def format_cpu_set(cpus: Iterable[int]) -> str:
+    """Formats cpus as a list of ranges, like /proc/self/status does. For
+    example '0-3,6'."""
+    ranges: List[List[int]] = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}"
+                    for first, last in ranges)
+
+
+def place_process(cpus: Optional[Set[int]], nice: Optional[int],
+                  ioprio: Optional[int], ioprio_set: Optional[int],
+                  cgroup_procs: Optional[str]):
+    """
+    Places the calling process. Called in the child process before the
+    workflow is executed, so everything the workflow starts inherits the
+    placement. Only system calls are made, because the child process of a
+    multithreaded program can not safely do much more.
+    :param cpus: The cpus the process may run on
+    :param nice: The increment of the nice level
+    :param ioprio: The value for the ioprio_set system call
+    :param ioprio_set: The number of the ioprio_set system call
+    :param cgroup_procs: The cgroup.procs file of the cgroup the process is
+    moved to
+    """
+    if cgroup_procs is not None:
+        fd = os.open(cgroup_procs, os.O_WRONLY)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+        finally:
+            os.close(fd)
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    if nice:
+        os.nice(nice)
+    if ioprio is not None and ioprio_set is not None:
+        if _libc.syscall(ioprio_set, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+
+class Placement(object):
+    """Gives the workflows that are started by the WorkflowQueue their
+    place on the machine. Workflows are placed when they are started and
+    their cpus are returned when they have finished."""
+
+    def __init__(self, cpus: Optional[Iterable[int]] = None,
+                 nice: Optional[int] = None,
+                 ionice: Optional[str] = None,
+                 cgroup_root: Optional[Path] = None,
+                 io_weight: int = DEFAULT_IO_WEIGHT):
+        """
+        :param cpus: The cpus the workflows are placed on. Each running
+        workflow gets as many of these as it claims with its cpus, with no
+        overlap between the workflows. None means the workflows are not
+        pinned to cpus.
+        :param nice: The increment of the nice level of the workflows
+        :param ionice: The I/O scheduling class of the workflows, see
+        parse_ionice.
+        :param cgroup_root: A cgroup v2 directory that is delegated to this
+        process. Each workflow gets a cgroup in it with a cpu.max of its cpus
+        and an io.weight of io_weight. None means no cgroups are created.
+        :param io_weight: The io.weight of the cgroups, from 1 to 10000.
+        """
+        self._free_cpus: Optional[Set[int]] = (
+            set(cpus) if cpus is not None else None)
+        self.nice = nice
+        self.ionice = ionice
+        self._ioprio: Optional[int] = None
+        self._ioprio_set = IOPRIO_SET_SYSCALLS.get(platform.machine())
+        if ionice is not None:
+            ioprio_class, level = parse_ionice(ionice)
+            self._ioprio = (ioprio_class << IOPRIO_CLASS_SHIFT) | level
+            if self._ioprio_set is None:
+                warnings.warn(f"Setting the I/O scheduling class is not "
+                              f"supported on {platform.machine()}. "
+                              f"'{ionice}' is not used.")
+        if cgroup_root is not None and not (
+                cgroup_root / "cgroup.controllers").exists():
+            raise ValueError(f"'{cgroup_root}' is not a cgroup v2 directory.")
+        if not 1 <= io_weight <= 10000:
+            raise ValueError(f"io.weight should be between 1 and 10000, not "
+                             f"{io_weight}.")
+        self.cgroup_root = cgroup_root
+        self.io_weight = io_weight
+        self._cgroups_enabled = cgroup_root is not None
+        self._cpus: Dict["Workflow", Set[int]] = {}
+        self._cgroups: Dict["Workflow", Path] = {}
+
+    @property
+    def pins_cpus(self) -> bool:
+        """Whether the workflows are pinned to cpus."""
+        return self._free_cpus is not None
+
+    def claim(self, workflow: "Workflow"):
+        """Places a workflow that is about to start. The placement is
+        described in workflow.allocation."""
+        cpus = self._claim_cpus(workflow)
+        cgroup = self._create_cgroup(workflow)
+        if cpus is not None:
+            workflow.allocation["cpus"] = format_cpu_set(cpus)
+        elif self._free_cpus is not None:
+            workflow.allocation["cpus"] = "not pinned, too few free cpus"
+        if self.nice:
+            workflow.allocation["nice"] = str(self.nice)
+        if self.ionice is not None and self._ioprio_set is not None:
+            workflow.allocation["ionice"] = self.ionice
+        if cgroup is not None:
+            workflow.allocation["cgroup"] = str(cgroup)
+        workflow.preexec = functools.partial(
+            place_process, cpus, self.nice, self._ioprio, self._ioprio_set,
+            str(cgroup / "cgroup.procs") if cgroup is not None else None)
+
+    def release(self, workflow: "Workflow"):
+        """Returns the cpus of a finished workflow and removes its cgroup."""
+        cpus = self._cpus.pop(workflow, None)
+        if cpus is not None and self._free_cpus is not None:
+            self._free_cpus.update(cpus)
+        cgroup = self._cgroups.pop(workflow, None)
+        if cgroup is not None:
+            try:
+                cgroup.rmdir()
+            except OSError:
+                # Processes of the workflow that outlived it are still in
+                # the cgroup.
+                warnings.warn(f"Could not remove cgroup '{cgroup}'.")
+
+    def _claim_cpus(self, workflow: "Workflow") -> Optional[Set[int]]:
+        # A workflow that does not fit in the free cpus, for instance because
+        # it claims more cpus than the machine has, is not pinned rather than
+        # squeezed on too few cpus.
+        if (self._free_cpus is None or
+                len(self._free_cpus) < max(workflow.cpus, 1)):
+            return None
+        cpus = set(sorted(self._free_cpus)[:max(workflow.cpus, 1)])
+        self._free_cpus.difference_update(cpus)
+        self._cpus[workflow] = cpus
+        return cpus
+
+    def _create_cgroup(self, workflow: "Workflow") -> Optional[Path]:
+        if not self._cgroups_enabled or self.cgroup_root is None:
+            return None
+        cgroup = self.cgroup_root / replace_whitespace(
+            f"workflow-{os.getpid()}-{workflow.name}", "_").replace("/", "_")
+        try:
+            # The controllers have to be enabled for the children of the
+            # root before the children can use them.
+            (self.cgroup_root / "cgroup.subtree_control").write_text(
+                "+cpu +io")
+            cgroup.mkdir()
+            (cgroup / "cpu.max").write_text(
+                f"{max(workflow.cpus, 1) * CPU_MAX_PERIOD} {CPU_MAX_PERIOD}")
+            (cgroup / "io.weight").write_text(f"default {self.io_weight}")
+        except OSError as error:
+            warnings.warn(f"Could not create a cgroup in "
+                          f"'{self.cgroup_root}': {error}. Workflows are run "
+                          f"without cgroups.")
+            self._cgroups_enabled = False
+            with contextlib.suppress(OSError):
+                cgroup.rmdir()
+            return None
+        self._cgroups[workflow] = cgroup
+        return cgroup
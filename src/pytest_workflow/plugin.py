@@ -16,23 +16,43 @@
 
 """core functionality of pytest-workflow plugin"""
 import argparse
+import collections
+import functools
+import json
 import os
+import queue
+import resource
 import shutil
+import socket
 import tempfile
+import threading
 import warnings
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 import pytest
 
 import yaml
 
+from . import hooks
+from .batch import BatchExecutor
 from .content_tests import ContentTestCollector
 from .file_tests import FileTestCollector
-from .schema import WorkflowTest, workflow_tests_from_schema
+from .history import PerformanceBaseline, WorkflowHistory
+from .placement import DEFAULT_IO_WEIGHT, Placement
+from .progress import ProgressReporter
+from .resource_tests import (BASELINE_METRICS, BaselineComparisonTest,
+                             RESOURCE_METRICS, ResourceUsageTest)
+from .result_cache import CachingExecutor, ResultCache, workflow_fingerprint
+from .sampling import ResourceSampler
+from .scanner import ContentScanner
+from .schema import ContentTest, WorkflowTest, workflow_tests_from_schema
+from .shared_queue import SharedQueue, SharedQueueExecutor
 from .util import (decode_unaligned, duplicate_tree, is_in_dir,
-                   replace_whitespace)
-from .workflow import Workflow, WorkflowQueue
+                   make_writable, parse_group_limit, parse_memory,
+                   parse_shard, replace_whitespace)
+from .workflow import (Executor, LocalExecutor, ResourceUsage, Workflow,
+                       WorkflowQueue)
 
 
 def pytest_addoption(parser: pytest.Parser):
@@ -56,6 +76,268 @@ def pytest_addoption(parser: pytest.Parser):
         default=1,
         type=int,
         help="The number of workflows to run simultaneously.")
+    parser.addoption(
+        "--workflow-cpus",
+        dest="workflow_cpus",
+        type=int,
+        help="The number of cpus that simultaneously running workflows may "
+             "use together. Workflows claim cpus with the 'cpus' key in "
+             "their 'resources'. Default: no limit.")
+    parser.addoption(
+        "--workflow-memory",
+        dest="workflow_memory",
+        type=parse_memory,
+        help="The memory that simultaneously running workflows may use "
+             "together. In bytes or with a K, M, G or T suffix. Workflows "
+             "claim memory with the 'memory' key in their 'resources'. "
+             "Default: no limit.")
+    parser.addoption(
+        "--workflow-group-limit",
+        dest="workflow_group_limits",
+        type=parse_group_limit,
+        action="append",
+        default=[],
+        metavar="GROUP=N",
+        help="Run at most N workflows of the concurrency group GROUP at the "
+             "same time. Workflows join groups with the 'concurrency_group' "
+             "key. Groups without a limit run one workflow at a time. Can be "
+             "used multiple times.")
+    parser.addoption(
+        "--workflow-retries",
+        dest="workflow_retries",
+        type=int,
+        default=0,
+        help="How many times a workflow that fails is run again in a fresh "
+             "directory. The 'retries' key in the YAML takes precedence. "
+             "Default: 0.")
+    parser.addoption(
+        "--workflow-retry-alone",
+        dest="workflow_retry_alone",
+        action="store_true",
+        help="Retry failed workflows when no other workflows are running, "
+             "for failures caused by a busy machine.")
+    parser.addoption(
+        "--workflow-shard",
+        dest="workflow_shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="Only run shard I of N shards of the workflows, for instance "
+             "to split the test suite over N CI jobs. The workflows are "
+             "divided so each shard takes about as long, based on their "
+             "durations in earlier sessions. Workflows connected through "
+             "depends_on are in the same shard. Tests that do not belong "
+             "to a workflow are run in the first shard.")
+    parser.addoption(
+        "--workflow-timeout",
+        dest="workflow_timeout",
+        type=float,
+        help="The number of seconds a workflow may run before it is "
+             "terminated. The 'timeout' key in the YAML takes precedence. "
+             "Default: no timeout.")
+    parser.addoption(
+        "--workflow-stall-timeout",
+        dest="workflow_stall_timeout",
+        type=float,
+        help="The number of seconds the logs, the files in the directory "
+             "and the cpu time of a workflow may stay the same. When a "
+             "workflow makes no progress for longer, the state of its "
+             "processes is reported and it is terminated. The "
+             "'stall_timeout' key in the YAML takes precedence. Default: "
+             "workflows are not watched.")
+    parser.addoption(
+        "--workflow-fail-fast",
+        dest="workflow_fail_fast",
+        action="store_true",
+        help="Stop starting new workflows after the first workflow did not "
+             "exit with its desired exit code. The workflows that were not "
+             "started are skipped. When -x or --maxfail is used, the queue "
+             "is stopped after that many workflows failed.")
+    parser.addoption(
+        "--workflow-terminate-on-fail",
+        dest="workflow_terminate_on_fail",
+        action="store_true",
+        help="When the workflow queue is stopped because of a failure, also "
+             "terminate the workflows that are still running. Implies "
+             "--workflow-fail-fast.")
+    parser.addoption(
+        "--workflow-progress",
+        dest="workflow_progress",
+        type=float,
+        metavar="SECONDS",
+        help="Report the progress of the workflows every SECONDS seconds: "
+             "the number of running, queued and finished workflows, the "
+             "estimated remaining time and, per running workflow, its "
+             "elapsed time and the size and growth of its logs and "
+             "directory. Default: no progress reports.")
+    parser.addoption(
+        "--workflow-sample-interval",
+        dest="workflow_sample_interval",
+        type=float,
+        metavar="SECONDS",
+        help="Sample the cpu, memory and storage use of the processes of "
+             "each running workflow every SECONDS seconds from /proc. The "
+             "peak and average are shown when a workflow fails and the "
+             "samples are written to --workflow-report. Only on Linux. "
+             "Default: no sampling.")
+    parser.addoption(
+        "--workflow-report",
+        dest="workflow_report",
+        type=Path,
+        metavar="FILE",
+        help="Write a JSON report with the status, duration, earlier "
+             "attempts, placement and samples of each workflow to FILE.")
+    parser.addoption(
+        "--workflow-pin-cpus",
+        dest="workflow_pin_cpus",
+        action="store_true",
+        help="Give each running workflow its own cpus, as many as it claims "
+             "with the 'cpus' key in its 'resources'. The cpus of running "
+             "workflows do not overlap. Workflows for which not enough cpus "
+             "are free are not pinned.")
+    parser.addoption(
+        "--workflow-nice",
+        dest="workflow_nice",
+        type=int,
+        help="Run the workflows with this increment of their nice level.")
+    parser.addoption(
+        "--workflow-ionice",
+        dest="workflow_ionice",
+        metavar="CLASS[:LEVEL]",
+        help="Run the workflows with this I/O scheduling class: 'idle', "
+             "'best-effort' or 'realtime'. The latter two take an optional "
+             "level from 0 to 7, for example 'best-effort:7'.")
+    parser.addoption(
+        "--workflow-cgroup",
+        dest="workflow_cgroup",
+        type=Path,
+        metavar="DIR",
+        help="A cgroup v2 directory that is delegated to the user running "
+             "pytest. Each workflow is run in a cgroup in DIR with a "
+             "cpu.max of the cpus it claims and an io.weight of "
+             "--workflow-io-weight.")
+    parser.addoption(
+        "--workflow-io-weight",
+        dest="workflow_io_weight",
+        type=int,
+        default=DEFAULT_IO_WEIGHT,
+        help=f"The io.weight of the cgroups of the workflows, from 1 to "
+             f"10000. Default: {DEFAULT_IO_WEIGHT}.")
+    parser.addoption(
+        "--workflow-executor",
+        dest="workflow_executor",
+        choices=["local", "batch"],
+        default="local",
+        help="Where the workflows are run. 'local' runs them as processes on "
+             "this machine. 'batch' submits them to a batch scheduler with "
+             "--workflow-submit-command. Default: local.")
+    parser.addoption(
+        "--workflow-submit-command",
+        dest="workflow_submit_command",
+        help="The command that submits a job script to the batch scheduler, "
+             "for example 'sbatch --parsable -c {cpus} {script}'. The last "
+             "word it prints is used as the job id.")
+    parser.addoption(
+        "--workflow-poll-command",
+        dest="workflow_poll_command",
+        help="A command that exits with a non-zero exit code when the "
+             "scheduler no longer knows the job, for example "
+             "'squeue -h -j {job_id}'. Used to detect jobs that were removed "
+             "by the scheduler. Default: only the exit code of the job is "
+             "checked.")
+    parser.addoption(
+        "--workflow-cancel-command",
+        dest="workflow_cancel_command",
+        help="The command that cancels a job, for example "
+             "'scancel {job_id}'. Needed to terminate jobs on timeouts, "
+             "abort patterns and fail-fast.")
+    parser.addoption(
+        "--workflow-poll-interval",
+        dest="workflow_poll_interval",
+        type=float,
+        default=5.0,
+        help="The number of seconds between checks whether the submitted "
+             "jobs have finished. Default: 5.")
+    parser.addoption(
+        "--workflow-result-cache",
+        dest="workflow_result_cache",
+        type=Path,
+        metavar="DIR",
+        help="Store the outputs, logs and exit code of workflows that "
+             "succeeded in DIR. A workflow of which the YAML definition and "
+             "input files did not change is restored from the cache instead "
+             "of being run. The directory can be shared by concurrent "
+             "sessions. Default: no result cache.")
+    parser.addoption(
+        "--workflow-result-cache-size",
+        dest="workflow_result_cache_size",
+        type=parse_memory,
+        default="10G",
+        help="The maximum size of the result cache. In bytes or with a K, M, "
+             "G or T suffix. The least recently used results are removed "
+             "first. Default: 10G.")
+    parser.addoption(
+        "--workflow-cache-env",
+        dest="workflow_cache_env",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="An environment variable that influences the workflows, such "
+             "as PATH. Workflows are only restored from the result cache "
+             "when the variable has the same value. Can be used multiple "
+             "times.")
+    parser.addoption(
+        "--workflow-shared-queue",
+        dest="workflow_shared_queue",
+        type=Path,
+        metavar="DIR",
+        help="Share the workflows with other sessions that run the same "
+             "tests with the same DIR, for instance on other machines with "
+             "a shared file system. Each workflow is run by the session that "
+             "claims it first and its result is published in DIR. The other "
+             "sessions skip it. Requires --workflow-shared-queue-run. "
+             "Default: no shared queue.")
+    parser.addoption(
+        "--workflow-shared-queue-run",
+        dest="workflow_shared_queue_run",
+        metavar="RUN",
+        help="The run of the test suite the sessions of the shared queue "
+             "belong to, for instance the id of a CI pipeline. Sessions only "
+             "share workflows and results with sessions of the same run.")
+    parser.addoption(
+        "--workflow-shared-queue-wait",
+        dest="workflow_shared_queue_wait",
+        action="store_true",
+        help="Wait for the results of the workflows that other sessions run "
+             "and run their tests in this session instead of skipping them. "
+             "Use this on one session to collect all results.")
+    parser.addoption(
+        "--workflow-node-name",
+        dest="workflow_node_name",
+        default=f"{socket.gethostname()}:{os.getpid()}",
+        metavar="NAME",
+        help="The name of this session in the shared queue. Default: the "
+             "host name and process id.")
+    parser.addoption(
+        "--workflow-perf-baseline",
+        dest="workflow_perf_baseline",
+        choices=["save", "compare"],
+        help="'save' stores the CPU and wall time of each successful "
+             "workflow as its performance baseline. 'compare' adds tests "
+             "that fail when a workflow is more than "
+             "--workflow-perf-tolerance percent slower than its baseline.")
+    parser.addoption(
+        "--workflow-perf-baseline-file",
+        dest="workflow_perf_baseline_file",
+        type=Path,
+        help="A JSON file to store the performance baseline in. Default: "
+             "the baseline is stored in pytest's cache.")
+    parser.addoption(
+        "--workflow-perf-tolerance",
+        dest="workflow_perf_tolerance",
+        type=float,
+        default=20.0,
+        help="The percentage a workflow may be slower than its baseline. "
+             "Default: 20.")
     parser.addoption(
         "--symlink", action="store_true",
         help="Instead of copying the current working directory, create a "
@@ -103,6 +385,26 @@ def pytest_addoption(parser: pytest.Parser):
     )
 
 
+def pytest_addhooks(pluginmanager: pytest.PytestPluginManager):
+    pluginmanager.add_hookspecs(hooks)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_workflow_executor(config: pytest.Config) -> Executor:
+    """Creates the executor that is selected with --workflow-executor."""
+    if config.getoption("workflow_executor") == "batch":
+        submit_command = config.getoption("workflow_submit_command")
+        if submit_command is None:
+            raise ValueError("--workflow-submit-command is required with "
+                             "--workflow-executor batch.")
+        return BatchExecutor(
+            submit_command,
+            poll_command=config.getoption("workflow_poll_command"),
+            cancel_command=config.getoption("workflow_cancel_command"),
+            poll_interval=config.getoption("workflow_poll_interval"))
+    return LocalExecutor()
+
+
 def __pytest_workflow_cli():  # pragma: no cover
     """Helper function for showing all pytest-workflow specific options in the
     documentation with sphinx argparse. The ArgParser class bypasses any
@@ -147,14 +449,49 @@ def pytest_configure(config: pytest.Config):
     workflow_queue = WorkflowQueue()
     setattr(config, "workflow_queue", workflow_queue)
 
+    # Durations of earlier sessions are used to start the longest workflows
+    # first. The cache is not available when the cacheprovider plugin is
+    # disabled.
+    setattr(config, "workflow_history",
+            WorkflowHistory(getattr(config, "cache", None)))
+    setattr(config, "workflow_perf_baseline",
+            PerformanceBaseline(
+                getattr(config, "cache", None),
+                config.getoption("workflow_perf_baseline_file")))
+
     # Save which workflows are run and which are not.
     executed_workflows: Dict[str, str] = {}
     setattr(config, "executed_workflows", executed_workflows)
 
+    # The workflow objects by name. Used to look up the workflow of custom
+    # tests.
+    workflows: Dict[str, Workflow] = {}
+    setattr(config, "workflows", workflows)
+
+    # The workflows that are run when only a shard of them is run. None
+    # means all workflows are run.
+    workflow_selection: Optional[List[Workflow]] = None
+    setattr(config, "workflow_selection", workflow_selection)
+
+    # The share of the workflows each workflow belongs to on a pytest-xdist
+    # worker. The workflows of a share run at the same time.
+    workflow_shares: Dict[str, int] = {}
+    setattr(config, "workflow_shares", workflow_shares)
+
     # Save workflow for cleanup in this var.
     workflow_cleanup_dirs: List[str] = []
     setattr(config, "workflow_cleanup_dirs", workflow_cleanup_dirs)
 
+    # Sections of the terminal summary with a line per workflow, such as
+    # the status of the setup workflows. Form: section -> [(name, line)]
+    workflow_summary: Dict[str, List[Tuple[str, str]]] = {}
+    setattr(config, "workflow_summary", workflow_summary)
+
+    # The entries of the workflows in the JSON report, including the ones
+    # sent by the pytest-xdist workers.
+    workflow_report: List[Dict[str, Any]] = []
+    setattr(config, "workflow_report", workflow_report)
+
     # When multiple workflows are started they should all be set in the same
     # temporary directory
     # Running in a temporary directory will prevent the project repository
@@ -186,6 +523,96 @@ def pytest_configure(config: pytest.Config):
 
     setattr(config, "workflow_temp_dir", workflow_temp_dir)
 
+    executor: Executor = config.hook.pytest_workflow_executor(config=config)
+    setattr(config, "workflow_placement",
+            workflow_placement(config, executor))
+    result_cache_dir = config.getoption("workflow_result_cache")
+    if result_cache_dir is not None:
+        # pytest's cache is copied along with the project, but it changes in
+        # every session.
+        pytest_cache_dir = Path(config.rootpath, config.getini("cache_dir"))
+        result_cache = ResultCache(
+            result_cache_dir, config.getoption("workflow_result_cache_size"),
+            ignore=([pytest_cache_dir.relative_to(config.rootpath).as_posix()]
+                    if is_in_dir(pytest_cache_dir, config.rootpath) else []))
+        executor = CachingExecutor(executor, result_cache)
+    shared_queue_dir = config.getoption("workflow_shared_queue")
+    if shared_queue_dir is not None:
+        shared_queue_run = config.getoption("workflow_shared_queue_run")
+        if not shared_queue_run:
+            raise ValueError("--workflow-shared-queue requires "
+                             "--workflow-shared-queue-run, so the results of "
+                             "earlier runs are not used.")
+        executor = SharedQueueExecutor(
+            executor,
+            SharedQueue(shared_queue_dir, shared_queue_run,
+                        config.getoption("workflow_node_name")),
+            wait=config.getoption("workflow_shared_queue_wait"))
+    setattr(config, "workflow_executor", executor)
+
+    # A workflow and all its tests must run on the same pytest-xdist worker.
+    # The workers put the tests of each workflow in an xdist_group, which is
+    # only honoured by the loadgroup distribution mode.
+    if is_xdist_controller(config):
+        dist = config.getoption("dist")
+        if dist not in ("load", "loadgroup", "each"):
+            warnings.warn(
+                f"pytest-workflow uses '--dist loadgroup' instead of "
+                f"'--dist {dist}' to keep the tests of a workflow on the "
+                f"worker that runs the workflow.")
+        if dist != "each":
+            config.option.dist = "loadgroup"
+
+
+def workflow_placement(config: pytest.Config,
+                       executor: Executor) -> Optional[Placement]:
+    """
+    Returns the placement of the workflows on this machine with the options
+    from the command line. None when no placement options are used.
+    :param config: The pytest config
+    :param executor: The executor that runs the workflows
+    """
+    pin_cpus = config.getoption("workflow_pin_cpus")
+    nice = config.getoption("workflow_nice")
+    ionice = config.getoption("workflow_ionice")
+    cgroup_root = config.getoption("workflow_cgroup")
+    if not (pin_cpus or nice or ionice or cgroup_root):
+        return None
+    if not isinstance(executor, LocalExecutor):
+        warnings.warn("The workflow placement options only apply to "
+                      "workflows that run as local processes. They are not "
+                      "used.")
+        return None
+    cpus: Optional[List[int]] = None
+    if pin_cpus:
+        if not hasattr(os, "sched_getaffinity"):
+            raise ValueError("--workflow-pin-cpus is only supported on "
+                             "Linux.")
+        cpus = sorted(os.sched_getaffinity(0))
+        # The pytest-xdist workers on this machine each get a part of the
+        # cpus, so their workflows do not share cpus either.
+        if is_xdist_worker(config):
+            worker = int(config.workerinput["workerid"][2:])  # type: ignore
+            workers = config.workerinput["workercount"]  # type: ignore
+            cpus = cpus[worker * len(cpus) // workers:
+                        (worker + 1) * len(cpus) // workers]
+    return Placement(cpus=cpus, nice=nice, ionice=ionice,
+                     cgroup_root=cgroup_root,
+                     io_weight=config.getoption("workflow_io_weight"))
+
+
+def is_xdist_worker(config: pytest.Config) -> bool:
+    """Whether this process is a pytest-xdist worker."""
+    return hasattr(config, "workerinput")
+
+
+def is_xdist_controller(config: pytest.Config) -> bool:
+    """Whether this process distributes the tests over pytest-xdist
+    workers."""
+    return (config.pluginmanager.hasplugin("xdist") and
+            config.getoption("dist", "no") != "no" and
+            not is_xdist_worker(config))
+
 
 def pytest_collection():
     """This function is started at the beginning of collection"""
@@ -240,38 +667,459 @@ def pytest_generate_tests(metafunc: pytest.Metafunc):
                          ids=workflow_names)
 
 
+def get_workflow_name_from_item(item: pytest.Item) -> Optional[str]:
+    """Returns the name of the workflow a custom test belongs to or None if
+    it is not marked with the workflow marker."""
+    marker: Optional[pytest.Mark] = item.get_closest_marker("workflow")
+
+    if marker is None:
+        return None
+
+    workflow_names = get_workflow_names_from_workflow_marker(marker)
+    if len(workflow_names) == 1:
+        return workflow_names[0]
+    elif "workflow_dir" in item.fixturenames:  # type: ignore
+        # workflow_dir is parametrized with the directories of the workflows
+        # in the order of the marker. The name of the test is not parsed,
+        # because workflow names, such as those of matrix variants, and
+        # other parameters can contain brackets.
+        callspec = item.callspec  # type: ignore
+        return workflow_names[callspec.indices["workflow_dir"]]
+    else:
+        raise NotImplementedError(f"Cannot determine workflow name for "
+                                  f"{item.nodeid}")
+
+
+def get_workflow_from_item(item: pytest.Item) -> Optional[Workflow]:
+    """Returns the workflow that a test of a YAML file or a custom test
+    belongs to, or None if it does not belong to a queued workflow."""
+    collector = item.getparent(WorkflowTestsCollector)
+    if collector is not None:
+        workflow_name: Optional[str] = collector.workflow_test.name
+    else:
+        workflow_name = get_workflow_name_from_item(item)
+    if workflow_name is None:
+        return None
+    return item.config.workflows.get(workflow_name)  # type: ignore
+
+
+def workflow_groups(workflows: Dict[str, Workflow]) -> Dict[str, str]:
+    """
+    Groups workflows that are connected through depends_on, because a
+    workflow can only run on the worker that ran its dependencies.
+    :param workflows: The workflows by name in collection order
+    :return: The name of the first collected workflow of its group for each
+    workflow name.
+    """
+    order = {name: index for index, name in enumerate(workflows)}
+    group = {name: name for name in workflows}
+
+    def find(name: str) -> str:
+        while group[name] != name:
+            name = group[name]
+        return name
+
+    for workflow in workflows.values():
+        for dependency in workflow.depends_on:
+            if dependency not in group:
+                continue
+            first, second = sorted((find(workflow.name), find(dependency)),
+                                   key=order.__getitem__)
+            group[second] = first
+    return {name: find(name) for name in workflows}
+
+
+def assign_shards(weights: Dict[str, float], shards: int) -> Dict[str, int]:
+    """
+    Divides groups of workflows over shards so the shards take about as
+    long. The longest group is assigned first, to the shard with the least
+    work so far. This is longest-processing-time-first scheduling. The
+    result only depends on the weights and their order, so every job that
+    runs a shard divides the groups in the same way.
+    :param weights: The estimated duration of each group in collection order
+    :param shards: The number of shards
+    :return: The shard of each group, numbered from 1
+    """
+    order = {group: index for index, group in enumerate(weights)}
+    loads = [0.0] * shards
+    assignment = {}
+    for group in sorted(weights, key=lambda group: (-weights[group],
+                                                    order[group])):
+        shard = loads.index(min(loads))
+        loads[shard] += weights[group]
+        assignment[group] = shard + 1
+    return assignment
+
+
+def divide_workflows(workflows: Dict[str, Workflow],
+                     shards: int) -> Dict[str, int]:
+    """
+    Divides the workflows over shards by their estimated durations. Workflows
+    that are connected through depends_on are in the same shard. Without
+    durations of earlier sessions the shards get about the same number of
+    workflows.
+    :param workflows: The workflows by name in collection order
+    :param shards: The number of shards
+    :return: The shard of each workflow, numbered from 1
+    """
+    groups = workflow_groups(workflows)
+    known = any(workflow.estimated_duration for workflow in workflows.values())
+    weights: Dict[str, float] = {}
+    for name, workflow in workflows.items():
+        weights[groups[name]] = weights.get(groups[name], 0.0) + (
+            workflow.estimated_duration if known else 1.0)
+    assignment = assign_shards(weights, shards)
+    return {name: assignment[groups[name]] for name in workflows}
+
+
+def select_shard(config: pytest.Config, items: List[pytest.Function],
+                 shard: int, shards: int):
+    """Deselects the tests of the workflows that are not in the shard and
+    selects the workflows that are."""
+    workflows: Dict[str, Workflow] = config.workflows  # type: ignore
+    assignment = divide_workflows(workflows, shards)
+    selection = [workflow for name, workflow in workflows.items()
+                 if assignment[name] == shard]
+    setattr(config, "workflow_selection", selection)
+    selected, deselected = [], []
+    for item in items:
+        item_workflow = get_workflow_from_item(item)
+        if (item_workflow in selection if item_workflow is not None
+                else shard == 1):
+            selected.append(item)
+        else:
+            deselected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def pytest_report_collectionfinish(config: pytest.Config) -> Optional[str]:
+    """Reports the part of the workflows that is in the shard."""
+    shard = config.getoption("workflow_shard")
+    selection: Optional[List[Workflow]] = (
+        config.workflow_selection)  # type: ignore
+    if shard is None or selection is None:
+        return None
+    workflows: Dict[str, Workflow] = config.workflows  # type: ignore
+    estimate = sum(workflow.estimated_duration for workflow in selection)
+    total = sum(workflow.estimated_duration
+                for workflow in workflows.values())
+    return (f"workflow shard {shard[0]}/{shard[1]}: {len(selection)} of "
+            f"{len(workflows)} workflows, estimated {estimate:.1f} of "
+            f"{total:.1f} seconds")
+
+
+# tryfirst, so the xdist_group markers are added before pytest-xdist uses
+# them.
+@pytest.hookimpl(tryfirst=True)
 def pytest_collection_modifyitems(config: pytest.Config,
                                   items: List[pytest.Function]):
     """Here we skip all tests related to workflows that are not executed"""
 
     for item in items:
-        marker: Optional[pytest.Mark] = item.get_closest_marker("workflow")
+        workflow_name = get_workflow_name_from_item(item)
 
-        if marker is None:
+        if workflow_name is None:
             continue
 
-        workflow_names = get_workflow_names_from_workflow_marker(marker)
-        if len(workflow_names) == 1:
-            workflow_name = workflow_names[0]
-        elif "workflow_dir" in item.fixturenames:
-            # nodeid looks like test_bla.py::test_bla[parametrizedvalue]
-            # this parametrizedvalue should be the workflow name.
-            workflow_name = item.nodeid.split('[')[-1].strip(']')
-        else:
-            raise NotImplementedError(f"Cannot determine workflow name for "
-                                      f"{item.nodeid}")
-
         if workflow_name not in config.executed_workflows.keys():  # type: ignore  # noqa: E501
             skip_marker = pytest.mark.skip(
                 reason=f"'{workflow_name}' has not run.")
             item.add_marker(skip_marker)
 
+    shard = config.getoption("workflow_shard")
+    if shard is not None:
+        select_shard(config, items, *shard)
+
+    executor: Executor = config.workflow_executor  # type: ignore
+    if isinstance(executor, SharedQueueExecutor):
+        # Workflows are claimed with the workflows they are connected to.
+        executor.shared_queue.groups = workflow_groups(
+            config.workflows)  # type: ignore
+
+    if (is_xdist_worker(config) and
+            config.workerinput.get("workflow_groups")):  # type: ignore
+        # The workers parse the command line themselves, so they do not know
+        # the controller switched to loadgroup.
+        config.option.loadgroup = True
+        # The workflows are divided into one share per worker, so a worker
+        # can run all workflows of its share at once. Every worker divides
+        # them in the same way. Each share is an xdist_group, so all its
+        # tests are sent to the same worker.
+        selection: Optional[List[Workflow]] = (
+            config.workflow_selection)  # type: ignore
+        workflows: Dict[str, Workflow] = (
+            config.workflows if selection is None  # type: ignore
+            else {workflow.name: workflow for workflow in selection})
+        shares = divide_workflows(
+            workflows, config.workerinput["workercount"])  # type: ignore
+        config.workflow_shares.update(shares)  # type: ignore
+        for item in items:
+            workflow = get_workflow_from_item(item)
+            if workflow is not None and workflow.name in shares:
+                item.add_marker(pytest.mark.xdist_group(
+                    f"workflows-{shares[workflow.name]}"))
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    """Tells a pytest-xdist worker whether to group the tests by workflow."""
+    node.workerinput["workflow_groups"] = (
+        node.config.getoption("dist") == "loadgroup")
+
+
+def pytest_runtest_setup(item: pytest.Item):
+    """Runs the workflows of the share of a test on a pytest-xdist worker if
+    they have not run yet. Skips custom tests of workflows that were skipped,
+    for instance because a workflow they depend on failed."""
+    workflow = get_workflow_from_item(item)
+    if workflow is None:
+        return
+    workflow_queue: WorkflowQueue = item.config.workflow_queue  # type: ignore
+    if is_xdist_worker(item.config) and workflow in workflow_queue.queue:
+        shares: Dict[str, int] = item.config.workflow_shares  # type: ignore
+        share = shares.get(workflow.name)
+        workflows: Dict[str, Workflow] = item.config.workflows  # type: ignore
+        process_workflow_queue(
+            item.config,
+            [workflow] if share is None else
+            [workflows[name] for name, workflow_share in shares.items()
+             if workflow_share == share])
+    if workflow.skip_reason is not None:
+        pytest.skip(workflow.skip_reason)
+
+
+def pytest_runtestloop(session: pytest.Session) -> Optional[bool]:
+    """Runs the workflows and runs the tests of each workflow as soon as it
+    has finished, while the other workflows keep running."""
+    # A pytest-xdist worker only runs the workflows of the tests it is
+    # given, when the first of their tests is set up. The controller does not
+    # collect, so its queue is empty. Collection errors and --collect-only
+    # are handled by pytest's own loop.
+    if (is_xdist_worker(session.config) or
+            session.config.option.collectonly or
+            (session.testsfailed and
+             not session.config.option.continue_on_collection_errors)):
+        return None
+    workflow_queue: WorkflowQueue = session.config.workflow_queue  # type: ignore  # noqa: E501
+    items_by_workflow: Dict[Workflow, List[pytest.Item]] = {}
+    # Tests that do not belong to a workflow are run first.
+    pending: Deque[pytest.Item] = collections.deque()
+    for item in session.items:
+        workflow = get_workflow_from_item(item)
+        if workflow is None:
+            pending.append(item)
+        else:
+            items_by_workflow.setdefault(workflow, []).append(item)
+
+    # The queue is processed in a thread. Its messages are printed by this
+    # thread in between tests, otherwise they would end up in the captured
+    # output of the test that is running.
+    events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+    errors: List[BaseException] = []
+
+    def process():
+        try:
+            process_workflow_queue(
+                session.config,
+                workflows=session.config.workflow_selection,  # type: ignore
+                on_finished=lambda workflow: events.put(
+                    ("finished", workflow)))
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            events.put(("stopped", None))
+
+    terminal_reporter = session.config.pluginmanager.get_plugin(
+        "terminalreporter")
+    # The terminal reporter starts a new line when a test result is shown.
+    write_line = (print if terminal_reporter is None
+                  else terminal_reporter.write_line)
+
+    def handle(event: Tuple[str, Any]) -> bool:
+        """Handles an event. Returns whether the queue has stopped."""
+        kind, value = event
+        if kind == "message":
+            write_line(value)
+        elif kind == "finished":
+            if value.errors:
+                # Python errors, such as an unparsable command, stop the
+                # session instead of being reported by the tests.
+                raise value.errors[0]
+            pending.extend(items_by_workflow.pop(value, []))
+        return kind == "stopped"
+
+    workflow_queue.report = lambda message: events.put(("message", message))
+    thread = threading.Thread(target=process, daemon=True)
+    thread.start()
+    stopped = False
+    try:
+        while pending or not stopped:
+            if not pending and not stopped:
+                stopped = handle(events.get())
+                continue
+            # Handle the workflows that finished in the meantime, so the next
+            # test is known. Fixtures that the next test also uses are kept.
+            while not stopped:
+                try:
+                    stopped = handle(events.get_nowait())
+                except queue.Empty:
+                    break
+            if stopped:
+                # Tests of workflows that never reported.
+                for items in items_by_workflow.values():
+                    pending.extend(items)
+                items_by_workflow.clear()
+            if not pending:
+                continue
+            item = pending.popleft()
+            if pending:
+                nextitem: Optional[pytest.Item] = pending[0]
+            else:
+                # The next test is not known yet. Only keep the fixtures that
+                # all tests that are still to run have in common.
+                nextitem = furthest_item(
+                    item, [remaining for items in items_by_workflow.values()
+                           for remaining in items])
+            item.config.hook.pytest_runtest_protocol(item=item,
+                                                     nextitem=nextitem)
+            if session.shouldfail:
+                raise session.Failed(session.shouldfail)
+            if session.shouldstop:
+                raise session.Interrupted(session.shouldstop)
+    except BaseException:
+        workflow_queue.cancel("the test session was stopped")
+        raise
+    finally:
+        thread.join()
+        workflow_queue.report = print
+        # Print the messages that were not printed yet.
+        while not events.empty():
+            kind, value = events.get_nowait()
+            if kind == "message":
+                write_line(value)
+    if errors:
+        raise errors[0]
+    return True
+
+
+def furthest_item(item: pytest.Item, candidates: List[pytest.Item]
+                  ) -> Optional[pytest.Item]:
+    """
+    Returns the candidate that has the fewest collectors in common with the
+    item, such as the module or the class. When it is passed as nextitem, the
+    fixtures that are torn down after the item are exactly those that are not
+    shared by all candidates.
+    :return: A candidate or None if there are no candidates.
+    """
+    chain = item.listchain()
 
-def pytest_runtestloop(session: pytest.Session):
-    """This runs after collection, but before the tests."""
-    session.config.workflow_queue.process(  # type: ignore
-        session.config.getoption("workflow_threads")
-    )
+    def shared(candidate: pytest.Item) -> int:
+        number = 0
+        for own, other in zip(chain, candidate.listchain()):
+            if own is not other:
+                break
+            number += 1
+        return number
+
+    return min(candidates, key=shared, default=None)
+
+
+def process_workflow_queue(
+        config: pytest.Config,
+        workflows: Optional[List[Workflow]] = None,
+        on_finished: Optional[Callable[[Workflow], None]] = None):
+    """
+    Runs the queued workflows with the options from the command line and
+    records the durations of the workflows that succeeded.
+    :param config: The pytest config
+    :param workflows: Only run these workflows and their dependencies. None
+    means all queued workflows are run.
+    :param on_finished: Called with each workflow that has finished.
+    """
+    workflow_queue: WorkflowQueue = config.workflow_queue  # type: ignore
+    terminate_on_failure = config.getoption("workflow_terminate_on_fail")
+    # All tests are run after the workflows have finished. Without stopping
+    # the queue -x and --maxfail would only take effect after every workflow
+    # has run.
+    max_failures: Optional[int] = config.getoption("maxfail") or None
+    if max_failures is None and (
+            config.getoption("workflow_fail_fast") or terminate_on_failure):
+        max_failures = 1
+    number_of_threads = config.getoption("workflow_threads")
+    progress_interval = config.getoption("workflow_progress")
+    progress_reporter = (
+        ProgressReporter(workflow_queue, progress_interval,
+                         slots=number_of_threads)
+        if progress_interval else None)
+    sample_interval = config.getoption("workflow_sample_interval")
+    sampler = (ResourceSampler(workflow_queue, sample_interval)
+               if sample_interval else None)
+    finished_before = len(workflow_queue.finished)
+    if progress_reporter is not None:
+        progress_reporter.start()
+    if sampler is not None:
+        sampler.start()
+    try:
+        workflow_queue.process(
+            number_of_threads,
+            cpus=config.getoption("workflow_cpus"),
+            memory=config.getoption("workflow_memory"),
+            max_failures=max_failures,
+            terminate_on_failure=terminate_on_failure,
+            workflows=workflows,
+            executor=config.workflow_executor,  # type: ignore
+            on_finished=on_finished,
+            placement=config.workflow_placement,  # type: ignore
+            group_limits=dict(config.getoption("workflow_group_limits")),
+            retry_alone=config.getoption("workflow_retry_alone")
+        )
+    finally:
+        if progress_reporter is not None:
+            progress_reporter.stop()
+        if sampler is not None:
+            sampler.stop()
+    # Only successful runs are recorded. Failing workflows often stop early,
+    # which would make their estimate too short. Restoring from the result
+    # cache says nothing about how long the workflow runs.
+    for workflow in workflow_queue.finished[finished_before:]:
+        if (workflow.succeeded() and workflow.duration is not None and
+                not workflow.from_cache):
+            record_workflow(config, workflow.name, workflow.duration,
+                            workflow.resource_usage)
+
+
+def record_workflow(config: pytest.Config, name: str, duration: float,
+                    resource_usage: Optional[ResourceUsage]):
+    """Records the duration and, when saving a baseline, the resource usage
+    of a workflow that succeeded."""
+    config.workflow_history.record(name, duration)  # type: ignore
+    if (config.getoption("workflow_perf_baseline") == "save" and
+            resource_usage is not None):
+        config.workflow_perf_baseline.record(  # type: ignore
+            name, resource_usage)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """Runs on the pytest-xdist controller when a worker has finished. The
+    worker sends the workflows it ran, so their durations are saved and
+    their directories cleaned up by the controller."""
+    output = getattr(node, "workeroutput", {}).get("pytest_workflow")
+    if output is None:
+        return
+    for record in output["records"]:
+        resource_usage = record["resource_usage"]
+        record_workflow(node.config, record["name"], record["duration"],
+                        None if resource_usage is None
+                        else ResourceUsage(**resource_usage))
+    node.config.workflow_cleanup_dirs.extend(
+        Path(directory) for directory in output["cleanup_dirs"])
+    for section, lines in output["summary"].items():
+        node.config.workflow_summary.setdefault(section, []).extend(
+            tuple(line) for line in lines)
+    node.config.workflow_report.extend(output["report"])
 
 
 def pytest_collectstart(collector: pytest.Collector):
@@ -291,8 +1139,96 @@ def pytest_collectstart(collector: pytest.Collector):
             )
 
 
+def format_attempt(status: str, duration: Optional[float]) -> str:
+    """Describes how a workflow ended and how long it ran."""
+    if duration is None:
+        return status
+    return f"{status} in {duration:.1f} seconds"
+
+
+def summarize_workflows(config: pytest.Config, workflows: List[Workflow]):
+    """Adds the setup workflows and the workflows that were retried to the
+    terminal summary."""
+    summary: Dict[str, List[Tuple[str, str]]] = (
+        config.workflow_summary)  # type: ignore
+    for workflow in workflows:
+        last_attempt = format_attempt(workflow.status(), workflow.duration)
+        if workflow.setup:
+            summary.setdefault("workflow setup", []).append(
+                (workflow.name, last_attempt))
+        if workflow.attempts:
+            attempts = [format_attempt(status, duration)
+                        for status, duration in workflow.attempts]
+            attempts.append(last_attempt)
+            summary.setdefault("workflow retries", []).append(
+                (workflow.name, "; ".join(
+                    f"attempt {number} {attempt}"
+                    for number, attempt in enumerate(attempts, start=1))))
+
+
+def report_workflows(config: pytest.Config, workflows: List[Workflow]):
+    """Adds the workflows to the JSON report."""
+    report: List[Dict[str, Any]] = config.workflow_report  # type: ignore
+    for workflow in workflows:
+        report.append(dict(
+            name=workflow.name,
+            status=workflow.status(),
+            duration=workflow.duration,
+            attempts=[dict(status=status, duration=duration)
+                      for status, duration in workflow.attempts],
+            allocation=workflow.allocation,
+            run_by=workflow.run_by,
+            samples=workflow.samples.to_dict()))
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus: int,
+                            config: pytest.Config):
+    """Reports the setup workflows separately, because the other workflows
+    depend on them, and all attempts of the workflows that were retried."""
+    summary: Dict[str, List[Tuple[str, str]]] = (
+        config.workflow_summary)  # type: ignore
+    for section, lines in summary.items():
+        terminalreporter.section(section)
+        for name, line in lines:
+            terminalreporter.write_line(f"{name}: {line}")
+
+
 def pytest_sessionfinish(session: pytest.Session, exitstatus: int):
     directories: List[Path] = session.config.workflow_cleanup_dirs  # type: ignore # noqa: E501
+    workflow_queue: WorkflowQueue = session.config.workflow_queue  # type: ignore  # noqa: E501
+    summarize_workflows(session.config, workflow_queue.finished)
+    report_workflows(session.config, workflow_queue.finished)
+    # The directories of setup workflows are only read-only during the
+    # session, so they can be removed or inspected afterwards.
+    for workflow in workflow_queue.finished:
+        if workflow.setup:
+            make_writable(workflow.cwd)
+    if is_xdist_worker(session.config):
+        # The controller saves the durations and decides on the cleanup,
+        # because only it knows whether all tests succeeded.
+        records = [
+            dict(name=workflow.name, duration=workflow.duration,
+                 resource_usage=(None if workflow.resource_usage is None
+                                 else vars(workflow.resource_usage)))
+            for workflow in workflow_queue.finished
+            if workflow.succeeded() and workflow.duration is not None and
+            not workflow.from_cache]
+        session.config.workeroutput["pytest_workflow"] = dict(  # type: ignore  # noqa: E501
+            records=records,
+            cleanup_dirs=[str(directory) for directory in directories],
+            summary=session.config.workflow_summary,  # type: ignore
+            report=session.config.workflow_report)  # type: ignore
+        return
+    report_file: Optional[Path] = session.config.getoption("workflow_report")
+    if report_file is not None:
+        with report_file.open("w") as report_h:
+            json.dump(dict(workflows=session.config.workflow_report),  # type: ignore  # noqa: E501
+                      report_h)
+    if not session.config.getoption("collectonly"):
+        session.config.workflow_history.save()  # type: ignore
+        if session.config.getoption("workflow_perf_baseline") == "save":
+            session.config.workflow_perf_baseline.save()  # type: ignore
+
     # No cleanup needed if there are no directories to cleanup. (I.e.
     # pytest-workflow plugin was not used.)
     if len(directories) == 0:
@@ -322,6 +1258,9 @@ def pytest_sessionfinish(session: pytest.Session, exitstatus: int):
         for directory in directories:
             try:
                 shutil.rmtree(str(directory))
+            except FileNotFoundError:
+                # The workflow was never started.
+                continue
             except PermissionError:
                 unremovable_dirs.append(directory)
         if unremovable_dirs:
@@ -359,7 +1298,10 @@ class WorkflowTestsCollector(pytest.Collector):
         super().__init__(workflow_test.name, parent=parent)
 
         # Attach tags to this node for easier workflow selection
+        # The name of a matrix selects all of its variants.
         self.tags = [self.workflow_test.name] + self.workflow_test.tags
+        if self.workflow_test.matrix_name is not None:
+            self.tags.append(self.workflow_test.matrix_name)
 
     def queue_workflow(self):
         """Creates a temporary directory and add the workflow to the workflow
@@ -400,19 +1342,55 @@ class WorkflowTestsCollector(pytest.Collector):
                 f"will copy the entire .git directory and all files ignored "
                 f"by git. It is recommended to use the --git-aware option.")
         # Copy the project directory to the temporary directory using pytest's
-        # rootdir.
-        duplicate_tree(root_dir, tempdir,
-                       symlink=self.config.getoption("symlink"),
-                       git_aware=git_aware)
-
-        # Create a workflow and make sure it runs in the tempdir
-        workflow = Workflow(command=self.workflow_test.command,
+        # rootdir. This is done right before the workflow starts, so a
+        # pytest-xdist worker only copies it for the workflows it runs.
+        prepare = functools.partial(
+            duplicate_tree, root_dir, tempdir,
+            symlink=self.config.getoption("symlink"), git_aware=git_aware)
+
+        # Create a workflow and make sure it runs in the tempdir. {cpus} in
+        # the command is replaced by the number of cpus the workflow claims,
+        # so it can be passed to options such as --threads.
+        cpus = self.workflow_test.resources.cpus
+        workflow = Workflow(command=self.workflow_test.command.replace(
+                                "{cpus}", str(cpus)),
                             cwd=tempdir,
                             name=self.workflow_test.name,
-                            desired_exit_code=self.workflow_test.exit_code)
+                            desired_exit_code=self.workflow_test.exit_code,
+                            cpus=cpus,
+                            memory=self.workflow_test.resources.memory,
+                            estimated_duration=(
+                                self.config.workflow_history.estimate(
+                                    self.workflow_test.name,
+                                    self.workflow_test.matrix_variants,
+                                    self.workflow_test.matrix_name)),
+                            timeout=self.workflow_test.timeout or
+                            self.config.getoption("workflow_timeout"),
+                            stall_timeout=self.workflow_test.stall_timeout or
+                            self.config.getoption("workflow_stall_timeout"),
+                            limit_threads=(
+                                self.workflow_test.resources.claims_cpus),
+                            depends_on=self.workflow_test.depends_on,
+                            stdout_scanner=self.content_scanner(
+                                self.workflow_test.stdout),
+                            stderr_scanner=self.content_scanner(
+                                self.workflow_test.stderr),
+                            prepare=prepare,
+                            fingerprint=self.fingerprint(),
+                            rlimits=self.rlimits(),
+                            memory_limit=self.workflow_test.limits.memory,
+                            setup=self.workflow_test.setup,
+                            concurrency_groups=(
+                                self.workflow_test.concurrency_groups),
+                            retries=(
+                                self.workflow_test.retries
+                                if self.workflow_test.retries is not None
+                                else self.config.getoption(
+                                    "workflow_retries")))
 
         # Add the workflow to the workflow queue.
         self.config.workflow_queue.put(workflow)
+        self.config.workflows[workflow.name] = workflow
 
         # Add the tempdir to the removal queue. We do not use a teardown method
         # because this will remove the tempdir right after all the tests from
@@ -422,6 +1400,43 @@ class WorkflowTestsCollector(pytest.Collector):
         self.config.workflow_cleanup_dirs.append(tempdir)
         return workflow
 
+    def rlimits(self) -> Dict[int, int]:
+        """The limits of the YAML that are set with setrlimit"""
+        limits = self.workflow_test.limits
+        return {limit: value for limit, value in (
+                    (resource.RLIMIT_AS, limits.address_space),
+                    (resource.RLIMIT_FSIZE, limits.file_size),
+                    (resource.RLIMIT_NOFILE, limits.open_files))
+                if value is not None}
+
+    def fingerprint(self) -> Optional[str]:
+        """Identifies the definition of the workflow in the result cache.
+        None when the result cache is not used."""
+        if self.config.getoption("workflow_result_cache") is None:
+            return None
+        return workflow_fingerprint(
+            self.workflow_test.definition,
+            {name: os.environ.get(name)
+             for name in self.config.getoption("workflow_cache_env")})
+
+    def content_scanner(self, content_test: ContentTest
+                        ) -> Optional[ContentScanner]:
+        """
+        Creates a scanner that searches stdout or stderr while the workflow
+        runs. Returns None when there is nothing to search for, so the stream
+        is written to its log file directly.
+        :param content_test: The tests for stdout or stderr
+        """
+        strings = content_test.contains + content_test.must_not_contain
+        patterns = (content_test.contains_regex +
+                    content_test.must_not_contain_regex)
+        abort_on = self.workflow_test.abort_on
+        if not (strings or patterns or abort_on):
+            return None
+        return ContentScanner(strings=strings, patterns=patterns,
+                              abort_patterns=abort_on,
+                              encoding=content_test.encoding)
+
     def collect(self):
         """This runs the workflow and starts all the associated tests
         The idea is that isolated parts of the yaml get their own collector or
@@ -457,6 +1472,20 @@ class WorkflowTestsCollector(pytest.Collector):
             stderr_encoding=self.workflow_test.stderr.encoding,
         )]
 
+        for metric in RESOURCE_METRICS:
+            maximum = getattr(self.workflow_test, metric)
+            if maximum is not None:
+                tests += [ResourceUsageTest.from_parent(
+                    parent=self, workflow=workflow, metric=metric,
+                    maximum=maximum)]
+
+        if self.config.getoption("workflow_perf_baseline") == "compare":
+            tests += [BaselineComparisonTest.from_parent(
+                parent=self, workflow=workflow, metric=metric,
+                baseline=self.config.workflow_perf_baseline,
+                tolerance=self.config.getoption("workflow_perf_tolerance"))
+                for metric in BASELINE_METRICS]
+
         tests += [
             FileTestCollector.from_parent(
                 parent=self, filetest=filetest, workflow=workflow)
@@ -467,6 +1496,7 @@ class WorkflowTestsCollector(pytest.Collector):
             filepath=workflow.stdout_file,
             content_test=self.workflow_test.stdout,
             workflow=workflow,
+            scanner=workflow.stdout_scanner,
             content_name=f"'{self.workflow_test.name}': stdout")]
 
         tests += [ContentTestCollector.from_parent(
@@ -474,6 +1504,7 @@ class WorkflowTestsCollector(pytest.Collector):
             filepath=workflow.stderr_file,
             content_test=self.workflow_test.stderr,
             workflow=workflow,
+            scanner=workflow.stderr_scanner,
             content_name=f"'{self.workflow_test.name}': stderr")]
 
         return tests
@@ -494,6 +1525,9 @@ class ExitCodeTest(pytest.Item):
 
     def runtest(self):
         # workflow.exit_code waits for workflow to finish.
+        self.workflow.wait()
+        if self.workflow.skip_reason is not None:
+            pytest.skip(self.workflow.skip_reason)
         assert self.workflow.matching_exitcode()
 
     def repr_failure(self, excinfo, style=None):
@@ -511,9 +1545,22 @@ class ExitCodeTest(pytest.Item):
             stderr_text = decode_unaligned(standerr_file.read().strip(),
                                            encoding=self.stderr_encoding)
 
+        output = f"stderr: {stderr_text}\nstdout: {stdout_text}"
+        if self.workflow.samples:
+            output += f"\nresources: {self.workflow.samples.summary()}"
+        if self.workflow.stall_report is not None:
+            output += (f"\nprocesses when it stalled:\n"
+                       f"{self.workflow.stall_report}")
+        if self.workflow.abort_reason is not None:
+            return (
+                f"'{self.workflow.name}' was terminated because "
+                f"{self.workflow.abort_reason}.\n{output}")
+        if self.workflow.timed_out:
+            return (
+                f"'{self.workflow.name}' timed out after "
+                f"{self.workflow.timeout} seconds and was terminated.\n"
+                f"{output}")
         return (
             f"'{self.workflow.name}' exited with exit code " +
             f"'{self.workflow.exit_code}' instead of "
-            f"'{self.workflow.desired_exit_code}'.\n"
-            f"stderr: {stderr_text}\n"
-            f"stdout: {stdout_text}")
+            f"'{self.workflow.desired_exit_code}'.\n{output}")
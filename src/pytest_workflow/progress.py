@@ -0,0 +1,186 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Periodically reports the progress of the workflow queue."""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .util import format_bytes
+from .workflow import Workflow, WorkflowQueue
+
+# A workspace is measured again after this many times as long as its previous
+# measurement took, so walking a large workspace does not take up most of the
+# time of the reporting thread and of the file system.
+WORKSPACE_WALK_FACTOR = 10.0
+
+
+def format_duration(seconds: float) -> str:
+    """Formats a number of seconds as H:MM:SS"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def format_rate(bytes_per_second: float) -> str:
+    """Formats a growth rate with an explicit sign"""
+    sign = "+" if bytes_per_second >= 0 else "-"
+    return f"{sign}{format_bytes(abs(bytes_per_second))}/s"
+
+
+def directory_size(path: Path) -> int:
+    """The total size in bytes of all files in a directory. Symbolic links are
+    not followed. Files that disappear while the directory is scanned are
+    ignored."""
+    size = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        size += directory_size(Path(entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        size += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    continue
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return size
+
+
+class ProgressReporter(object):
+    """Prints the state of the workflow queue at a fixed interval from a
+    background thread."""
+
+    def __init__(self, workflow_queue: WorkflowQueue, interval: float,
+                 slots: int = 1):
+        """
+        :param workflow_queue: The queue that is reported on
+        :param interval: The number of seconds between reports
+        :param slots: The number of workflows that can run simultaneously.
+        Used to estimate the remaining time.
+        """
+        self.workflow_queue = workflow_queue
+        self.interval = interval
+        self.slots = max(slots, 1)
+        self.start_time = time.monotonic()
+        # The log sizes at the previous report, to calculate growth rates.
+        # Form: workflow -> (time, log size)
+        self._sizes: Dict[Workflow, Tuple[float, int]] = {}
+        # The last measurement of each workspace. Form: workflow -> (time,
+        # workspace size, growth rate, time of the next measurement)
+        self._workspaces: Dict[
+            Workflow, Tuple[float, int, Optional[float], float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Starts reporting in a background thread."""
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops reporting and waits for the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.workflow_queue.report(self.report())
+
+    def estimated_remaining(self, running: List[Workflow],
+                            queued: List[Workflow]) -> Optional[float]:
+        """
+        Estimates the remaining time from the estimated durations of the
+        workflows, assuming the slots stay filled. The session can not end
+        before the longest remaining workflow has finished.
+        :return: The number of seconds or None if there are no estimates
+        """
+        now = time.monotonic()
+        remaining = [workflow.estimated_duration for workflow in queued]
+        remaining += [max(workflow.estimated_duration -
+                          (now - (workflow.start_time or now)), 0.0)
+                      for workflow in running]
+        if not any(workflow.estimated_duration
+                   for workflow in running + queued) and remaining:
+            return None
+        return max(sum(remaining) / self.slots, max(remaining, default=0.0))
+
+    def workspace_size(self, workflow: Workflow,
+                       now: float) -> Tuple[int, Optional[float]]:
+        """
+        Measures the workspace of a running workflow. Walking a large
+        workspace takes long, so until WORKSPACE_WALK_FACTOR times the
+        duration of the previous walk has passed, the previous measurement
+        is returned.
+        :return: The size in bytes and the growth rate in bytes per second,
+        or None when the workspace has been measured only once.
+        """
+        previous = self._workspaces.get(workflow)
+        if previous is not None and now < previous[3]:
+            return previous[1], previous[2]
+        size = directory_size(workflow.cwd)
+        walk_duration = time.monotonic() - now
+        rate = None
+        if previous is not None and now > previous[0]:
+            rate = (size - previous[1]) / (now - previous[0])
+        self._workspaces[workflow] = (
+            now, size, rate, now + walk_duration * WORKSPACE_WALK_FACTOR)
+        return size, rate
+
+    def report(self) -> str:
+        """Creates a report of the current state of the queue."""
+        running, queued, finished = self.workflow_queue.snapshot()
+        now = time.monotonic()
+        remaining = self.estimated_remaining(running, queued)
+        eta = "unknown" if remaining is None else format_duration(remaining)
+        lines = [f"[{format_duration(now - self.start_time)}] "
+                 f"running: {len(running)}, queued: {len(queued)}, "
+                 f"finished: {len(finished)}, ETA: {eta}"]
+        sizes = {}
+        for workflow in running:
+            log_size = 0
+            for log in (workflow.stdout_file, workflow.stderr_file):
+                try:
+                    log_size += log.stat().st_size
+                except FileNotFoundError:
+                    pass
+            sizes[workflow] = (now, log_size)
+            previous = self._sizes.get(workflow)
+            if previous is not None and now > previous[0]:
+                log_rate = (log_size - previous[1]) / (now - previous[0])
+                log_growth = f" ({format_rate(log_rate)})"
+            else:
+                log_growth = ""
+            workspace_size, workspace_rate = self.workspace_size(
+                workflow, now)
+            workspace_growth = ("" if workspace_rate is None
+                                else f" ({format_rate(workspace_rate)})")
+            lines.append(
+                f"\t'{workflow.name}': "
+                f"{format_duration(now - (workflow.start_time or now))}, "
+                f"log {format_bytes(log_size)}{log_growth}, "
+                f"workspace {format_bytes(workspace_size)}{workspace_growth}")
+        # Only the workflows that are still running are remembered.
+        self._sizes = sizes
+        self._workspaces = {workflow: measurement for workflow, measurement
+                            in self._workspaces.items() if workflow in sizes}
+        return "\n".join(lines)
@@ -0,0 +1,147 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""All tests for the resource usage of workflows"""
+
+from typing import Optional
+
+import pytest
+
+from .history import PerformanceBaseline
+from .workflow import ResourceUsage, Workflow
+
+# The metrics that can be tested. Form: metric name, the ResourceUsage
+# attribute, a description and the unit used in messages.
+RESOURCE_METRICS = {
+    "max_rss": ("max_rss", "a peak resident set size", "bytes"),
+    "max_wall_time": ("wall_time", "a wall time", "seconds"),
+    "max_cpu_time": ("cpu_time", "a CPU time", "seconds"),
+}
+
+# The metrics that are compared against the baseline. CPU time is hardly
+# affected by other processes on the machine, while wall time is.
+BASELINE_METRICS = {
+    "cpu_time": "CPU time",
+    "wall_time": "wall time",
+}
+# Differences smaller than this are timer noise rather than a regression.
+# Without it very short workflows would fail on a few milliseconds.
+BASELINE_MIN_DIFFERENCE_SECS = 0.1
+
+
+def skip_if_measured_elsewhere(workflow: Workflow):
+    """Skips a test of the resource usage of a workflow that was not run by
+    this session. The resource usage of a result from the result cache or
+    another session was measured in another run, so it says nothing about
+    this one."""
+    if workflow.from_cache:
+        pytest.skip(f"'{workflow.name}' was restored from the result cache.")
+    if workflow.run_by is not None:
+        pytest.skip(f"'{workflow.name}' was run by {workflow.run_by}.")
+
+
+class ResourceUsageTest(pytest.Item):
+    """Tests whether a workflow stayed below a maximum resource usage."""
+
+    def __init__(self, parent: pytest.Collector, workflow: Workflow,
+                 metric: str, maximum: float):
+        """
+        :param parent: The collector that started this item
+        :param workflow: The workflow of which the resource usage is tested
+        :param metric: One of the keys of RESOURCE_METRICS
+        :param maximum: The maximum value of the metric
+        """
+        super().__init__(metric, parent)
+        self.workflow = workflow
+        self.metric = metric
+        self.maximum = maximum
+        self.observed: Optional[float] = None
+
+    def runtest(self):
+        # Resource usage is only known after the workflow has finished.
+        self.workflow.wait()
+        if self.workflow.skip_reason is not None:
+            pytest.skip(self.workflow.skip_reason)
+        if not self.workflow.matching_exitcode():
+            pytest.skip(f"'{self.workflow.name}' did not exit with "
+                        f"desired exit code.")
+        skip_if_measured_elsewhere(self.workflow)
+        resource_usage: Optional[ResourceUsage] = self.workflow.resource_usage
+        if resource_usage is None:
+            pytest.skip(f"The resource usage of '{self.workflow.name}' is "
+                        f"not available.")
+        attribute, _, _ = RESOURCE_METRICS[self.metric]
+        self.observed = getattr(resource_usage, attribute)
+        assert self.observed <= self.maximum
+
+    def repr_failure(self, excinfo, style=None):
+        _, description, unit = RESOURCE_METRICS[self.metric]
+        return (f"'{self.workflow.name}' used {description} of "
+                f"{self.observed} {unit}, which is more than the maximum of "
+                f"{self.maximum} {unit}.")
+
+
+class BaselineComparisonTest(pytest.Item):
+    """Tests whether a workflow did not get slower than its baseline."""
+
+    def __init__(self, parent: pytest.Collector, workflow: Workflow,
+                 metric: str, baseline: PerformanceBaseline,
+                 tolerance: float):
+        """
+        :param parent: The collector that started this item
+        :param workflow: The workflow of which the performance is tested
+        :param metric: One of the keys of BASELINE_METRICS
+        :param baseline: The baseline to compare with
+        :param tolerance: The percentage the workflow may be slower than
+        the baseline
+        """
+        super().__init__(f"{metric} baseline", parent)
+        self.workflow = workflow
+        self.metric = metric
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.observed: Optional[float] = None
+        self.expected: Optional[float] = None
+
+    def runtest(self):
+        self.workflow.wait()
+        if self.workflow.skip_reason is not None:
+            pytest.skip(self.workflow.skip_reason)
+        if not self.workflow.matching_exitcode():
+            pytest.skip(f"'{self.workflow.name}' did not exit with "
+                        f"desired exit code.")
+        skip_if_measured_elsewhere(self.workflow)
+        self.expected = self.baseline.get(self.workflow.name, self.metric)
+        if self.expected is None:
+            pytest.skip(f"No baseline recorded for '{self.workflow.name}'.")
+        resource_usage: Optional[ResourceUsage] = self.workflow.resource_usage
+        if resource_usage is None:
+            pytest.skip(f"The resource usage of '{self.workflow.name}' is "
+                        f"not available.")
+        self.observed = getattr(resource_usage, self.metric)
+        allowed = max(self.expected * (1 + self.tolerance / 100),
+                      self.expected + BASELINE_MIN_DIFFERENCE_SECS)
+        assert self.observed <= allowed
+
+    def repr_failure(self, excinfo, style=None):
+        assert self.observed is not None and self.expected is not None
+        degradation = ((self.observed - self.expected) / self.expected * 100
+                       if self.expected else float("inf"))
+        return (f"'{self.workflow.name}' used {self.observed:.3f} seconds "
+                f"{BASELINE_METRICS[self.metric]}. This is "
+                f"{degradation:.1f}% more than the baseline of "
+                f"{self.expected:.3f} seconds, while {self.tolerance}% is "
+                f"allowed.")
@@ -0,0 +1,347 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""A cache of workflow results in a local directory. Workflows of which the
+definition and the input files did not change are restored from the cache
+instead of being run."""
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .workflow import Executor, LogScanner, ResourceUsage, Workflow
+
+# Changing the way keys are calculated or entries are stored requires a new
+# version, so old entries are not used anymore.
+CACHE_VERSION = 1
+LOCK_FILE = "lock"
+METADATA_FILE = "metadata.json"
+OUTPUTS_DIR = "outputs"
+# The files in a directory and their size and modification time in
+# nanoseconds. Form: relative path -> (size, modification time)
+Manifest = Dict[str, Tuple[int, int]]
+
+
+def workflow_fingerprint(definition: dict,
+                         environment: Dict[str, Optional[str]]) -> str:
+    """
+    Identifies a workflow definition.
+    :param definition: The workflow test as written in the YAML
+    :param environment: Environment variables that influence the workflow
+    and their values. None for variables that are not set.
+    """
+    content = json.dumps(dict(version=CACHE_VERSION, definition=definition,
+                              environment=environment), sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def directory_files(directory: Path, ignore: Iterable[str] = ()
+                    ) -> Iterator[Tuple[str, Path]]:
+    """
+    Yields the relative path and the path of all files in a directory in a
+    fixed order. Symbolic links to files are included.
+    :param directory: The directory
+    :param ignore: Relative paths of subdirectories that are skipped
+    """
+    ignored = set(ignore)
+    for root, dirs, files in os.walk(directory):
+        relative_root = Path(root).relative_to(directory)
+        dirs[:] = sorted(name for name in dirs
+                         if (relative_root / name).as_posix() not in ignored)
+        for name in sorted(files):
+            path = Path(root, name)
+            yield path.relative_to(directory).as_posix(), path
+
+
+def directory_manifest(workflow: Workflow, ignore: Iterable[str] = ()
+                       ) -> Manifest:
+    """
+    Lists the files in the directory of a workflow, except its logs, with
+    their size and modification time.
+    :param workflow: The workflow
+    :param ignore: Relative paths of subdirectories that are skipped
+    """
+    manifest: Manifest = {}
+    for relative_path, path in directory_files(workflow.cwd, ignore):
+        if path in (workflow.stdout_file, workflow.stderr_file):
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # A broken symbolic link.
+            continue
+        manifest[relative_path] = (stat.st_size, stat.st_mtime_ns)
+    return manifest
+
+
+def store_outputs(workflow: Workflow, inputs: Manifest, entry: Path,
+                  ignore: Iterable[str] = ()) -> Tuple[List[str], int]:
+    """
+    Copies the logs of a finished workflow and the files in its directory
+    that were created or changed while it ran into a directory.
+    :param workflow: The workflow
+    :param inputs: The files in the directory before the workflow was run
+    :param entry: The directory the files are copied to
+    :param ignore: Relative paths of subdirectories that are skipped
+    :return: The relative paths of the copied outputs and the size of all
+    copied files
+    """
+    outputs = []
+    size = 0
+    for relative_path, (file_size, mtime) in directory_manifest(
+            workflow, ignore).items():
+        if inputs.get(relative_path) == (file_size, mtime):
+            continue
+        destination = entry / OUTPUTS_DIR / relative_path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(workflow.cwd / relative_path, destination)
+        outputs.append(relative_path)
+        size += file_size
+    for log, name in ((workflow.stdout_file, "log.out"),
+                      (workflow.stderr_file, "log.err")):
+        shutil.copyfile(log, entry / name)
+        size += log.stat().st_size
+    return outputs, size
+
+
+def restore_outputs(entry: Path, outputs: Iterable[str], workflow: Workflow):
+    """
+    Copies the outputs and logs stored with store_outputs into the directory
+    of a workflow.
+    :param entry: The directory the outputs were stored in
+    :param outputs: The relative paths of the outputs
+    :param workflow: The workflow
+    """
+    for relative_path in outputs:
+        destination = workflow.cwd / relative_path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # Inputs may be symbolic links to the original files, which should
+        # not be overwritten.
+        if destination.is_symlink() or destination.exists():
+            destination.unlink()
+        shutil.copy2(entry / OUTPUTS_DIR / relative_path, destination)
+    shutil.copyfile(entry / "log.out", workflow.stdout_file)
+    shutil.copyfile(entry / "log.err", workflow.stderr_file)
+
+
+class ResultCache(object):
+    """
+    Stores the outputs, logs, exit code and resource usage of workflows in
+    a directory. Each entry is a subdirectory named after the hash of the
+    workflow definition and its input files. When the cache grows beyond its
+    maximum size the least recently used entries are removed.
+
+    Multiple sessions can use the same directory. Entries are written to a
+    temporary directory and renamed, and a lock file prevents entries from
+    being removed while they are restored.
+    """
+
+    def __init__(self, directory: Path, max_size: int,
+                 ignore: Iterable[str] = ()):
+        """
+        :param directory: The directory of the cache. Created when needed.
+        :param max_size: The maximum size of all entries in bytes
+        :param ignore: Relative paths of directories in the workflow
+        directories that are neither inputs nor outputs, such as pytest's
+        cache.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.ignore = list(ignore)
+
+    @contextlib.contextmanager
+    def _lock(self, shared: bool) -> Iterator[None]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def key(self, workflow: Workflow) -> Tuple[str, Manifest]:
+        """
+        Calculates the key of a workflow from its fingerprint and the files
+        in its directory. Should be called right before the workflow is run.
+        :return: The key and the files that were hashed.
+        """
+        assert workflow.fingerprint is not None
+        hasher = hashlib.sha256(workflow.fingerprint.encode())
+        manifest: Manifest = {}
+        for relative_path, path in directory_files(workflow.cwd,
+                                                   self.ignore):
+            if path in (workflow.stdout_file, workflow.stderr_file):
+                continue
+            hasher.update(relative_path.encode() + b"\0")
+            try:
+                with path.open("rb") as input_file:
+                    for block in iter(lambda: input_file.read(64 * 1024),
+                                      b""):
+                        hasher.update(block)
+                stat = path.stat()
+            except FileNotFoundError:
+                # A broken symbolic link.
+                hasher.update(os.readlink(path).encode())
+                continue
+            hasher.update(b"\0")
+            manifest[relative_path] = (stat.st_size, stat.st_mtime_ns)
+        return hasher.hexdigest(), manifest
+
+    def restore(self, key: str, workflow: Workflow) -> Optional[dict]:
+        """
+        Copies the outputs and logs of a cache entry into the directory of
+        the workflow.
+        :return: The metadata of the entry or None if there is no entry.
+        """
+        with self._lock(shared=True):
+            entry = self.directory / key
+            metadata_file = entry / METADATA_FILE
+            if not metadata_file.exists():
+                return None
+            metadata = json.loads(metadata_file.read_text())
+            restore_outputs(entry, metadata["outputs"], workflow)
+            # The modification time of the metadata is the last use.
+            os.utime(metadata_file)
+        return metadata
+
+    def store(self, key: str, workflow: Workflow, inputs: Manifest):
+        """
+        Stores the results of a workflow that has finished.
+        :param key: The key calculated before the workflow was run
+        :param workflow: The workflow
+        :param inputs: The files in the directory before the workflow was run.
+        Only files that were created or changed are stored.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.directory))
+        try:
+            outputs, size = store_outputs(workflow, inputs, entry,
+                                          self.ignore)
+            resource_usage = workflow.resource_usage
+            metadata: Dict[str, Any] = dict(
+                exit_code=workflow.exit_code,
+                resource_usage=(None if resource_usage is None
+                                else vars(resource_usage)),
+                outputs=outputs,
+                size=size)
+            (entry / METADATA_FILE).write_text(json.dumps(metadata))
+            with self._lock(shared=False):
+                if (self.directory / key).exists():
+                    # Stored by another session in the meantime.
+                    shutil.rmtree(entry)
+                else:
+                    entry.rename(self.directory / key)
+                self._evict()
+        except BaseException:
+            shutil.rmtree(entry, ignore_errors=True)
+            raise
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits in
+        its maximum size. Must be called while holding the exclusive lock."""
+        entries = []
+        for entry in self.directory.iterdir():
+            metadata_file = entry / METADATA_FILE
+            if entry.name.startswith(".tmp-") or not metadata_file.exists():
+                continue
+            size = json.loads(metadata_file.read_text())["size"]
+            entries.append((metadata_file.stat().st_mtime_ns, size, entry))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry)
+            total -= size
+
+
+class CachingExecutor(Executor):
+    """Restores the results of workflows from a ResultCache and runs the
+    workflows that are not in the cache with another executor."""
+
+    def __init__(self, executor: Executor, cache: ResultCache):
+        """
+        :param executor: Runs the workflows that are not in the cache
+        :param cache: The result cache
+        """
+        self.executor = executor
+        self.cache = cache
+        self.poll_interval = executor.poll_interval
+        self.shares_machine = executor.shares_machine
+
+    async def claim(self, workflow: Workflow) -> Optional[str]:
+        return await self.executor.claim(workflow)
+
+    def submit(self, workflow: Workflow):
+        self.executor.submit(workflow)
+
+    def poll(self, workflow: Workflow) -> bool:
+        return self.executor.poll(workflow)
+
+    def cancel(self, workflow: Workflow):
+        self.executor.cancel(workflow)
+
+    def exit_code(self, workflow: Workflow) -> int:
+        return self.executor.exit_code(workflow)
+
+    async def supervise(self, workflow: Workflow):
+        """Restores the workflow from the cache. When it is not in the cache
+        it is run and its results are stored when it succeeds."""
+        if workflow.fingerprint is None:
+            await self.executor.supervise(workflow)
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            key, inputs = await loop.run_in_executor(
+                None, self.cache.key, workflow)
+            metadata = await loop.run_in_executor(
+                None, self.cache.restore, key, workflow)
+        except OSError as error:
+            warnings.warn(f"The result cache could not be used for "
+                          f"'{workflow.name}': {error}")
+            await self.executor.supervise(workflow)
+            return
+        if metadata is not None:
+            workflow.mark_started()
+            for log, scanner, stream_name in (
+                    (workflow.stdout_file, workflow.stdout_scanner, "stdout"),
+                    (workflow.stderr_file, workflow.stderr_scanner,
+                     "stderr")):
+                if scanner is not None:
+                    LogScanner(log, scanner, stream_name).close()
+            resource_usage = metadata["resource_usage"]
+            if resource_usage is not None:
+                workflow.resource_usage = ResourceUsage(**resource_usage)
+            workflow.from_cache = True
+            workflow.mark_finished(metadata["exit_code"])
+            return
+        await self.executor.supervise(workflow)
+        if (workflow.succeeded() and not workflow.timed_out and
+                workflow.abort_reason is None):
+            try:
+                await loop.run_in_executor(
+                    None, self.cache.store, key, workflow, inputs)
+            except OSError as error:
+                warnings.warn(f"The results of '{workflow.name}' could not "
+                              f"be stored in the result cache: {error}")
@@ -0,0 +1,120 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Samples the resources used by the processes of the running workflows."""
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .workflow import (PAGE_SIZE, Workflow, WorkflowQueue,
+                       cpu_time_from_stat, session_stats)
+
+
+def read_io(pid: int) -> Tuple[int, int]:
+    """
+    Reads the bytes a process has read from and written to storage from
+    /proc/<pid>/io. Returns zeros when the file can not be read, for
+    instance when the process has exited.
+    """
+    read_bytes = write_bytes = 0
+    try:
+        with open(f"/proc/{pid}/io", "rb") as io_file:
+            for line in io_file:
+                key, _, value = line.partition(b":")
+                if key == b"read_bytes":
+                    read_bytes = int(value)
+                elif key == b"write_bytes":
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+
+class ResourceSampler(object):
+    """Adds a sample of the cpu, memory and storage use of every running
+    workflow to its samples at a fixed interval from a background thread.
+    Only workflows that run as local processes are sampled."""
+
+    def __init__(self, workflow_queue: WorkflowQueue, interval: float):
+        """
+        :param workflow_queue: The queue of which the running workflows are
+        sampled
+        :param interval: The number of seconds between samples
+        """
+        self.workflow_queue = workflow_queue
+        self.interval = interval
+        # The cpu time and bytes read and written of each process at the
+        # previous sample, to calculate the use since then. Processes that
+        # are seen for the first time started after the previous sample.
+        # Form: (session id, pid) -> (cpu seconds, read bytes, write bytes)
+        self._counters: Dict[Tuple[int, int], Tuple[float, int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Starts sampling in a background thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling and waits for the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Adds a sample to each running workflow."""
+        running, _, _ = self.workflow_queue.snapshot()
+        sessions: Dict[int, Workflow] = {}
+        for workflow in running:
+            popen = workflow._popen
+            if popen is not None and workflow.start_time is not None:
+                sessions[popen.pid] = workflow
+        # /proc is read once for all workflows.
+        stats = session_stats(set(sessions))
+        now = time.monotonic()
+        counters = {}
+        for session_id, workflow in sessions.items():
+            cpu_time = 0.0
+            rss = read_bytes = write_bytes = 0
+            for pid, fields in stats.get(session_id, {}).items():
+                process_cpu_time = cpu_time_from_stat(fields)
+                process_read, process_write = read_io(pid)
+                previous = self._counters.get((session_id, pid), (0.0, 0, 0))
+                counters[session_id, pid] = (
+                    process_cpu_time, process_read, process_write)
+                # The counters of a pid that was reused are lower.
+                cpu_time += max(process_cpu_time - previous[0], 0.0)
+                read_bytes += max(process_read - previous[1], 0)
+                write_bytes += max(process_write - previous[2], 0)
+                rss += int(fields[21]) * PAGE_SIZE
+            samples = workflow.samples
+            start_time: float = workflow.start_time  # type: ignore
+            elapsed = now - start_time
+            since_previous = elapsed - (samples.time[-1] if samples.time
+                                        else 0.0)
+            if since_previous <= 0:
+                continue
+            samples.add(elapsed, cpu_time / since_previous, rss,
+                        read_bytes / since_previous,
+                        write_bytes / since_previous)
+        self._counters = counters
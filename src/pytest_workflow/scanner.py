@@ -0,0 +1,114 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Scans the output of a workflow for strings and patterns while it is
+running."""
+
+import codecs
+import io
+import locale
+import re
+from typing import Iterable, List, Optional, Set
+
+
+class ContentScanner(object):
+    """
+    Searches a stream of bytes for strings and regex patterns as the data
+    arrives. The data is searched line by line, like check_content does for
+    files, so the results are the same as searching the finished log.
+    """
+
+    def __init__(self,
+                 strings: Iterable[str] = (),
+                 patterns: Iterable[str] = (),
+                 abort_patterns: Iterable[str] = (),
+                 encoding: Optional[str] = None):
+        """
+        :param strings: Strings to look for
+        :param patterns: Regex patterns to look for
+        :param abort_patterns: Regex patterns that indicate the workflow
+        should be aborted
+        :param encoding: The encoding of the stream. Defaults to the
+        preferred encoding of the system, like open does.
+        """
+        self.strings: Set[str] = set(strings)
+        self.patterns: Set[str] = set(patterns)
+        self.abort_patterns: List[str] = list(abort_patterns)
+        self.encoding = encoding
+        self.reset()
+
+    def reset(self):
+        """Forgets what was found, so a new stream can be scanned."""
+        self.strings_to_check: Set[str] = set(self.strings)
+        self.found_strings: Set[str] = set()
+        self.regex_to_match: Set[re.Pattern] = {
+            re.compile(pattern) for pattern in self.patterns}
+        self.found_patterns: Set[str] = set()
+        self.abort_regexes: List[re.Pattern] = [
+            re.compile(pattern) for pattern in self.abort_patterns]
+        # The abort pattern that matched. None when none has matched.
+        self.abort_match: Optional[str] = None
+        # Universal newlines the same way as reading the file in text mode.
+        # Undecodable bytes are replaced, so a stray byte does not stop the
+        # scanning of the rest of the stream.
+        decoder = codecs.getincrementaldecoder(
+            self.encoding or locale.getpreferredencoding(False))(
+            errors="replace")
+        self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        self._partial_line = ""
+
+    def feed(self, data: bytes) -> bool:
+        """
+        Scans a chunk of the stream.
+        :param data: The next bytes of the stream
+        :return: Whether an abort pattern was found in this chunk
+        """
+        text = self._partial_line + self._decoder.decode(data)
+        lines = text.split("\n")
+        # The last element is the start of a line that is not finished yet.
+        self._partial_line = lines.pop()
+        return self._scan_lines(line + "\n" for line in lines)
+
+    def close(self) -> bool:
+        """
+        Scans the remainder of the stream. Should be called at the end of the
+        stream.
+        :return: Whether an abort pattern was found in the remainder
+        """
+        text = self._partial_line + self._decoder.decode(b"", final=True)
+        self._partial_line = ""
+        return self._scan_lines(text.splitlines(keepends=True))
+
+    def _scan_lines(self, lines: Iterable[str]) -> bool:
+        aborted = False
+        for line in lines:
+            if self.strings_to_check or self.regex_to_match:
+                found_strings = {string for string in self.strings_to_check
+                                 if string in line}
+                found_regexes = {regex for regex in self.regex_to_match
+                                 if regex.search(line)}
+                self.found_strings |= found_strings
+                self.found_patterns |= {regex.pattern
+                                        for regex in found_regexes}
+                self.strings_to_check -= found_strings
+                self.regex_to_match -= found_regexes
+            if self.abort_match is None:
+                for regex in self.abort_regexes:
+                    if regex.search(line):
+                        self.abort_match = regex.pattern
+                        aborted = True
+                        break
+        return aborted
@@ -16,25 +16,115 @@
 
 """Schema for the YAML files used by pytest-workflow"""
 
+import itertools
 import json
+import re
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 import jsonschema
 
-from .util import replace_whitespace
+from .util import parse_memory, replace_whitespace
 
 SCHEMA = Path(__file__).parent / "schema" / "schema.json"
 DEFAULT_EXIT_CODE = 0
 DEFAULT_FILE_SHOULD_EXIST = True
+DEFAULT_CPUS = 1
+DEFAULT_MEMORY = 0
 
 JSON_SCHEMA = json.loads(SCHEMA.read_text())
 
 
-def workflow_tests_from_schema(schema):
-    """Returns workflow test objects from a schema"""
-    validate_schema(schema)
-    return [WorkflowTest.from_schema(x) for x in schema]
+def workflow_tests_from_schema(schema) -> List["WorkflowTest"]:
+    """Returns workflow test objects from a schema. A test with a matrix
+    gives a workflow test for each of its variants."""
+    validate_schema_structure(schema)
+    variants = []
+    for test in schema:
+        matrix_name = test["name"] if "matrix" in test else None
+        matrix_variants = variant_names(test) if matrix_name else None
+        for variant in expand_matrix(test):
+            validate_test(variant)
+            variants.append((variant, matrix_name, matrix_variants))
+    # All variants are validated before the first workflow test is made.
+    return [WorkflowTest.from_schema(variant, matrix_name=matrix_name,
+                                     matrix_variants=matrix_variants)
+            for variant, matrix_name, matrix_variants in variants]
+
+
+def matrix_parameters(test: dict) -> Iterator[Dict[str, str]]:
+    """
+    Yields the parameters of each variant of a test's matrix. A test without
+    a matrix has a single variant without parameters.
+    :param test: A test from the schema
+    """
+    matrix: Dict[str, list] = test.get("matrix", {})
+    for values in itertools.product(*matrix.values()):
+        yield {key: _parameter_string(value)
+               for key, value in zip(matrix.keys(), values)}
+
+
+def _parameter_string(value: Union[str, int, float, bool]) -> str:
+    # Booleans are written as in the YAML file rather than as in Python.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _variant_name(name: str, parameters: Dict[str, str]) -> str:
+    # Parameters that do not occur in the name are added to it in the way
+    # pytest names parametrized tests, so every variant has a unique name.
+    missing = [value for key, value in parameters.items()
+               if "{" + key + "}" not in name]
+    name = _substitute(name, parameters)
+    if missing:
+        name += "[" + "-".join(missing) + "]"
+    return name
+
+
+def _substitute(value: Any, parameters: Dict[str, str]) -> Any:
+    # Only placeholders of matrix parameters are replaced. Other braces, for
+    # instance in shell commands or regexes, are left alone.
+    if isinstance(value, str):
+        if not parameters:
+            return value
+        pattern = re.compile(
+            r"\{(" + "|".join(map(re.escape, parameters)) + r")\}")
+        return pattern.sub(lambda match: parameters[match.group(1)], value)
+    if isinstance(value, list):
+        return [_substitute(item, parameters) for item in value]
+    if isinstance(value, dict):
+        return {key: _substitute(item, parameters)
+                for key, item in value.items()}
+    return value
+
+
+def variant_names(test: dict) -> List[str]:
+    """
+    Returns the names of all variants of a test. This is cheaper than
+    expanding the matrix.
+    :param test: A test from the schema
+    """
+    return [_variant_name(test["name"], parameters)
+            for parameters in matrix_parameters(test)]
+
+
+def expand_matrix(test: dict) -> Iterator[dict]:
+    """
+    Yields a test for each combination of the parameters in the matrix of a
+    test. The {parameter} placeholders in the strings of the test are
+    replaced by the values of the combination. A test without a matrix is
+    yielded as is.
+    :param test: A test from the schema
+    """
+    if "matrix" not in test:
+        yield test
+        return
+    for parameters in matrix_parameters(test):
+        variant = {key: _substitute(value, parameters)
+                   for key, value in test.items() if key != "matrix"}
+        variant["name"] = _variant_name(test["name"], parameters)
+        yield variant
 
 
 def validate_schema(instance):
@@ -44,6 +134,20 @@ def validate_schema(instance):
     :return: This function rasises a ValidationError
     when the schema is not correct.
     """
+    validate_schema_structure(instance)
+    for test in instance:
+        for variant in expand_matrix(test):
+            validate_test(variant)
+
+
+def validate_schema_structure(instance):
+    """
+    Validates the pytest-workflow schema without the checks on the contents
+    of the individual tests. These are done by validate_test.
+    :param instance: an object that is validated against the schema
+    :return: This function rasises a ValidationError
+    when the schema is not correct.
+    """
     jsonschema.validate(instance, JSON_SCHEMA)
 
     # Some extra tests here below that can not be captured in jsonschema
@@ -51,12 +155,21 @@ def validate_schema(instance):
     # Test if there are name collisions when whitespace is removed. This will
     # cause errors in pytest (collectors not having unique names) so has to
     # be avoided.
-    test_names = [replace_whitespace(test['name'], ' ') for test in instance]
+    test_names = [replace_whitespace(name, ' ')
+                  for test in instance for name in variant_names(test)]
     if len(test_names) != len(set(test_names)):
         raise jsonschema.ValidationError(
             f"Some names were not unique when whitespace was removed. "
             f"Defined names: {test_names}")
 
+
+def validate_test(test: dict):
+    """
+    Validates a single test of the schema after its matrix is expanded.
+    :param test: a test that was validated by validate_schema_structure
+    :return: This function rasises a ValidationError
+    when the test is not correct.
+    """
     def test_contains_concordance(dictionary: dict, name: str):
         """
         Test whether contains and must not contain have the same members.
@@ -76,23 +189,25 @@ def validate_schema(instance):
                     f"Object: {name}. Common members: {common_members}"
                 )
 
-    for test in instance:
-        test_contains_concordance(test.get('stdout', {}),
-                                  test['name'] + "/stdout")
-        test_contains_concordance(test.get('stderr', {}),
-                                  test['name'] + "/stderr")
-        for test_file in test.get("files", []):
-            keys = test_file.keys()
-            test_contains_concordance(test_file, test_file['path'])
-            file_should_exist = test_file.get("should_exist",
-                                              DEFAULT_FILE_SHOULD_EXIST)
-
-            if not file_should_exist:
-                for check in ["md5sum", "contains", "must_not_contain"]:
-                    if check in keys:
-                        raise jsonschema.ValidationError(
-                            f"Content checking not allowed on non existing "
-                            f"file: {test_file['path']}. Key = {check}")
+    if test['name'] in test.get('depends_on', []):
+        raise jsonschema.ValidationError(
+            f"Workflow '{test['name']}' can not depend on itself.")
+    test_contains_concordance(test.get('stdout', {}),
+                              test['name'] + "/stdout")
+    test_contains_concordance(test.get('stderr', {}),
+                              test['name'] + "/stderr")
+    for test_file in test.get("files", []):
+        keys = test_file.keys()
+        test_contains_concordance(test_file, test_file['path'])
+        file_should_exist = test_file.get("should_exist",
+                                          DEFAULT_FILE_SHOULD_EXIST)
+
+        if not file_should_exist:
+            for check in ["md5sum", "contains", "must_not_contain"]:
+                if check in keys:
+                    raise jsonschema.ValidationError(
+                        f"Content checking not allowed on non existing "
+                        f"file: {test_file['path']}. Key = {check}")
 
 
 # Schema classes below
@@ -156,6 +271,49 @@ class FileTest(ContentTest):
         self.should_exist = should_exist
 
 
+class Resources(object):
+    """A class that holds the resources a workflow uses while running."""
+    def __init__(self, cpus: Optional[int] = None,
+                 memory: Union[int, str] = DEFAULT_MEMORY):
+        """
+        :param cpus: The number of cpus the workflow uses. None means the
+        default of DEFAULT_CPUS, without claiming them explicitly.
+        :param memory: The memory the workflow uses. Either in bytes or as a
+        string with a K, M, G or T suffix.
+        """
+        # Whether the cpus are given in the test, so the tools in the
+        # workflow should be limited to them.
+        self.claims_cpus = cpus is not None
+        self.cpus: int = cpus if cpus is not None else DEFAULT_CPUS
+        self.memory: int = parse_memory(memory)
+
+
+class Limits(object):
+    """A class that holds the limits that are enforced while a workflow
+    runs."""
+    def __init__(self, memory: Optional[Union[int, str]] = None,
+                 address_space: Optional[Union[int, str]] = None,
+                 file_size: Optional[Union[int, str]] = None,
+                 open_files: Optional[int] = None):
+        """
+        All sizes are either in bytes or a string with a K, M, G or T suffix.
+        None means no limit.
+        :param memory: The resident set size all processes of the workflow
+        may use together
+        :param address_space: The virtual memory each process may use
+        :param file_size: The largest file each process may write
+        :param open_files: The number of files each process may have open
+        """
+        self.memory: Optional[int] = (
+            parse_memory(memory) if memory is not None else None)
+        self.address_space: Optional[int] = (
+            parse_memory(address_space) if address_space is not None
+            else None)
+        self.file_size: Optional[int] = (
+            parse_memory(file_size) if file_size is not None else None)
+        self.open_files = open_files
+
+
 class WorkflowTest(object):
     """A class that contains all properties of a to be tested workflow"""
 
@@ -164,7 +322,22 @@ class WorkflowTest(object):
                  exit_code: int = DEFAULT_EXIT_CODE,
                  stdout: ContentTest = ContentTest(),
                  stderr: ContentTest = ContentTest(),
-                 files: Optional[List[FileTest]] = None):
+                 files: Optional[List[FileTest]] = None,
+                 resources: Optional[Resources] = None,
+                 limits: Optional[Limits] = None,
+                 timeout: Optional[float] = None,
+                 stall_timeout: Optional[float] = None,
+                 max_rss: Optional[Union[int, str]] = None,
+                 max_wall_time: Optional[float] = None,
+                 max_cpu_time: Optional[float] = None,
+                 depends_on: Optional[List[str]] = None,
+                 abort_on: Optional[List[str]] = None,
+                 setup: bool = False,
+                 concurrency_group: Optional[Union[str, List[str]]] = None,
+                 retries: Optional[int] = None,
+                 definition: Optional[dict] = None,
+                 matrix_name: Optional[str] = None,
+                 matrix_variants: Optional[List[str]] = None):
         """
         Create a WorkflowTest object.
         :param name: The name of the test
@@ -173,6 +346,31 @@ class WorkflowTest(object):
         :param stdout: a ContentTest object
         :param stderr: a ContentTest object
         :param files: a list of FileTest objects
+        :param resources: a Resources object
+        :param limits: a Limits object
+        :param timeout: The number of seconds the workflow may run
+        :param stall_timeout: The number of seconds the workflow may run
+        without making progress
+        :param max_rss: The maximum peak resident set size of the workflow.
+        Either in bytes or as a string with a K, M, G or T suffix.
+        :param max_wall_time: The maximum number of seconds the workflow may
+        take
+        :param max_cpu_time: The maximum number of CPU seconds the workflow
+        may use
+        :param depends_on: Names of workflows that should have finished
+        successfully before this workflow is started
+        :param abort_on: Regex patterns that terminate the workflow when
+        they are found in its stdout or stderr
+        :param setup: Whether the workflow prepares something for the
+        workflows that depend on it
+        :param concurrency_group: A group or list of groups of workflows of
+        which only a limited number may run at the same time
+        :param retries: How many times the workflow is run again when it
+        fails. None means the default of the command line is used.
+        :param definition: The workflow test as it was written in the YAML,
+        with the parameters of its matrix filled in
+        :param matrix_name: The name of the matrix this test is a variant of
+        :param matrix_variants: The names of all variants of the matrix
         """
         self.name = name
         self.command = command
@@ -181,9 +379,28 @@ class WorkflowTest(object):
         self.stderr = stderr
         self.files = files or []
         self.tags = tags or []
+        self.resources = resources or Resources()
+        self.limits = limits or Limits()
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.max_rss: Optional[int] = (
+            parse_memory(max_rss) if max_rss is not None else None)
+        self.max_wall_time = max_wall_time
+        self.max_cpu_time = max_cpu_time
+        self.depends_on: List[str] = depends_on or []
+        self.abort_on: List[str] = abort_on or []
+        self.setup = setup
+        self.concurrency_groups: List[str] = (
+            [concurrency_group] if isinstance(concurrency_group, str)
+            else concurrency_group or [])
+        self.retries = retries
+        self.definition: dict = definition or {}
+        self.matrix_name = matrix_name
+        self.matrix_variants: List[str] = matrix_variants or []
 
     @classmethod
-    def from_schema(cls, schema: dict):
+    def from_schema(cls, schema: dict, matrix_name: Optional[str] = None,
+                    matrix_variants: Optional[List[str]] = None):
         """Generate a WorkflowTest object from schema objects"""
         test_file_dicts = schema.get("files", [])
         test_files = [FileTest(**d) for d in test_file_dicts]
@@ -195,5 +412,20 @@ class WorkflowTest(object):
             exit_code=schema.get("exit_code", DEFAULT_EXIT_CODE),
             stdout=ContentTest(**schema.get("stdout", {})),
             stderr=ContentTest(**schema.get("stderr", {})),
-            files=test_files
+            files=test_files,
+            resources=Resources(**schema.get("resources", {})),
+            limits=Limits(**schema.get("limits", {})),
+            timeout=schema.get("timeout"),
+            stall_timeout=schema.get("stall_timeout"),
+            max_rss=schema.get("max_rss"),
+            max_wall_time=schema.get("max_wall_time"),
+            max_cpu_time=schema.get("max_cpu_time"),
+            depends_on=schema.get("depends_on"),
+            abort_on=schema.get("abort_on"),
+            setup=schema.get("setup", False),
+            concurrency_group=schema.get("concurrency_group"),
+            retries=schema.get("retries"),
+            definition=schema,
+            matrix_name=matrix_name,
+            matrix_variants=matrix_variants
         )
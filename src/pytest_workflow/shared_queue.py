@@ -0,0 +1,416 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""A queue of workflows in a directory that is shared by several sessions,
+for instance on machines with the same network file system. Each session
+claims the workflows it runs, so every workflow is run once, and publishes
+their results for the other sessions."""
+
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import warnings
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import quote
+
+from .result_cache import (METADATA_FILE, Manifest, directory_manifest,
+                           restore_outputs, store_outputs)
+from .workflow import Executor, LogScanner, ResourceUsage, Workflow
+
+CLAIMS_DIR = "claims"
+RESULTS_DIR = "results"
+# How often a session marks the claims of the workflows it runs as alive.
+HEARTBEAT_SECS = 10.0
+# Claims that were not marked as alive for this long, measured by the clock
+# of the session that watches them, belong to a session that stopped. Their
+# workflows are taken over by a waiting session.
+STALE_CLAIM_SECS = 60.0
+
+
+class SharedQueue(object):
+    """
+    Claims and results of workflows in a shared directory. A claim is a file
+    with the name of the session that runs the workflow and a heartbeat
+    counter. It is created by linking a temporary file to its name, which
+    either succeeds or fails as a whole, also on network file systems.
+    Results are written to a temporary directory and renamed.
+
+    The clocks of the machines may differ, so a claim is not judged by its
+    modification time. A claim is stale when its counter has not changed for
+    STALE_CLAIM_SECS since this session first saw its current value.
+
+    The workflows that are connected through depends_on are claimed as a
+    group, so they run in the same session.
+    """
+
+    def __init__(self, directory: Path, run: str, node: str):
+        """
+        :param directory: The shared directory. Created when needed.
+        :param run: The run of the test suite. The claims and results of
+        each run are kept in a subdirectory of their own, so the results of
+        earlier runs are never restored.
+        :param node: The name of this session in the claims and results
+        """
+        self.directory = directory / quote(run, safe="")
+        self.node = node
+        # The group of each workflow name. Workflows that are not in here
+        # form a group of their own.
+        self.groups: Dict[str, str] = {}
+        self._claimed: Set[str] = set()
+        self._heartbeat_counter = itertools.count(1)
+        # The content of each claim of another session that was last seen
+        # and when, by the monotonic clock of this session, it was first
+        # seen.
+        self._seen: Dict[str, Tuple[str, float]] = {}
+
+    def group_of(self, workflow: Workflow) -> str:
+        """The name of the group of a workflow."""
+        return self.groups.get(workflow.name, workflow.name)
+
+    def members(self, group: str) -> Set[str]:
+        """The names of the workflows in a group."""
+        return ({name for name, member_group in self.groups.items()
+                 if member_group == group} or {group})
+
+    def _claim_file(self, workflow: Workflow) -> Path:
+        return self.directory / CLAIMS_DIR / quote(self.group_of(workflow),
+                                                   safe="")
+
+    def _result_dir(self, workflow: Workflow) -> Path:
+        return self.directory / RESULTS_DIR / quote(workflow.name, safe="")
+
+    def claim(self, workflow: Workflow) -> str:
+        """
+        Claims the group of a workflow for this session.
+        :return: The name of the session that has claimed the group. This
+        session when the claim succeeded.
+        """
+        claim_file = self._claim_file(workflow)
+        if claim_file.name in self._claimed:
+            return self.node
+        claim_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = claim_file.with_name(f".tmp-{uuid.uuid4().hex}")
+        temporary.write_text(self._claim_content(0))
+        try:
+            while True:
+                try:
+                    os.link(temporary, claim_file)
+                except FileExistsError:
+                    pass
+                else:
+                    self._claimed.add(claim_file.name)
+                    return self.node
+                try:
+                    return claim_file.read_text().split("\n", 1)[0]
+                except FileNotFoundError:
+                    # Removed as stale in the meantime.
+                    continue
+        finally:
+            temporary.unlink()
+
+    def _claim_content(self, heartbeat: int) -> str:
+        # Every heartbeat has the same length, so it can be written over the
+        # previous one without changing the name of the session.
+        return f"{self.node}\n{heartbeat:020d}\n"
+
+    def heartbeat(self, workflow: Workflow):
+        """Marks the claim of a workflow that this session runs as alive by
+        increasing its counter."""
+        with self._claim_file(workflow).open("r+") as claim:
+            if claim.readline() != f"{self.node}\n":
+                # Taken over by another session.
+                return
+            claim.seek(0)
+            claim.write(self._claim_content(next(self._heartbeat_counter)))
+
+    def release(self, workflow: Workflow):
+        """Gives up the claim of a group of which a workflow was not run to
+        the end, so another session can run it."""
+        claim_file = self._claim_file(workflow)
+        self._claimed.discard(claim_file.name)
+        try:
+            claim_file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def remove_stale_claim(self, workflow: Workflow) -> bool:
+        """
+        Removes the claim of a workflow when the session that claimed it has
+        not marked it as alive for STALE_CLAIM_SECS. Must be called
+        repeatedly, because a claim can only be judged after it was seen.
+        :return: Whether the claim was removed by this session
+        """
+        claim_file = self._claim_file(workflow)
+        now = time.monotonic()
+        try:
+            content = claim_file.read_text()
+            seen = self._seen.get(claim_file.name)
+            if seen is None or seen[0] != content:
+                self._seen[claim_file.name] = (content, now)
+                return False
+            if now - seen[1] < STALE_CLAIM_SECS:
+                return False
+            # Only one of the sessions that try this succeeds.
+            stale = claim_file.with_name(f".stale-{uuid.uuid4().hex}")
+            claim_file.rename(stale)
+        except FileNotFoundError:
+            self._seen.pop(claim_file.name, None)
+            return False
+        self._seen.pop(claim_file.name, None)
+        stale.unlink()
+        return True
+
+    def publish(self, workflow: Workflow, inputs: Manifest):
+        """
+        Publishes the outputs, logs and outcome of a workflow that has
+        finished.
+        :param workflow: The workflow
+        :param inputs: The files in its directory before it was run
+        """
+        results = self.directory / RESULTS_DIR
+        results.mkdir(parents=True, exist_ok=True)
+        entry = Path(tempfile.mkdtemp(prefix=".tmp-", dir=results))
+        try:
+            outputs, _ = store_outputs(workflow, inputs, entry)
+            resource_usage = workflow.resource_usage
+            metadata = dict(
+                node=self.node,
+                exit_code=workflow.exit_code,
+                duration=workflow.duration,
+                timed_out=workflow.timed_out,
+                abort_reason=workflow.abort_reason,
+                resource_usage=(None if resource_usage is None
+                                else vars(resource_usage)),
+                outputs=outputs)
+            (entry / METADATA_FILE).write_text(json.dumps(metadata))
+            try:
+                entry.rename(self._result_dir(workflow))
+            except OSError:
+                # Published by a session that took over the workflow.
+                shutil.rmtree(entry)
+        except BaseException:
+            shutil.rmtree(entry, ignore_errors=True)
+            raise
+
+    def restore(self, workflow: Workflow) -> Optional[dict]:
+        """
+        Copies the published outputs and logs of a workflow into its
+        directory.
+        :return: The metadata of the result or None if it is not published.
+        """
+        entry = self._result_dir(workflow)
+        metadata_file = entry / METADATA_FILE
+        if not metadata_file.exists():
+            return None
+        metadata = json.loads(metadata_file.read_text())
+        restore_outputs(entry, metadata["outputs"], workflow)
+        return metadata
+
+
+class SharedQueueExecutor(Executor):
+    """Runs the workflows that this session claims in a SharedQueue with
+    another executor and publishes their results. The workflows that other
+    sessions claimed are skipped, or their results are waited for and
+    restored.
+
+    The claim of a group is kept alive from the moment it is claimed until
+    all its members have finished, also while no member is running. When one
+    of them was not run to the end, the claim is released after the last
+    member has finished. Members that the queue did not run, for instance
+    because a workflow they depend on failed, finish when the queue stops.
+    """
+
+    def __init__(self, executor: Executor, shared_queue: SharedQueue,
+                 wait: bool = False):
+        """
+        :param executor: Runs the claimed workflows
+        :param shared_queue: The shared queue
+        :param wait: Wait for the results of the workflows that other
+        sessions run instead of skipping them.
+        """
+        self.executor = executor
+        self.shared_queue = shared_queue
+        self.wait = wait
+        self.poll_interval = executor.poll_interval
+        self.shares_machine = executor.shares_machine
+        # The members of each group claimed by this session that have not
+        # finished yet, and the task that keeps its claim alive.
+        self._unfinished: Dict[str, Set[str]] = {}
+        self._heartbeats: Dict[str, asyncio.Future] = {}
+        # The groups of which a member was not published.
+        self._incomplete: Set[str] = set()
+
+    async def claim(self, workflow: Workflow) -> Optional[str]:
+        """Skips the workflows that other sessions claimed, unless their
+        results are waited for."""
+        try:
+            owner = await asyncio.get_running_loop().run_in_executor(
+                None, self.shared_queue.claim, workflow)
+        except OSError as error:
+            warnings.warn(f"'{workflow.name}' could not be claimed in the "
+                          f"shared queue and is run in this session: {error}")
+            return await self.executor.claim(workflow)
+        if owner != self.shared_queue.node:
+            if not self.wait:
+                return f"'{workflow.name}' is run by {owner}."
+            return await self.executor.claim(workflow)
+        self._keep_alive(workflow)
+        skip_reason = await self.executor.claim(workflow)
+        if skip_reason is not None:
+            await self._finish(workflow, published=False)
+        return skip_reason
+
+    def submit(self, workflow: Workflow):
+        self.executor.submit(workflow)
+
+    def poll(self, workflow: Workflow) -> bool:
+        return self.executor.poll(workflow)
+
+    def cancel(self, workflow: Workflow):
+        self.executor.cancel(workflow)
+
+    def exit_code(self, workflow: Workflow) -> int:
+        return self.executor.exit_code(workflow)
+
+    async def supervise(self, workflow: Workflow):
+        """Runs the workflow when this session claimed it and publishes its
+        result. Otherwise waits until the result is published and restores
+        it. A workflow of which the claim has become stale is taken over,
+        unless the session that claimed it published its result before it
+        stopped."""
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(
+                None, self.shared_queue.claim,
+                workflow) != self.shared_queue.node:
+            metadata = await loop.run_in_executor(
+                None, self.shared_queue.restore, workflow)
+            if metadata is not None:
+                self._restore(workflow, metadata)
+                return
+            if not await loop.run_in_executor(
+                    None, self.shared_queue.remove_stale_claim, workflow):
+                await asyncio.sleep(self.poll_interval)
+        self._keep_alive(workflow)
+        metadata = await loop.run_in_executor(
+            None, self.shared_queue.restore, workflow)
+        if metadata is not None:
+            self._restore(workflow, metadata)
+            await self._finish(workflow, published=True)
+            return
+        inputs = await loop.run_in_executor(
+            None, directory_manifest, workflow)
+        await self.executor.supervise(workflow)
+        if workflow.skip_reason is not None or workflow.errors:
+            # Terminated by this session or not started at all.
+            await self._finish(workflow, published=False)
+        elif (workflow.succeeded() or
+                len(workflow.attempts) >= workflow.retries):
+            # The attempts that are retried are not published.
+            try:
+                await loop.run_in_executor(
+                    None, self.shared_queue.publish, workflow, inputs)
+            except OSError as error:
+                warnings.warn(f"The result of '{workflow.name}' could not be "
+                              f"published in the shared queue: {error}")
+                await self._finish(workflow, published=False)
+            else:
+                await self._finish(workflow, published=True)
+
+    def _keep_alive(self, workflow: Workflow):
+        """Keeps the claim of the group of a workflow that this session
+        claimed alive until all members of the group have finished."""
+        group = self.shared_queue.group_of(workflow)
+        if group not in self._heartbeats:
+            self._unfinished[group] = self.shared_queue.members(group)
+            self._heartbeats[group] = asyncio.ensure_future(
+                self._heartbeat(workflow))
+
+    async def _finish(self, workflow: Workflow, published: bool):
+        """
+        Marks a member of a claimed group as finished. After the last member
+        the claim is no longer kept alive. It is released when a member was
+        not published, so another session can run that member.
+        :param workflow: The member
+        :param published: Whether its result was published
+        """
+        group = self.shared_queue.group_of(workflow)
+        unfinished = self._unfinished.get(group)
+        if unfinished is None:
+            return
+        unfinished.discard(workflow.name)
+        if not published:
+            self._incomplete.add(group)
+        if unfinished:
+            return
+        del self._unfinished[group]
+        self._heartbeats.pop(group).cancel()
+        if group in self._incomplete:
+            self._incomplete.remove(group)
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.shared_queue.release, workflow)
+
+    async def _heartbeat(self, workflow: Workflow):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    await loop.run_in_executor(
+                        None, self.shared_queue.heartbeat, workflow)
+                except OSError:
+                    pass
+                await asyncio.sleep(HEARTBEAT_SECS)
+        except asyncio.CancelledError:
+            group = self.shared_queue.group_of(workflow)
+            if group in self._unfinished:
+                # The queue has stopped before all members of the group were
+                # run. Another session may run them. The event loop is
+                # stopping, so waiting here holds up nothing.
+                del self._unfinished[group]
+                del self._heartbeats[group]
+                self._incomplete.discard(group)
+                try:
+                    self.shared_queue.release(workflow)
+                except OSError:
+                    pass
+            raise
+
+    @staticmethod
+    def _restore(workflow: Workflow, metadata: dict):
+        """Finishes a workflow with a result that another session
+        published."""
+        workflow.mark_started()
+        for log, scanner, stream_name in (
+                (workflow.stdout_file, workflow.stdout_scanner, "stdout"),
+                (workflow.stderr_file, workflow.stderr_scanner, "stderr")):
+            if scanner is not None:
+                LogScanner(log, scanner, stream_name).close()
+        resource_usage = metadata["resource_usage"]
+        if resource_usage is not None:
+            workflow.resource_usage = ResourceUsage(**resource_usage)
+        workflow.timed_out = metadata["timed_out"]
+        workflow.abort_reason = metadata["abort_reason"]
+        workflow.run_by = metadata["node"]
+        workflow.mark_finished(metadata["exit_code"])
+        if metadata["duration"] is not None:
+            # The duration of the run, not of the wait.
+            workflow.start_time = workflow.end_time - metadata["duration"]
@@ -7,8 +7,8 @@ import subprocess
 import sys
 import warnings
 from pathlib import Path
-from typing import Callable, IO, Iterator, List, Optional, Set, Tuple, Union, \
-                   cast
+from typing import Callable, IO, Iterable, Iterator, List, Optional, Set, \
+    Tuple, Union, cast
 
 from xopen import xopen
 
@@ -27,6 +27,88 @@ def replace_whitespace(string: str, replace_with: str = '_') -> str:
     return re.sub(r'\s+', replace_with, string)
 
 
+MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3,
+                "T": 1024 ** 4}
+
+
+def parse_memory(memory: Union[int, str]) -> int:
+    """
+    Converts a memory specification into a number of bytes.
+    :param memory: A number of bytes, or a string with a number and an
+    optional K, M, G or T suffix. Suffixes are powers of 1024.
+    :return: The number of bytes
+    """
+    if isinstance(memory, int):
+        return memory
+    match = re.fullmatch(r"\s*([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)\s*",
+                         memory.upper())
+    if match is None:
+        raise ValueError(f"Invalid memory specification: '{memory}'. Use a "
+                         f"number of bytes or a number with a K, M, G or T "
+                         f"suffix.")
+    number, unit = match.groups()
+    return int(float(number) * MEMORY_UNITS[unit])
+
+
+def parse_group_limit(group_limit: str) -> Tuple[str, int]:
+    """
+    Converts a limit of a concurrency group from the command line.
+    :param group_limit: The group and the number of workflows of the group
+    that may run at the same time, for example 'database=1'.
+    :return: A tuple of the group and the number
+    """
+    group, separator, limit = group_limit.rpartition("=")
+    if not (group and separator and limit.isdigit() and int(limit) > 0):
+        raise ValueError(f"Invalid group limit: '{group_limit}'. Use "
+                         f"GROUP=N with N a number higher than 0.")
+    return group, int(limit)
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Converts a shard from the command line.
+    :param shard: The number of the shard and the number of shards, for
+    example '2/4'. Shards are numbered from 1.
+    :return: A tuple of the number of the shard and the number of shards
+    """
+    number, separator, count = shard.partition("/")
+    if not (separator and number.isdigit() and count.isdigit() and
+            0 < int(number) <= int(count)):
+        raise ValueError(f"Invalid shard: '{shard}'. Use I/N with I a "
+                         f"number from 1 to N.")
+    return int(number), int(count)
+
+
+def format_bytes(number: float) -> str:
+    """Formats a number of bytes with a binary unit prefix"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(number) < 1024:
+            return f"{number:.1f} {unit}"
+        number /= 1024
+    return f"{number:.1f} TiB"
+
+
+def newest_mtime(path: Path) -> float:
+    """The newest modification time of a directory and all files and
+    directories in it. Symbolic links are not followed. Files that disappear
+    while the directory is scanned are ignored."""
+    try:
+        newest = path.stat().st_mtime
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        newest = max(newest, newest_mtime(Path(entry.path)))
+                    else:
+                        newest = max(newest, entry.stat(
+                            follow_symlinks=False).st_mtime)
+                except FileNotFoundError:
+                    continue
+    except (FileNotFoundError, NotADirectoryError):
+        return 0.0
+    return newest
+
+
 def is_in_dir(child: Path, parent: Path, strict: bool = False) -> bool:
     """
     Checks if child path is in parent path. Works for non-existent paths if
@@ -188,6 +270,65 @@ def duplicate_tree(src: Filepath, dest: Filepath,
             copy(src_path, dest_path)
 
 
+def link_new_files(src: Filepath, dest: Filepath,
+                   exclude: Iterable[Filepath] = ()) -> None:
+    """
+    Links all files in src that are not present in dest into dest. Files are
+    hard linked, which does not take any extra disk space. When hard links are
+    not possible, for instance because src and dest are on different file
+    systems, symbolic links are created instead. Symbolic links in src are
+    recreated in dest.
+    :param src: The source directory
+    :param dest: The destination directory
+    :param exclude: Paths in src that should not be linked
+    """
+    excluded = {os.path.abspath(path) for path in exclude}
+    for dirpath, dirnames, filenames in os.walk(str(src)):
+        dest_dir = os.path.join(dest, os.path.relpath(dirpath, src))
+        os.makedirs(dest_dir, exist_ok=True)
+        # os.walk does not descend into symbolic links to directories. Those
+        # are recreated like symbolic links to files.
+        symlinked_dirs = [dirname for dirname in dirnames
+                          if os.path.islink(os.path.join(dirpath, dirname))]
+        for filename in filenames + symlinked_dirs:
+            src_path = os.path.join(dirpath, filename)
+            dest_path = os.path.join(dest_dir, filename)
+            if (os.path.lexists(dest_path) or
+                    os.path.abspath(src_path) in excluded):
+                continue
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dest_path)
+                continue
+            try:
+                os.link(src_path, dest_path)
+            except OSError:
+                os.symlink(os.path.abspath(src_path), dest_path)
+
+
+def _change_tree_mode(path: Path, change: Callable[[int], int]):
+    # Symbolic links are skipped, so the files they point to, for instance in
+    # the project directory with --symlink, keep their permissions.
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in [dirpath] + [os.path.join(dirpath, filename)
+                                 for filename in filenames]:
+            if not os.path.islink(name):
+                os.chmod(name, change(os.stat(name).st_mode))
+
+
+def make_read_only(path: Filepath) -> None:
+    """Removes the write permissions of all files and directories in a
+    directory tree."""
+    _change_tree_mode(Path(path), lambda mode: mode & ~0o222)
+
+
+def make_writable(path: Filepath) -> None:
+    """Gives the owner back the write permissions of all files and
+    directories in a directory tree."""
+    _change_tree_mode(Path(path), lambda mode: mode | 0o200)
+
+
 def link_tree(src: Filepath, dest: Filepath) -> None:
     """
     Copies a tree by mimicking the directory structure and soft-linking the
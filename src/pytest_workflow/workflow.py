@@ -20,14 +20,309 @@ on stdout, stderr and exit code.
 This file was created by A.H.B. Bollen. Multithreading functionality was added
 later.
 """
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import os
 import queue
+import re
+import resource
+import selectors
 import shlex
+import shutil
+import signal
 import subprocess
+import sys
 import tempfile
 import threading
 import time
+import warnings
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, IO, List, Optional, Set, Tuple
+
+from .placement import Placement
+from .scanner import ContentScanner
+from .util import (format_bytes, link_new_files, make_read_only,
+                   newest_mtime)
+
+# The number of seconds a workflow gets to exit after SIGTERM before it is
+# killed with SIGKILL.
+TERMINATE_GRACE_SECS = 5.0
+# The number of seconds output is still read after the workflow process has
+# exited. Background processes that keep writing to stdout or stderr would
+# otherwise keep the workflow from finishing.
+STREAM_DRAIN_SECS = 1.0
+# The number of bytes that are read from stdout or stderr at once.
+STREAM_CHUNK_SIZE = 64 * 1024
+# How often the memory use of workflows with a memory limit is checked.
+MEMORY_POLL_SECS = 0.5
+# The longest time between checks whether a workflow with a stall timeout
+# still makes progress.
+STALL_POLL_SECS = 5.0
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+# Libraries that pick their number of threads from the number of cpus of the
+# machine read these variables. Workflows that limit their threads get the
+# number of cpus they claim.
+THREAD_COUNT_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                          "OPENBLAS_NUM_THREADS")
+
+
+def exit_code_from_status(status: int) -> int:
+    """Converts a wait status into an exit code the same way as subprocess
+    does. A process killed by a signal gets the negative signal number."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def setup_variable(name: str) -> str:
+    """The environment variable with the directory of a setup workflow."""
+    return "PYTEST_WORKFLOW_SETUP_" + re.sub(r"[^A-Za-z0-9]", "_",
+                                             name).upper()
+
+
+def session_stats(session_ids: Set[int]) -> Dict[int, Dict[int, List[bytes]]]:
+    """
+    Reads /proc/<pid>/stat of the processes in the given sessions. A
+    workflow is the leader of its own session, so this includes all
+    processes it started, also the ones whose parent has exited. Returns an
+    empty dictionary where /proc is not available.
+    :param session_ids: The process ids of the session leaders
+    :return: The fields after the command name by session id and process id.
+    The first field is the state of the process, the field numbers in
+    proc(5) are 3 higher.
+    """
+    stats: Dict[int, Dict[int, List[bytes]]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return stats
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            # The process exited in the meantime.
+            continue
+        # The command name is between parentheses and may contain spaces.
+        fields = stat[stat.rindex(b")") + 2:].split()
+        session_id = int(fields[3])
+        if session_id in session_ids:
+            stats.setdefault(session_id, {})[int(entry)] = fields
+    return stats
+
+
+def session_rss(session_id: int) -> int:
+    """
+    Sums the resident set size of the processes in a session, read from
+    /proc. Returns 0 where /proc is not available.
+    :param session_id: The process id of the session leader
+    """
+    return rss_from_stats(session_stats({session_id}).get(session_id, {}))
+
+
+def rss_from_stats(processes: Dict[int, List[bytes]]) -> int:
+    """The total resident set size in bytes of processes from the fields
+    returned by session_stats for their session."""
+    return sum(int(fields[21]) * PAGE_SIZE for fields in processes.values())
+
+
+def cpu_time_from_stat(fields: List[bytes]) -> float:
+    """The user and system time in seconds from the fields returned by
+    session_stats."""
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def process_tree(session_id: int) -> str:
+    """
+    Describes the processes in a session as an indented tree with their
+    state, cpu time, the kernel function they wait in and their command
+    line. Used to find out why a workflow hangs.
+    :param session_id: The process id of the session leader
+    """
+    processes = session_stats({session_id}).get(session_id, {})
+    children: Dict[int, List[int]] = {}
+    for pid, fields in processes.items():
+        parent = int(fields[1])
+        # Processes whose parent is not in the session are shown at the top.
+        children.setdefault(parent if parent in processes else 0,
+                            []).append(pid)
+    lines: List[str] = []
+
+    def describe(pid: int, depth: int):
+        fields = processes[pid]
+        details = [fields[0].decode(),
+                   f"{cpu_time_from_stat(fields):.1f}s cpu"]
+        try:
+            wchan = Path(f"/proc/{pid}/wchan").read_text()
+            if wchan not in ("", "0"):
+                details.append(f"waiting in {wchan}")
+            command = Path(f"/proc/{pid}/cmdline").read_bytes().replace(
+                b"\0", b" ").decode(errors="replace").strip()
+        except OSError:
+            command = "(exited)"
+        lines.append(f"{'  ' * depth}{pid} [{', '.join(details)}] "
+                     f"{command}")
+        for child in sorted(children.get(pid, [])):
+            describe(child, depth + 1)
+
+    for pid in sorted(children.get(0, [])):
+        describe(pid, 0)
+    return "\n".join(lines)
+
+
+class ResourceUsage(object):
+    """The resources used by a workflow. These are collected with os.wait4,
+    so they cover the workflow process and all of its descendants that were
+    waited for."""
+
+    def __init__(self, max_rss: int, user_time: float, system_time: float,
+                 wall_time: float, block_input: int, block_output: int):
+        """
+        :param max_rss: The peak resident set size in bytes of the largest
+        process.
+        :param user_time: CPU time spent in user mode in seconds
+        :param system_time: CPU time spent in system mode in seconds
+        :param wall_time: Elapsed real time in seconds
+        :param block_input: The number of block input operations
+        :param block_output: The number of block output operations
+        """
+        self.max_rss = max_rss
+        self.user_time = user_time
+        self.system_time = system_time
+        self.wall_time = wall_time
+        self.block_input = block_input
+        self.block_output = block_output
+
+    @property
+    def cpu_time(self) -> float:
+        """The total CPU time (user + system) in seconds"""
+        return self.user_time + self.system_time
+
+    @classmethod
+    def from_rusage(cls, rusage, wall_time: float):
+        """Creates a ResourceUsage object from a resource.struct_rusage"""
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        rss_unit = 1 if sys.platform == "darwin" else 1024
+        return cls(max_rss=rusage.ru_maxrss * rss_unit,
+                   user_time=rusage.ru_utime,
+                   system_time=rusage.ru_stime,
+                   wall_time=wall_time,
+                   block_input=rusage.ru_inblock,
+                   block_output=rusage.ru_oublock)
+
+
+class ResourceSamples(object):
+    """Time series of the resources used by the processes of a running
+    workflow. The samples are added by the ResourceSampler."""
+
+    def __init__(self):
+        # Seconds since the start of the workflow.
+        self.time: List[float] = []
+        # The number of cpus used since the previous sample.
+        self.cpu: List[float] = []
+        # The resident set size of all processes together in bytes.
+        self.rss: List[int] = []
+        # Bytes read from and written to storage per second since the
+        # previous sample.
+        self.read: List[float] = []
+        self.write: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def add(self, time: float, cpu: float, rss: int, read: float,
+            write: float):
+        self.time.append(time)
+        self.cpu.append(cpu)
+        self.rss.append(rss)
+        self.read.append(read)
+        self.write.append(write)
+
+    def to_dict(self) -> Dict[str, list]:
+        """The series with the precision that is useful in a report."""
+        return dict(time=[round(value, 2) for value in self.time],
+                    cpu=[round(value, 2) for value in self.cpu],
+                    rss=self.rss,
+                    read=[round(value) for value in self.read],
+                    write=[round(value) for value in self.write])
+
+    def summary(self) -> str:
+        """Describes the peak and average of each series."""
+        def peak_and_average(values, formatter) -> str:
+            return (f"peak {formatter(max(values))}, "
+                    f"average {formatter(sum(values) / len(values))}")
+
+        def rate(number: float) -> str:
+            return f"{format_bytes(number)}/s"
+
+        return (f"cpus: {peak_and_average(self.cpu, '{:.2f}'.format)}; "
+                f"rss: {peak_and_average(self.rss, format_bytes)}; "
+                f"read: {peak_and_average(self.read, rate)}; "
+                f"write: {peak_and_average(self.write, rate)}")
+
+
+class OutputStream(object):
+    """The stdout or stderr of a workflow that is read through a pipe. The
+    output is copied to the log file and scanned."""
+
+    def __init__(self, pipe: IO[bytes], log_h: IO[bytes],
+                 scanner: ContentScanner, name: str):
+        """
+        :param pipe: The reading end of the pipe
+        :param log_h: The log file. It is closed with the stream.
+        :param scanner: The scanner that searches the output
+        :param name: 'stdout' or 'stderr'. Used in messages.
+        """
+        self.pipe = pipe
+        self.log_h = log_h
+        self.scanner = scanner
+        self.name = name
+        # Set when the scanner found an abort pattern.
+        self.abort_reason: Optional[str] = None
+        self.closed = False
+        # A read must never block the thread or event loop that reads the
+        # stream, not even after a spurious wake-up.
+        os.set_blocking(pipe.fileno(), False)
+
+    def fileno(self) -> int:
+        return self.pipe.fileno()
+
+    def read(self) -> bool:
+        """
+        Reads the output that is available.
+        :return: False when the end of the stream was reached.
+        """
+        try:
+            data = os.read(self.pipe.fileno(), STREAM_CHUNK_SIZE)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        self.log_h.write(data)
+        if self.scanner.feed(data):
+            self._set_abort_reason()
+        return True
+
+    def close(self):
+        """Scans the last line and closes the pipe and the log file."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.scanner.close():
+            self._set_abort_reason()
+        self.log_h.close()
+        self.pipe.close()
+
+    def _set_abort_reason(self):
+        self.abort_reason = (f"'{self.scanner.abort_match}' was found in its "
+                             f"{self.name}")
 
 
 class Workflow(object):
@@ -36,7 +331,23 @@ class Workflow(object):
                  command: str,
                  cwd: Optional[Path] = None,
                  name: Optional[str] = None,
-                 desired_exit_code: int = 0):
+                 desired_exit_code: int = 0,
+                 cpus: int = 1,
+                 memory: int = 0,
+                 estimated_duration: float = 0.0,
+                 timeout: Optional[float] = None,
+                 depends_on: Optional[List[str]] = None,
+                 stdout_scanner: Optional[ContentScanner] = None,
+                 stderr_scanner: Optional[ContentScanner] = None,
+                 prepare: Optional[Callable[[], None]] = None,
+                 fingerprint: Optional[str] = None,
+                 rlimits: Optional[Dict[int, int]] = None,
+                 memory_limit: Optional[int] = None,
+                 setup: bool = False,
+                 concurrency_groups: Optional[List[str]] = None,
+                 retries: int = 0,
+                 stall_timeout: Optional[float] = None,
+                 limit_threads: bool = False):
         """
         Initiates a workflow object
         :param command: The string that represents the command to be run
@@ -44,6 +355,52 @@ class Workflow(object):
         be executed. If None given will default to Path()
         :param name: An alias for the workflow. This looks nicer than a printed
         command.
+        :param desired_exit_code: The exit code the workflow should exit with
+        :param cpus: The number of cpus the workflow uses. Used by the
+        WorkflowQueue to stay within its cpu budget.
+        :param memory: The memory in bytes the workflow uses. Used by the
+        WorkflowQueue to stay within its memory budget.
+        :param estimated_duration: How long the workflow is expected to run
+        in seconds. The WorkflowQueue starts the longest workflows first.
+        :param timeout: The number of seconds the workflow may run. When it
+        takes longer it is terminated by the run method. None means no
+        timeout.
+        :param depends_on: Names of the workflows that should have finished
+        successfully before this workflow is started. Their outputs are linked
+        into the directory of this workflow.
+        :param stdout_scanner: Scans stdout while the workflow runs. When
+        given, stdout is read through a pipe and written to the stdout file.
+        When the scanner finds one of its abort patterns the workflow is
+        terminated.
+        :param stderr_scanner: The same as stdout_scanner for stderr.
+        :param prepare: Called by the WorkflowQueue right before the workflow
+        is started, for instance to create its directory. Workflows that are
+        never started do not need to be prepared.
+        :param fingerprint: Identifies the definition of the workflow in the
+        result cache, together with its input files. None means the results
+        of the workflow are not cached.
+        :param rlimits: Limits that are set with setrlimit in each process of
+        the workflow, by resource.RLIMIT_* constant.
+        :param memory_limit: The resident set size in bytes all processes of
+        the workflow may use together. The LocalExecutor terminates the
+        workflow when it uses more. None means no limit.
+        :param setup: Whether this workflow prepares something for the
+        workflows that depend on it, such as an index. Its directory is made
+        read-only when it has succeeded and is shared with the workflows that
+        depend on it, instead of linking its outputs into their directories.
+        :param concurrency_groups: Groups of workflows of which only a limited
+        number may run at the same time, by default one. The WorkflowQueue
+        enforces the limits.
+        :param retries: How many times the WorkflowQueue runs the workflow
+        again when it fails.
+        :param stall_timeout: The number of seconds the logs, the files in
+        the directory and the cpu time of the workflow may stay the same.
+        The LocalExecutor terminates the workflow when it makes no progress
+        for longer. None means the workflow is not watched.
+        :param limit_threads: Tell the tools in the workflow to start no more
+        threads than its cpus through THREAD_COUNT_VARIABLES. The
+        WorkflowQueue also does this when it keeps the workflows within a cpu
+        budget or pins them to cpus.
         """
         if command == "":
             raise ValueError("command can not be an empty string")
@@ -71,21 +428,119 @@ class Workflow(object):
         self.errors: List[Exception] = []
         self.start_lock = threading.Lock()
         self.desired_exit_code = desired_exit_code
+        self.cpus = cpus
+        self.memory = memory
+        self.estimated_duration = estimated_duration
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.timeout = timeout
+        self.timed_out = False
+        self.resource_usage: Optional[ResourceUsage] = None
+        self.depends_on: List[str] = depends_on or []
+        # The workflow objects belonging to depends_on. Resolved by the
+        # WorkflowQueue.
+        self.dependencies: List["Workflow"] = []
+        # Why the workflow was not run or why it was terminated before it
+        # could finish. None when it ran to completion.
+        self.skip_reason: Optional[str] = None
+        # Ensures the process is reaped only once.
+        self._reap_lock = threading.Lock()
+        self.stdout_scanner = stdout_scanner
+        self.stderr_scanner = stderr_scanner
+        self.prepare = prepare
+        self.fingerprint = fingerprint
+        # Whether the results were restored from the result cache instead of
+        # running the workflow.
+        self.from_cache = False
+        # The session that ran the workflow when its result was published in
+        # a shared queue by another session.
+        self.run_by: Optional[str] = None
+        # Why the workflow was aborted by a scanner. None when it was not.
+        self.abort_reason: Optional[str] = None
+        # The streams that are read through a pipe. Created when the workflow
+        # is started.
+        self.output_streams: List[OutputStream] = []
+        self._stream_threads: List[threading.Thread] = []
+        # Set by executors that do not run the workflow as a local process.
+        self._submitted = False
+        self._exit_code: Optional[int] = None
+        self._finished = threading.Event()
+        # Called in the child process before the command is executed, for
+        # instance to pin it to cpus. Set by the Placement of the queue.
+        self.preexec: Optional[Callable[[], None]] = None
+        self.rlimits: Dict[int, int] = rlimits or {}
+        self.memory_limit = memory_limit
+        self.setup = setup
+        self.concurrency_groups: List[str] = concurrency_groups or []
+        self.retries = retries
+        self.stall_timeout = stall_timeout
+        self.limit_threads = limit_threads
+        # The number of threads the tools may start when the workflow does
+        # not limit them to its cpus. The WorkflowQueue sets it to a fair
+        # share of the machine. None means no hints are given.
+        self.default_threads: Optional[int] = None
+        # The state of the processes when the workflow stalled.
+        self.stall_report: Optional[str] = None
+        # The status and duration of the earlier attempts that failed.
+        self.attempts: List[Tuple[str, Optional[float]]] = []
+        # How the workflow was placed on the machine, for the report.
+        self.allocation: Dict[str, str] = {}
+        self.samples = ResourceSamples()
 
-    def start(self):
+    def start(self, stream_in_threads: bool = True):
         """Runs the workflow in a subprocess in the background.
-        To make sure the workflow is finished use the `.wait()` method"""
+        To make sure the workflow is finished use the `.wait()` method
+        :param stream_in_threads: Read the streams that have a scanner in a
+        thread per stream. When False, the caller should read the
+        output_streams itself, for instance from an event loop.
+        """
         # The lock ensures that the workflow is started only once, even if it
         # is started from multiple threads.
         with self.start_lock:
             if not self._started:
                 try:
-                    stdout_h = self.stdout_file.open('wb')
-                    stderr_h = self.stderr_file.open('wb')
+                    # Unbuffered, so output that is streamed to the files can
+                    # be followed with ``tail -f``.
+                    stdout_h = self.stdout_file.open('wb', buffering=0)
+                    stderr_h = self.stderr_file.open('wb', buffering=0)
                     sub_process_args = shlex.split(self.command)
+                    self.start_time = time.monotonic()
+                    # A new session makes the workflow the leader of its own
+                    # process group, so all of its processes can be
+                    # terminated together. Streams without a scanner are
+                    # written to their file directly by the workflow.
                     self._popen = subprocess.Popen(
-                        sub_process_args, stdout=stdout_h,
-                        stderr=stderr_h, cwd=str(self.cwd))
+                        sub_process_args,
+                        stdout=(subprocess.PIPE if self.stdout_scanner
+                                else stdout_h),
+                        stderr=(subprocess.PIPE if self.stderr_scanner
+                                else stderr_h),
+                        cwd=str(self.cwd),
+                        env={**os.environ, **self.environment()},
+                        start_new_session=True,
+                        preexec_fn=(self._preexec
+                                    if self.rlimits or self.preexec
+                                    else None))
+                    for pipe, log_h, scanner, stream_name in (
+                            (self._popen.stdout, stdout_h,
+                             self.stdout_scanner, "stdout"),
+                            (self._popen.stderr, stderr_h,
+                             self.stderr_scanner, "stderr")):
+                        if pipe is None or scanner is None:
+                            continue
+                        # The stream gets its own file descriptor, because
+                        # the handles are closed below.
+                        log_copy = os.fdopen(os.dup(log_h.fileno()), 'wb',
+                                             buffering=0)
+                        self.output_streams.append(
+                            OutputStream(pipe, log_copy, scanner,
+                                         stream_name))
+                    if stream_in_threads:
+                        for stream in self.output_streams:
+                            thread = threading.Thread(
+                                target=self._stream_output, args=(stream,))
+                            thread.start()
+                            self._stream_threads.append(thread)
                 except Exception as error:
                     # Append the error so it can be raised in the main thread.
                     self.errors.append(error)
@@ -96,9 +551,240 @@ class Workflow(object):
             else:
                 raise ValueError("Workflows can only be started once")
 
+    def _preexec(self):
+        """Runs in the child process before the command is executed."""
+        for limit, value in self.rlimits.items():
+            # The limits can not be raised above the hard limit.
+            _, hard = resource.getrlimit(limit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(limit, (value, value))
+        if self.preexec is not None:
+            self.preexec()
+
+    def progress_state(self) -> Tuple[int, float, float]:
+        """
+        The size of the logs, the newest modification time of the files in
+        the directory and the cpu time of the processes of the workflow. When
+        none of these change the workflow makes no progress.
+        """
+        log_size = 0
+        for log in (self.stdout_file, self.stderr_file):
+            try:
+                log_size += log.stat().st_size
+            except FileNotFoundError:
+                pass
+        cpu_time = 0.0
+        if self._popen is not None:
+            session_id = self._popen.pid
+            processes = session_stats({session_id}).get(session_id, {})
+            cpu_time = sum(cpu_time_from_stat(fields)
+                           for fields in processes.values())
+        return log_size, newest_mtime(self.cwd), cpu_time
+
+    def thread_count_hints(self) -> Dict[str, str]:
+        """The environment variables that tell the tools in the workflow how
+        many threads they may use. Without these, tools such as OpenMP and
+        BLAS libraries start a thread for every cpu of the machine, even
+        when the workflow shares the machine with other workflows. The
+        number of cpus is always in PYTEST_WORKFLOW_CPUS. The other variables
+        are set to the number of cpus when the workflow limits its threads,
+        otherwise to its default number of threads, if any. They are never
+        overridden when they are set already."""
+        hints = {"PYTEST_WORKFLOW_CPUS": str(max(self.cpus, 1))}
+        if self.limit_threads:
+            threads = max(self.cpus, 1)
+        elif self.default_threads is not None:
+            threads = self.default_threads
+        else:
+            return hints
+        hints.update((variable, str(threads))
+                     for variable in THREAD_COUNT_VARIABLES
+                     if variable not in os.environ)
+        return hints
+
+    def environment(self) -> Dict[str, str]:
+        """The environment variables the workflow is run with on top of the
+        environment of pytest. The directory of each setup workflow it
+        depends on is in PYTEST_WORKFLOW_SETUP_<NAME>, with the name in upper
+        case and other characters than letters and digits replaced by '_'."""
+        environment = self.thread_count_hints()
+        for dependency in self.dependencies:
+            if dependency.setup:
+                environment[setup_variable(dependency.name)] = str(
+                    dependency.cwd.absolute())
+        return environment
+
+    def _stream_output(self, stream: "OutputStream"):
+        """
+        Reads an output stream until it ends. Runs in its own thread.
+        :param stream: The stdout or stderr stream of this workflow
+        """
+        drain_deadline: Optional[float] = None
+        with selectors.DefaultSelector() as selector:
+            selector.register(stream, selectors.EVENT_READ)
+            while True:
+                if selector.select(timeout=0.05):
+                    if not stream.read():
+                        break
+                    if stream.abort_reason is not None:
+                        self.abort(stream.abort_reason)
+                    if drain_deadline is None or (
+                            time.monotonic() < drain_deadline):
+                        continue
+                # There is no more output for now. Stop when the workflow has
+                # exited, even if a background process still holds the pipe.
+                if self._popen is not None and (
+                        self._popen.returncode is not None):
+                    if drain_deadline is None:
+                        drain_deadline = time.monotonic() + STREAM_DRAIN_SECS
+                    elif time.monotonic() >= drain_deadline:
+                        break
+        stream.close()
+        if stream.abort_reason is not None:
+            self.abort(stream.abort_reason)
+
+    def abort(self, reason: str, terminate: bool = True):
+        """
+        Terminates the workflow in the background because it can not succeed
+        anymore. Only the first reason is kept.
+        :param reason: Why the workflow is aborted. Reported in the exit code
+        test.
+        :param terminate: Whether to start a thread that terminates the
+        workflow. Callers that terminate the workflow themselves should set
+        this to False.
+        """
+        if self.abort_reason is not None:
+            return
+        self.abort_reason = reason
+        if terminate:
+            # Terminating takes up to the grace period. It is done in a
+            # separate thread so the output keeps being read in the meantime.
+            threading.Thread(target=self.terminate, daemon=True).start()
+
+    def skip(self, reason: str):
+        """
+        Marks the workflow as not run. Waiting on a skipped workflow returns
+        immediately.
+        :param reason: Why the workflow is not run
+        """
+        with self.start_lock:
+            if self._started:
+                raise ValueError("Only workflows that have not started can be "
+                                 "skipped")
+            self.skip_reason = reason
+            self._started = True
+
+    def reset(self):
+        """Forgets the outcome of a failed attempt, so the workflow can be
+        started again. The attempt is added to attempts."""
+        with self.start_lock:
+            self.attempts.append((self.status(), self.duration))
+            self._popen = None
+            self._started = False
+            self.start_time = None
+            self.end_time = None
+            self.timed_out = False
+            self.resource_usage = None
+            self.abort_reason = None
+            self.from_cache = False
+            self.run_by = None
+            self.output_streams = []
+            self._stream_threads = []
+            self._submitted = False
+            self._exit_code = None
+            self._finished = threading.Event()
+            self.preexec = None
+            self.allocation = {}
+            self.samples = ResourceSamples()
+            self.stall_report = None
+            for scanner in (self.stdout_scanner, self.stderr_scanner):
+                if scanner is not None:
+                    scanner.reset()
+
+    def status(self) -> str:
+        """Describes how the workflow ended."""
+        if self.errors:
+            return "python error during starting"
+        if self.timed_out:
+            return f"timed out after {self.timeout} seconds"
+        if self.abort_reason is not None:
+            return f"aborted because {self.abort_reason}"
+        if self.skip_reason is not None:
+            return self.skip_reason
+        if self.from_cache:
+            return "restored from the result cache"
+        if self.succeeded():
+            return "succeeded"
+        return f"failed with exit code {self.exit_code}"
+
+    def mark_started(self):
+        """Marks the workflow as started by an executor that does not run it
+        as a local process."""
+        with self.start_lock:
+            if self._started:
+                raise ValueError("Workflows can only be started once")
+            self.start_time = time.monotonic()
+            self._submitted = True
+            self._started = True
+
+    def mark_finished(self, exit_code: Optional[int]):
+        """
+        Marks a workflow that was started with mark_started as finished.
+        :param exit_code: The exit code of the workflow. None when it is not
+        known, for instance because submitting the workflow failed.
+        """
+        self.end_time = time.monotonic()
+        self._exit_code = exit_code
+        self._finished.set()
+
+    def succeeded(self) -> bool:
+        """Checks if the workflow ran and exited with the desired exit
+        code."""
+        return (self.skip_reason is None and not self.errors and
+                self.matching_exitcode())
+
     def run(self):
-        """Runs the workflow and blocks until it is finished"""
+        """Runs the workflow and blocks until it is finished. When the
+        workflow takes longer than its timeout it is terminated."""
         self.start()
+        try:
+            self.wait(timeout_secs=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.timed_out = True
+            self.terminate()
+
+    def send_signal(self, signum: int):
+        """Sends a signal to all processes in the process group of the
+        workflow."""
+        # The start lock ensures a workflow that is being started receives
+        # the signal as well.
+        with self.start_lock:
+            if self._popen is None:
+                return
+            pid = self._popen.pid
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            # All processes in the group have already exited.
+            pass
+
+    def terminate(self, grace_secs: float = TERMINATE_GRACE_SECS):
+        """
+        Terminates all processes of the workflow. The process group is sent
+        SIGTERM first. Processes that are still there after the grace period
+        are killed with SIGKILL.
+        :param grace_secs: The number of seconds between SIGTERM and SIGKILL
+        """
+        if self._popen is None:
+            return
+        self.send_signal(signal.SIGTERM)
+        try:
+            self.wait(timeout_secs=grace_secs)
+        except subprocess.TimeoutExpired:
+            pass
+        # Also kill the processes in the group that outlived the group leader.
+        self.send_signal(signal.SIGKILL)
         self.wait()
 
     def wait(self, timeout_secs: Optional[float] = None,
@@ -126,18 +812,89 @@ class Workflow(object):
             time.sleep(wait_interval_secs)
             wait_time += wait_interval_secs
 
-        # Stdout and stderr are written to files. So popen.wait() does not
-        # block process completion with long stderr or stdout.
-        if timeout_secs is not None and self._popen is not None:
-            # Wait for timeout_secs number of secs minus te time that was
-            # already spent waiting for the workflow to start
-            self._popen.wait(timeout_secs - wait_time)
-        elif self._popen is not None:
-            self._popen.wait()
-        else:
-            # If self._popen is none, something went wrong during starting the
-            # workflow
-            pass
+        if self._popen is None:
+            if self._submitted:
+                # Run by an executor. Finished when it has been marked so.
+                if timeout_secs is None:
+                    self._finished.wait()
+                elif not self._finished.wait(
+                        max(timeout_secs - wait_time, 0.0)):
+                    raise subprocess.TimeoutExpired(self.command,
+                                                    timeout_secs)
+            # Otherwise something went wrong during starting the workflow.
+            return
+        # Stdout and stderr are written to files. So waiting does not block
+        # process completion with long stderr or stdout.
+        if timeout_secs is None and hasattr(os, "waitid"):
+            # Block until the process has exited without reaping it. That way
+            # multiple threads can wait while only one thread reaps.
+            if self._popen.returncode is None:
+                try:
+                    os.waitid(os.P_PID, self._popen.pid,
+                              os.WEXITED | os.WNOWAIT)
+                except ChildProcessError:
+                    # Already reaped by another thread.
+                    pass
+            self._reap()
+            self._join_streams()
+            return
+        # Without os.waitid, for instance on macOS before python 3.13, the
+        # process is polled. Wait for timeout_secs number of secs minus the
+        # time that was already spent waiting for the workflow to start.
+        remaining_secs = (float("inf") if timeout_secs is None
+                          else timeout_secs - wait_time)
+        deadline = time.monotonic() + remaining_secs
+        poll_interval = 0.0005
+        while not self._reap():
+            if time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.command, remaining_secs)
+            time.sleep(poll_interval)
+            # Poll quickly for short running workflows, but not too often for
+            # long running ones. Popen.wait uses the same strategy.
+            poll_interval = min(poll_interval * 2, 0.05,
+                                max(deadline - time.monotonic(), 0))
+        self._join_streams()
+
+    def _join_streams(self):
+        """Waits until all output of the exited workflow has been written to
+        the log files and scanned."""
+        for thread in self._stream_threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _reap(self) -> bool:
+        """
+        Collects the exit status and resource usage of the workflow process
+        with os.wait4 if it has exited. Does not block.
+        :return: Whether the process has exited.
+        """
+        assert self._popen is not None
+        with self._reap_lock:
+            if self._popen.returncode is not None:
+                return True
+            try:
+                pid, status, rusage = os.wait4(self._popen.pid, os.WNOHANG)
+            except ChildProcessError:
+                # The process was reaped outside of pytest-workflow. The exit
+                # code and resource usage can not be retrieved anymore.
+                self._popen.wait()
+                self.end_time = time.monotonic()
+                return True
+            if pid == 0:
+                return False
+            self.end_time = time.monotonic()
+            self._popen.returncode = exit_code_from_status(status)
+            self.resource_usage = ResourceUsage.from_rusage(
+                rusage, wall_time=self.end_time - (self.start_time or 0.0))
+            return True
+
+    @property
+    def duration(self) -> Optional[float]:
+        """The time in seconds the workflow ran. None if it has not
+        finished."""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
 
     def matching_exitcode(self) -> bool:
         """Checks if the workflow exited with the desired exit code"""
@@ -162,20 +919,406 @@ class Workflow(object):
         self.wait()
         if self._popen is not None:
             return self._popen.returncode
+        elif self._exit_code is not None:
+            return self._exit_code
         else:
             raise ValueError("No exit code after waiting. Please contact the "
                              "developers and report this issue.")
 
 
+class Executor(object):
+    """
+    Runs workflows for the WorkflowQueue. The queue submits a workflow and
+    polls it until it has finished. A workflow is cancelled when it times
+    out, when an abort pattern is found in its output or when the session is
+    stopped.
+
+    Subclasses implement submit, poll, cancel and exit_code. These may block,
+    so they are called from a thread and not from the event loop.
+    """
+    # The number of seconds between two polls of a running workflow.
+    poll_interval = 1.0
+    # Whether the workflows run on the machine of the session, so the ones
+    # that run at the same time share its cpus.
+    shares_machine = False
+
+    def submit(self, workflow: Workflow):
+        """
+        Starts a workflow. Its stdout and stderr should be written to
+        workflow.stdout_file and workflow.stderr_file.
+        :param workflow: A workflow that has not started
+        """
+        raise NotImplementedError
+
+    def poll(self, workflow: Workflow) -> bool:
+        """
+        Checks whether a submitted workflow has finished.
+        :param workflow: A submitted workflow
+        """
+        raise NotImplementedError
+
+    def cancel(self, workflow: Workflow):
+        """
+        Asks a submitted workflow to stop. Does not wait for it to stop.
+        :param workflow: A submitted workflow
+        """
+        raise NotImplementedError
+
+    def exit_code(self, workflow: Workflow) -> int:
+        """
+        Fetches the exit code of a finished workflow.
+        :param workflow: A workflow for which poll returned True
+        """
+        raise NotImplementedError
+
+    async def claim(self, workflow: Workflow) -> Optional[str]:
+        """
+        Decides whether a workflow that was taken from the queue is run in
+        this session. Called before its directory is prepared.
+        :param workflow: A workflow that has not started
+        :return: None when the workflow is run, otherwise why it is skipped
+        """
+        return None
+
+    async def supervise(self, workflow: Workflow):
+        """
+        Submits a workflow and polls it until it has finished. Its logs are
+        scanned while it runs, so an abort pattern cancels the workflow.
+        :param workflow: A workflow that has not started
+        """
+        loop = asyncio.get_running_loop()
+        workflow.mark_started()
+        try:
+            await loop.run_in_executor(None, self.submit, workflow)
+        except Exception as error:
+            workflow.errors.append(error)
+            workflow.mark_finished(None)
+            return
+        logs = [LogScanner(log, scanner, stream_name)
+                for log, scanner, stream_name in (
+                    (workflow.stdout_file, workflow.stdout_scanner, "stdout"),
+                    (workflow.stderr_file, workflow.stderr_scanner, "stderr"))
+                if scanner is not None]
+        deadline = (None if workflow.timeout is None
+                    else time.monotonic() + workflow.timeout)
+        cancelled_at: Optional[float] = None
+        exit_code: Optional[int] = None
+        try:
+            while True:
+                finished = await loop.run_in_executor(
+                    None, self.poll, workflow)
+                for log in logs:
+                    log.scan()
+                    if log.abort_reason is not None:
+                        workflow.abort(log.abort_reason, terminate=False)
+                if finished:
+                    exit_code = await loop.run_in_executor(
+                        None, self.exit_code, workflow)
+                    break
+                now = time.monotonic()
+                if cancelled_at is None:
+                    if deadline is not None and now >= deadline:
+                        workflow.timed_out = True
+                    if workflow.timed_out or (
+                            workflow.abort_reason is not None):
+                        await loop.run_in_executor(
+                            None, self.cancel, workflow)
+                        cancelled_at = now
+                elif now - cancelled_at >= TERMINATE_GRACE_SECS:
+                    # The workflow did not report that it stopped. Treat it
+                    # like a process that had to be killed.
+                    exit_code = -signal.SIGKILL
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            for log in logs:
+                log.close()
+            workflow.mark_finished(exit_code)
+
+
+class LogScanner(object):
+    """Scans a log file that is being written by a workflow that does not run
+    as a local process."""
+
+    def __init__(self, path: Path, scanner: ContentScanner, name: str):
+        """
+        :param path: The log file
+        :param scanner: Scans the content of the log
+        :param name: stdout or stderr. Used in the abort reason.
+        """
+        self.path = path
+        self.scanner = scanner
+        self.name = name
+        self.offset = 0
+        self.abort_reason: Optional[str] = None
+
+    def scan(self):
+        """Scans the part of the log that was written since the last scan."""
+        try:
+            with self.path.open("rb") as log:
+                log.seek(self.offset)
+                while True:
+                    data = log.read(STREAM_CHUNK_SIZE)
+                    if not data:
+                        break
+                    self.offset += len(data)
+                    if self.scanner.feed(data):
+                        self._set_abort_reason()
+        except FileNotFoundError:
+            # The workflow has not created its log yet.
+            pass
+
+    def close(self):
+        """Scans the rest of the log. Should be called when the workflow has
+        finished."""
+        self.scan()
+        if self.scanner.close():
+            self._set_abort_reason()
+
+    def _set_abort_reason(self):
+        if self.abort_reason is None:
+            self.abort_reason = (f"'{self.scanner.abort_match}' was found in "
+                                 f"its {self.name}")
+
+
+class LocalExecutor(Executor):
+    """Runs workflows as processes on the local machine. This is the default
+    executor. The number of simultaneous workflows is limited by the
+    WorkflowQueue, so this acts as a local process pool."""
+    shares_machine = True
+
+    def __init__(self):
+        # The running workflows with a memory limit and the function that
+        # aborts each of them. They are watched by a single task.
+        self._memory_watched: Dict[Workflow, Callable[[str], None]] = {}
+        self._memory_watcher: Optional[asyncio.Future] = None
+
+    def submit(self, workflow: Workflow):
+        workflow.start()
+
+    def poll(self, workflow: Workflow) -> bool:
+        return workflow._popen is None or workflow._reap()
+
+    def cancel(self, workflow: Workflow):
+        workflow.send_signal(signal.SIGTERM)
+
+    def exit_code(self, workflow: Workflow) -> int:
+        return workflow.exit_code
+
+    async def supervise(self, workflow: Workflow):
+        """Starts a workflow and waits until it has exited and its output has
+        been read. Terminates the workflow when it times out or when an abort
+        pattern is found in its output. The exit is signalled to the event
+        loop, so the workflow does not need to be polled."""
+        workflow.start(stream_in_threads=False)
+        if workflow._popen is None:
+            # Starting failed. The error is in workflow.errors.
+            return
+        aborted = asyncio.Event()
+
+        def abort(reason: str):
+            workflow.abort(reason, terminate=False)
+            aborted.set()
+
+        exited = asyncio.ensure_future(self._wait_for_exit(workflow))
+        abort_waiter = asyncio.ensure_future(aborted.wait())
+        readers = [asyncio.ensure_future(self._read_stream(stream, abort))
+                   for stream in workflow.output_streams]
+        watchers = []
+        if workflow.memory_limit is not None:
+            self._memory_watched[workflow] = abort
+            if self._memory_watcher is None or self._memory_watcher.done():
+                self._memory_watcher = asyncio.ensure_future(
+                    self._watch_memory())
+        if workflow.stall_timeout is not None:
+            watchers.append(asyncio.ensure_future(
+                self._watch_progress(workflow, abort)))
+        try:
+            done, _ = await asyncio.wait(
+                {exited, abort_waiter}, timeout=workflow.timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+            if not exited.done():
+                if not done:
+                    workflow.timed_out = True
+                await self._terminate(workflow, exited)
+            if readers:
+                # Background processes may keep the output open after the
+                # workflow has exited.
+                await asyncio.wait(readers, timeout=STREAM_DRAIN_SECS)
+        finally:
+            self._memory_watched.pop(workflow, None)
+            for future in [exited, abort_waiter] + readers + watchers:
+                future.cancel()
+
+    @staticmethod
+    async def _wait_for_exit(workflow: Workflow):
+        """Waits until the workflow process has exited and reaps it. On Linux
+        a pidfd signals the exit to the event loop. Elsewhere the process is
+        polled."""
+        assert workflow._popen is not None
+        try:
+            pidfd: Optional[int] = os.pidfd_open(  # type: ignore[attr-defined]  # noqa: E501
+                workflow._popen.pid)
+        except (AttributeError, OSError):
+            # Not available, or the process has already been reaped.
+            pidfd = None
+        if pidfd is None:
+            poll_interval = 0.0005
+            while not workflow._reap():
+                await asyncio.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, 0.05)
+            return
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(pidfd, readable.set)
+        try:
+            while not workflow._reap():
+                await readable.wait()
+                readable.clear()
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+    @staticmethod
+    async def _read_stream(stream: OutputStream,
+                           abort: Callable[[str], None]):
+        """Reads an output stream whenever it is readable until it ends."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(stream.fileno(), readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                if not stream.read():
+                    break
+                if stream.abort_reason is not None:
+                    abort(stream.abort_reason)
+        finally:
+            loop.remove_reader(stream.fileno())
+            stream.close()
+        if stream.abort_reason is not None:
+            abort(stream.abort_reason)
+
+    async def _watch_memory(self):
+        """Aborts the workflows whose processes together use more memory
+        than their memory limit, until no workflow with a memory limit is
+        running. /proc is read once for all workflows, like the
+        ResourceSampler does, instead of once for each workflow."""
+        loop = asyncio.get_running_loop()
+        while self._memory_watched:
+            sessions = {workflow._popen.pid: workflow  # type: ignore
+                        for workflow in self._memory_watched}
+            # Reading /proc takes a while on busy machines, so it is done
+            # outside the event loop.
+            stats = await loop.run_in_executor(None, session_stats,
+                                               set(sessions))
+            for session_id, workflow in sessions.items():
+                abort = self._memory_watched.get(workflow)
+                if abort is None:
+                    # Finished in the meantime.
+                    continue
+                memory_limit: int = workflow.memory_limit  # type: ignore
+                rss = rss_from_stats(stats.get(session_id, {}))
+                if rss > memory_limit:
+                    del self._memory_watched[workflow]
+                    abort(f"memory limit exceeded: its processes used "
+                          f"{format_bytes(rss)} of "
+                          f"{format_bytes(memory_limit)}")
+            await asyncio.sleep(MEMORY_POLL_SECS)
+
+    @staticmethod
+    async def _watch_progress(workflow: Workflow,
+                              abort: Callable[[str], None]):
+        """Aborts the workflow when its logs, its files and its cpu time have
+        not changed for longer than its stall timeout. The state of its
+        processes is saved in its stall_report first."""
+        assert workflow._popen is not None
+        assert workflow.stall_timeout is not None
+        loop = asyncio.get_running_loop()
+        poll_interval = min(workflow.stall_timeout / 4, STALL_POLL_SECS)
+        state = None
+        last_progress = time.monotonic()
+        while True:
+            # Walking the directory may take a while.
+            new_state = await loop.run_in_executor(
+                None, workflow.progress_state)
+            now = time.monotonic()
+            if new_state != state:
+                state = new_state
+                last_progress = now
+            elif now - last_progress >= workflow.stall_timeout:
+                workflow.stall_report = await loop.run_in_executor(
+                    None, process_tree, workflow._popen.pid)
+                abort(f"it stalled: its logs, files and cpu time did not "
+                      f"change for {workflow.stall_timeout} seconds")
+                return
+            await asyncio.sleep(poll_interval)
+
+    @staticmethod
+    async def _terminate(workflow: Workflow, exited: asyncio.Future,
+                         grace_secs: float = TERMINATE_GRACE_SECS):
+        """The event loop version of Workflow.terminate"""
+        workflow.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.shield(exited), grace_secs)
+        except asyncio.TimeoutError:
+            pass
+        # Also kill the processes in the group that outlived the group leader.
+        workflow.send_signal(signal.SIGKILL)
+        await exited
+
+
 class WorkflowQueue(queue.Queue):
     """A Queue object that will keep running 'n' numbers of workflows
-    simultaneously until the queue is empty."""
+    simultaneously until the queue is empty. Optionally the running workflows
+    are kept within a budget of cpus and memory.
+
+    All workflows are supervised from a single asyncio event loop. The loop
+    waits for the processes to exit and reads their output, so no thread is
+    needed per running workflow."""
 
     def __init__(self):
         # No argument for maxsize. This queue is infinite.
         super().__init__()
         # Collect errors during thread processing.
         self._process_errors = []
+        # Workflows that have finished, in order of completion.
+        self.finished: List[Workflow] = []
+        # The workflows that are currently running and the budget they have to
+        # fit in. These are guarded by the mutex of the queue.
+        self._running: List[Workflow] = []
+        self._cpus: Optional[int] = None
+        self._memory: Optional[int] = None
+        # The number of workflows that may run at the same time.
+        self._number_of_workflows = 1
+        # Scheduling priority of each workflow. Higher is started earlier.
+        self._priority: Dict[Workflow, float] = {}
+        # Fail-fast settings. After max_failures workflows have failed no new
+        # workflows are started.
+        self._max_failures: Optional[int] = None
+        self._terminate_on_failure = False
+        self._failures = 0
+        # The workflows that may be started by the current call of process.
+        # None means all workflows.
+        self._selected: Optional[Set[Workflow]] = None
+        self._dependencies_resolved = False
+        self._executor: Executor = LocalExecutor()
+        # Prints the messages about the progress of the queue. Can be
+        # replaced to show the messages elsewhere.
+        self.report: Callable[[str], None] = print
+        # Called with each workflow that finished or was skipped.
+        self._on_finished: Optional[Callable[[Workflow], None]] = None
+        self._placement: Optional[Placement] = None
+        # The number of workflows of each concurrency group that may run at
+        # the same time. Groups that are not in here have a limit of one.
+        self._group_limits: Dict[str, int] = {}
+        # Retried workflows that may only run when no other workflows run.
+        self._retry_alone = False
+        self._run_alone: Set[Workflow] = set()
+        # Set when the queue is cancelled, so failed workflows are not
+        # retried anymore.
+        self._cancelled = False
 
     def put(self, item, block=True, timeout=None):
         """Like Queue.put() but tests if item is a Workflow"""
@@ -185,49 +1328,478 @@ class WorkflowQueue(queue.Queue):
             raise ValueError("Only Workflow type objects can be submitted to "
                              "this queue.")
 
-    # Queue processing with workers example taken from
-    # https://docs.python.org/3.5/library/queue.html?highlight=queue#queue.Queue.join  # noqa
-    def process(self, number_of_threads: int = 1):
+    def process(self, number_of_threads: int = 1,
+                cpus: Optional[int] = None,
+                memory: Optional[int] = None,
+                max_failures: Optional[int] = None,
+                terminate_on_failure: bool = False,
+                workflows: Optional[List[Workflow]] = None,
+                executor: Optional[Executor] = None,
+                on_finished: Optional[Callable[[Workflow], None]] = None,
+                placement: Optional[Placement] = None,
+                group_limits: Optional[Dict[str, int]] = None,
+                retry_alone: bool = False):
         """
-        Processes the workflow queue with a number of threads
-        :param number_of_threads: The number of threads
+        Processes the workflow queue
+        :param number_of_threads: The number of workflows that run
+        simultaneously. The name is kept from when every workflow had its
+        own thread.
+        :param cpus: The number of cpus all running workflows may use
+        together. None means no limit.
+        :param memory: The memory in bytes all running workflows may use
+        together. None means no limit.
+        :param max_failures: Stop starting new workflows after this many
+        workflows did not succeed. The workflows that were not started are
+        skipped. None means all workflows are run.
+        :param terminate_on_failure: Also terminate the running workflows
+        when max_failures is reached.
+        :param workflows: Only run these workflows and the workflows they
+        depend on. The other workflows stay in the queue, so process can be
+        called again for them later. None means all workflows are run.
+        :param executor: Runs the workflows. None means the workflows are run
+        as local processes.
+        :param on_finished: Called with each workflow that has finished or
+        was skipped, from the thread that processes the queue. It should not
+        block.
+        :param placement: Places the workflows on the cpus and disks of the
+        machine when they are started. None means the workflows are not
+        placed.
+        :param group_limits: The number of workflows of a concurrency group
+        that may run at the same time. Groups without a limit are mutually
+        exclusive: their workflows run one at a time. Workflows that are held
+        back by their group leave their slot to other workflows.
+        :param retry_alone: Run the workflows that are retried after a
+        failure when no other workflows are running, so they are not
+        disturbed by them.
         """
-        threads = []
-        for _ in range(number_of_threads):
-            thread = threading.Thread(target=self.worker)
-            thread.start()
-            threads.append(thread)
-        self.join()
+        self._executor = executor or LocalExecutor()
+        self._on_finished = on_finished
+        self._placement = placement
+        self._group_limits = group_limits or {}
+        self._retry_alone = retry_alone
+        self._cpus = cpus
+        self._memory = memory
+        self._number_of_workflows = max(number_of_threads, 1)
+        self._max_failures = max_failures
+        self._terminate_on_failure = terminate_on_failure
+        with self.mutex:
+            # Dependencies are resolved on the first call, when all workflows
+            # are still in the queue.
+            if not self._dependencies_resolved:
+                self._resolve_dependencies()
+                self._dependencies_resolved = True
+            self._selected = (None if workflows is None
+                              else self._with_dependencies(workflows))
+            selected_workflows = [workflow for workflow in self.queue
+                                  if self._selected is None or
+                                  workflow in self._selected]
+        for workflow in selected_workflows:
+            if not self._fits_budget(workflow.cpus, workflow.memory):
+                warnings.warn(
+                    f"'{workflow.name}' requires more resources than the "
+                    f"budget allows. It will be run when no other workflows "
+                    f"are running.")
+        # asyncio.run is not used, because it cancels the running tasks on a
+        # KeyboardInterrupt before the workflows could be terminated.
+        loop = asyncio.new_event_loop()
+        # The default executor is owned here, because
+        # loop.shutdown_default_executor requires python 3.9.
+        thread_pool = concurrent.futures.ThreadPoolExecutor()
+        loop.set_default_executor(thread_pool)
+        try:
+            loop.run_until_complete(
+                self._process_async(self._number_of_workflows))
+        except BaseException:
+            # For instance a KeyboardInterrupt. The workflows run in their own
+            # process group so they do not receive the interrupt themselves.
+            self.cancel()
+            raise
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True))
+            thread_pool.shutdown(wait=True)
+            loop.close()
         # If errors are detected raise the first error. Raising all errors
         # is not possible.
         if len(self._process_errors) > 0:
             raise self._process_errors[0]
-        for thread in threads:
-            thread.join()
 
-    def worker(self):
+    async def _process_async(self, number_of_workflows: int):
+        """Starts workflows whenever a slot and resources are available until
+        the queue is empty."""
+        running: Set[asyncio.Future] = set()
+        while True:
+            while len(running) < number_of_workflows:
+                workflow = self._take_fitting_workflow()
+                if workflow is None:
+                    break
+                running.add(asyncio.ensure_future(
+                    self._run_workflow(workflow)))
+            if not running:
+                # Nothing is running, so nothing can become available
+                # anymore. _take_fitting_workflow always returns a workflow
+                # when the queue is not empty and nothing is running.
+                break
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # Raises unexpected errors.
+                task.result()
+
+    @staticmethod
+    def _with_dependencies(workflows: List[Workflow]) -> Set[Workflow]:
+        """Returns the workflows and everything they depend on, directly or
+        indirectly."""
+        selected: Set[Workflow] = set()
+        to_visit = list(workflows)
+        while to_visit:
+            workflow = to_visit.pop()
+            if workflow not in selected:
+                selected.add(workflow)
+                to_visit.extend(workflow.dependencies)
+        return selected
+
+    def _resolve_dependencies(self):
         """
-        Run workflows until the queue is empty
+        Links each queued workflow to the workflows it depends on and
+        determines the scheduling priorities. Workflows that depend on a
+        workflow that is not in the queue are skipped. Must be called while
+        holding the mutex.
         """
-        while True:
+        by_name = {workflow.name: workflow for workflow in self.queue}
+        for workflow in list(self.queue):
+            missing = [name for name in workflow.depends_on
+                       if name not in by_name]
+            if missing:
+                self._discard(workflow, f"'{workflow.name}' was not run "
+                                        f"because '{missing[0]}' is not run "
+                                        f"in this session.")
+            workflow.dependencies = [by_name[name]
+                                     for name in workflow.depends_on
+                                     if name in by_name]
+
+        dependents: Dict[Workflow, List[Workflow]] = {
+            workflow: [] for workflow in by_name.values()}
+        for workflow in by_name.values():
+            for dependency in workflow.dependencies:
+                dependents[dependency].append(workflow)
+
+        # The priority of a workflow is the longest estimated duration of any
+        # chain of workflows that starts with it. Starting the workflows with
+        # the longest chain first is longest-processing-time-first scheduling
+        # generalized to dependencies.
+        self._priority.clear()
+        in_progress: List[Workflow] = []
+
+        def priority(workflow: Workflow) -> float:
+            if workflow in self._priority:
+                return self._priority[workflow]
+            if workflow in in_progress:
+                cycle = in_progress[in_progress.index(workflow):] + [workflow]
+                raise ValueError(
+                    f"Workflows depend on each other in a cycle: "
+                    f"{' -> '.join(repr(w.name) for w in cycle)}")
+            in_progress.append(workflow)
+            self._priority[workflow] = workflow.estimated_duration + max(
+                (priority(dependent) for dependent in dependents[workflow]),
+                default=0.0)
+            in_progress.pop()
+            return self._priority[workflow]
+
+        for workflow in by_name.values():
+            priority(workflow)
+
+    def cancel(self, reason: str = "the session was cancelled",
+               terminate_running: bool = True,
+               grace_secs: float = TERMINATE_GRACE_SECS):
+        """
+        Removes all workflows that have not started from the queue and
+        terminates all running workflows.
+        :param reason: Why the workflows are not run or terminated. Used in
+        their skip reason.
+        :param terminate_running: Whether the running workflows are
+        terminated. When False they are allowed to finish.
+        :param grace_secs: The number of seconds between SIGTERM and SIGKILL
+        """
+        with self.mutex:
+            self._cancelled = True
+            for workflow in list(self.queue):
+                self._discard(workflow, f"'{workflow.name}' was not run "
+                                        f"because {reason}.")
+            running = list(self._running) if terminate_running else []
+        for workflow in running:
+            workflow.skip_reason = (f"'{workflow.name}' was terminated "
+                                    f"because {reason}.")
+            self._executor.cancel(workflow)
+        deadline = time.monotonic() + grace_secs
+        for workflow in running:
             try:
-                # We know the type is Workflow, because this was enforced in
-                # the put method.
-                workflow: Workflow = self.get_nowait()
-            except queue.Empty:
-                break
-            else:
-                print(
-                    f"\n{workflow.name}:\n"
-                    f"\tcommand:   {workflow.command}\n"
-                    f"\tdirectory: {workflow.cwd}\n"
-                    f"\tstdout:    {workflow.stdout_file}\n"
-                    f"\tstderr:    {workflow.stderr_file}")
-                workflow.run()
-                # Collect the workflow errors.
-                self._process_errors.extend(workflow.errors)
-                self.task_done()
-                # Some reporting
-                result = ("python error during starting"
-                          if workflow.errors else "done")
-                print(f"'{workflow.name}' {result}.")
+                workflow.wait(
+                    timeout_secs=max(deadline - time.monotonic(), 0.0))
+            except subprocess.TimeoutExpired:
+                pass
+        for workflow in running:
+            workflow.send_signal(signal.SIGKILL)
+
+    def _discard(self, workflow: Workflow, reason: str):
+        """
+        Removes a workflow from the queue without running it. Must be called
+        while holding the mutex.
+        :param workflow: A workflow in the queue
+        :param reason: Why the workflow is not run
+        """
+        self.queue.remove(workflow)
+        workflow.skip(reason)
+        self.finished.append(workflow)
+        self.report(f"'{workflow.name}' skipped.")
+        if self._on_finished is not None:
+            self._on_finished(workflow)
+        # The discarded workflow will never be marked as done by a worker.
+        self.unfinished_tasks -= 1
+        if self.unfinished_tasks == 0:
+            self.all_tasks_done.notify_all()
+
+    def snapshot(self) -> Tuple[List[Workflow], List[Workflow],
+                                List[Workflow]]:
+        """
+        Returns the running, queued and finished workflows at this moment.
+        """
+        with self.mutex:
+            return (list(self._running), list(self.queue),
+                    list(self.finished))
+
+    def _fits_budget(self, cpus: int, memory: int) -> bool:
+        return ((self._cpus is None or cpus <= self._cpus) and
+                (self._memory is None or memory <= self._memory))
+
+    def _take_fitting_workflow(self) -> Optional[Workflow]:
+        """
+        Takes the workflow with the highest priority from the queue whose
+        dependencies have finished, whose concurrency groups are below their
+        limits and that fits in the resources that are not used by the
+        running workflows. Workflows of which a dependency
+        did not succeed are skipped.
+
+        Starting the longest workflows first prevents a long workflow that
+        was collected last from dominating the total run time. Workflows with
+        the same priority are started in collection order.
+        :return: A workflow or None if no workflow can be started now.
+        """
+        with self.mutex:
+            used_cpus = sum(running.cpus for running in self._running)
+            used_memory = sum(running.memory for running in self._running)
+            running_groups = collections.Counter(
+                group for running in self._running
+                for group in running.concurrency_groups)
+            if any(running in self._run_alone for running in self._running):
+                return None
+            by_priority = sorted(
+                self.queue,
+                key=lambda queued: self._priority.get(
+                    queued, queued.estimated_duration),
+                reverse=True)
+            for workflow in by_priority:
+                if (self._selected is not None and
+                        workflow not in self._selected):
+                    continue
+                unfinished = [dependency
+                              for dependency in workflow.dependencies
+                              if dependency not in self.finished]
+                if unfinished:
+                    continue
+                failed = [dependency
+                          for dependency in workflow.dependencies
+                          if not dependency.succeeded()]
+                if failed:
+                    self._discard(
+                        workflow, f"'{workflow.name}' was not run because "
+                                  f"'{failed[0].name}' did not succeed.")
+                    continue
+                if any(running_groups[group] >=
+                       self._group_limits.get(group, 1)
+                       for group in workflow.concurrency_groups):
+                    continue
+                if workflow in self._run_alone and self._running:
+                    continue
+                # A workflow that is larger than the entire budget can only
+                # run when nothing else is running.
+                if (not self._running or self._fits_budget(
+                        used_cpus + workflow.cpus,
+                        used_memory + workflow.memory)):
+                    self.queue.remove(workflow)
+                    self._running.append(workflow)
+                    return workflow
+            return None
+
+    def _release(self, workflow: Workflow) -> bool:
+        """
+        Returns the resources of a finished workflow to the budget.
+        :return: Whether the workflow caused the maximum number of failures
+        to be reached.
+        """
+        with self.mutex:
+            self._running.remove(workflow)
+            self.finished.append(workflow)
+            # Workflows that were skipped or terminated by fail-fast did not
+            # fail by themselves.
+            if workflow.skip_reason is None and not workflow.succeeded():
+                self._failures += 1
+                return self._failures == self._max_failures
+            return False
+
+    def _may_retry(self, workflow: Workflow) -> bool:
+        # Workflows that were terminated by the queue, or that could not be
+        # started at all, would not do better a second time.
+        return (not workflow.succeeded() and workflow.skip_reason is None and
+                not workflow.errors and
+                len(workflow.attempts) < workflow.retries)
+
+    def _requeue(self, workflow: Workflow) -> bool:
+        """
+        Puts a failed workflow back in the queue to be retried in a fresh
+        directory. The workflow stays a task of the queue.
+        :return: Whether the workflow was put back. False when the queue was
+        cancelled in the meantime.
+        """
+        with self.mutex:
+            if self._cancelled:
+                return False
+            self._running.remove(workflow)
+            workflow.reset()
+            if workflow.prepare is not None:
+                # The queue created the directory, so it can make a new one.
+                # The old directory is moved aside, which is quick, and
+                # removed in a thread, so the retry does not hold up the
+                # other workflows.
+                old_cwd = tempfile.mkdtemp(prefix=f".{workflow.cwd.name}.",
+                                           dir=workflow.cwd.parent)
+                try:
+                    os.replace(workflow.cwd, old_cwd)
+                except OSError:
+                    shutil.rmtree(workflow.cwd, ignore_errors=True)
+                asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(shutil.rmtree, old_cwd,
+                                            ignore_errors=True))
+            if self._retry_alone:
+                self._run_alone.add(workflow)
+            self.queue.append(workflow)
+            return True
+
+    @staticmethod
+    def _link_dependency_outputs(workflow: Workflow):
+        """Links the files produced by the dependencies of a workflow into its
+        directory."""
+        for dependency in workflow.dependencies:
+            # Setup workflows are shared through an environment variable.
+            if (dependency.setup or
+                    dependency.cwd.resolve() == workflow.cwd.resolve()):
+                continue
+            link_new_files(dependency.cwd, workflow.cwd,
+                           exclude=[dependency.stdout_file,
+                                    dependency.stderr_file])
+
+    async def _run_workflow(self, workflow: Workflow):
+        """Runs a workflow that was taken from the queue and reports on it."""
+        skip_reason = await self._executor.claim(workflow)
+        if skip_reason is not None:
+            workflow.skip(skip_reason)
+            self._release(workflow)
+            self.report(f"'{workflow.name}' skipped.")
+            if self._on_finished is not None:
+                self._on_finished(workflow)
+            self.task_done()
+            return
+        if self._placement is not None:
+            self._placement.claim(workflow)
+        if self._cpus is not None or (self._placement is not None and
+                                      self._placement.pins_cpus):
+            workflow.limit_threads = True
+        elif self._executor.shares_machine:
+            # Without a cpu budget the workflows that may run at the same
+            # time share the cpus of the machine equally.
+            workflow.default_threads = max(
+                (os.cpu_count() or 1) // self._number_of_workflows, 1)
+        self.report(
+            f"\n{workflow.name}:\n"
+            f"\tcommand:   {workflow.command}\n"
+            f"\tdirectory: {workflow.cwd}\n"
+            f"\tstdout:    {workflow.stdout_file}\n"
+            f"\tstderr:    {workflow.stderr_file}" +
+            "".join(f"\n\t{key + ':':<10} {value}"
+                    for key, value in workflow.allocation.items()))
+        stop = False
+        retry = False
+        try:
+            loop = asyncio.get_running_loop()
+            if workflow.prepare is not None:
+                # Copying the directory can take long. It is done in a
+                # thread, so the running workflows are still supervised.
+                await loop.run_in_executor(None, workflow.prepare)
+            if any(not dependency.setup
+                   for dependency in workflow.dependencies):
+                await loop.run_in_executor(
+                    None, self._link_dependency_outputs, workflow)
+        except OSError as error:
+            workflow.errors.append(error)
+            workflow.skip(f"'{workflow.name}' was not run because its "
+                          f"directory could not be prepared.")
+        else:
+            await self._executor.supervise(workflow)
+            if workflow.setup and workflow.succeeded():
+                # The directory is shared by the workflows that depend on
+                # it, so none of them may change it. Walking it can take
+                # long, so it is done in a thread.
+                await loop.run_in_executor(
+                    None, make_read_only, workflow.cwd)
+            retry = self._may_retry(workflow)
+        finally:
+            if self._placement is not None:
+                self._placement.release(workflow)
+            retry = retry and self._requeue(workflow)
+            if not retry:
+                stop = self._release(workflow)
+        if retry:
+            status, duration = workflow.attempts[-1]
+            self.report(
+                f"'{workflow.name}' {status} after {duration or 0.0:.1f} "
+                f"seconds. Retrying, attempt {len(workflow.attempts) + 1} of "
+                f"{workflow.retries + 1}.")
+            return
+        # Collect the workflow errors.
+        self._process_errors.extend(workflow.errors)
+        # Some reporting
+        if workflow.errors:
+            result = "python error during starting"
+        elif workflow.timed_out:
+            result = f"timed out after {workflow.timeout} seconds"
+        elif workflow.abort_reason is not None:
+            result = f"aborted because {workflow.abort_reason}"
+        elif workflow.skip_reason is not None:
+            result = "terminated"
+        elif workflow.from_cache:
+            result = "restored from the result cache"
+        elif workflow.run_by is not None:
+            result = f"run by {workflow.run_by}"
+        else:
+            result = "done"
+        if workflow.attempts:
+            result += f" after {len(workflow.attempts) + 1} attempts"
+        self.report(f"'{workflow.name}' {result}.")
+        if self._on_finished is not None:
+            self._on_finished(workflow)
+        if stop:
+            self.report(f"Stopping the workflow queue because "
+                        f"'{workflow.name}' failed.")
+            # Cancelling waits for the running workflows to exit. It is done
+            # in a thread, so the event loop keeps reading their output and
+            # the queue is emptied before this workflow is marked as done.
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(
+                    self.cancel,
+                    f"the session was stopped after '{workflow.name}' failed",
+                    terminate_running=self._terminate_on_failure))
+        self.task_done()
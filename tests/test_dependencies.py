@@ -0,0 +1,143 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for workflows that depend on other workflows"""
+
+import textwrap
+
+import jsonschema
+
+import pytest
+
+from pytest_workflow.schema import validate_schema
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+DEPENDENCY_TESTS = textwrap.dedent("""\
+- name: downstream
+  command: bash -c 'cat index.txt > result.txt'
+  depends_on:
+    - index
+  files:
+    - path: result.txt
+      contains:
+        - "indexed"
+- name: index
+  command: bash -c 'sleep 0.2; echo indexed > index.txt'
+""")
+
+
+def test_dependency_outputs_linked(pytester, tmp_path_factory):
+    pytester.makefile(".yml", test=DEPENDENCY_TESTS)
+    basetemp = tmp_path_factory.mktemp("basetemp")
+    result = pytester.runpytest("-v", "--wt", "2", "--kwd",
+                                "--basetemp", str(basetemp))
+    result.assert_outcomes(passed=4)
+    upstream = basetemp / "index" / "index.txt"
+    downstream = basetemp / "downstream" / "index.txt"
+    # Hard linked, so no copy was made.
+    assert upstream.stat().st_ino == downstream.stat().st_ino
+
+
+def test_dependency_outputs_in_place(tmp_path):
+    upstream = Workflow(
+        "bash -c 'mkdir -p nested/deeper && echo x > nested/deeper/file.txt "
+        "&& echo x > appended.txt'", cwd=tmp_path / "upstream",
+        name="upstream", prepare=(tmp_path / "upstream").mkdir)
+    downstream = Workflow(
+        "bash -c 'sed -i s/x/y/ nested/deeper/file.txt && "
+        "echo y >> appended.txt'", cwd=tmp_path / "downstream",
+        name="downstream", depends_on=["upstream"],
+        prepare=(tmp_path / "downstream").mkdir)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(upstream)
+    workflow_queue.put(downstream)
+    workflow_queue.process()
+    assert downstream.exit_code == 0
+    # sed -i replaces the file, so the nested file of upstream is unchanged.
+    assert (tmp_path / "upstream" / "nested" / "deeper" /
+            "file.txt").read_text() == "x\n"
+    assert (tmp_path / "downstream" / "nested" / "deeper" /
+            "file.txt").read_text() == "y\n"
+    # Appending changes the hard linked file of upstream as well.
+    assert (tmp_path / "upstream" / "appended.txt").read_text() == "x\ny\n"
+
+
+def test_dependency_failed(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: upstream
+      command: bash -c 'exit 1'
+    - name: downstream
+      command: echo moo
+      depends_on:
+        - upstream
+      files:
+        - path: moo.txt
+    - name: further downstream
+      command: echo moo
+      depends_on:
+        - downstream
+    """))
+    pytester.makepyfile(textwrap.dedent("""\
+    import pytest
+
+    @pytest.mark.workflow('downstream')
+    def test_custom(workflow_dir):
+        assert False
+    """))
+    result = pytester.runpytest("-v", "-rs")
+    result.assert_outcomes(failed=1, skipped=4)
+    assert ("'downstream' was not run because 'upstream' did not succeed."
+            in result.stdout.str())
+    assert ("'further downstream' was not run because 'downstream' did not "
+            "succeed." in result.stdout.str())
+
+
+def test_dependency_not_in_session(pytester):
+    pytester.makefile(".yml", test=DEPENDENCY_TESTS)
+    result = pytester.runpytest("-v", "-rs", "--tag", "downstream")
+    result.assert_outcomes(skipped=3)
+    assert ("'downstream' was not run because 'index' is not run in this "
+            "session." in result.stdout.str())
+
+
+def test_dependency_cycle():
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(Workflow("echo a", name="a", depends_on=["b"]))
+    workflow_queue.put(Workflow("echo b", name="b", depends_on=["a"]))
+    with pytest.raises(ValueError) as error:
+        workflow_queue.process()
+    error.match("Workflows depend on each other in a cycle: 'a' -> 'b' -> "
+                "'a'")
+
+
+def test_dependency_critical_path_first():
+    # 'short' has a long workflow depending on it, so it should be started
+    # before 'medium'.
+    workflow_queue = WorkflowQueue()
+    medium = Workflow("echo medium", estimated_duration=5)
+    short = Workflow("echo short", name="short", estimated_duration=1)
+    long = Workflow("echo long", estimated_duration=10, depends_on=["short"])
+    for workflow in (medium, long, short):
+        workflow_queue.put(workflow)
+    workflow_queue.process(1)
+    assert workflow_queue.finished == [short, long, medium]
+
+
+def test_depends_on_itself():
+    with pytest.raises(jsonschema.ValidationError) as error:
+        validate_schema([dict(name="loop", command="echo moo",
+                              depends_on=["loop"])])
+    error.match("Workflow 'loop' can not depend on itself.")
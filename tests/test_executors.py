@@ -0,0 +1,176 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for running workflows with other executors than local processes"""
+
+import signal
+import textwrap
+from pathlib import Path
+from typing import List
+
+from pytest_workflow.batch import BatchExecutor
+from pytest_workflow.scanner import ContentScanner
+from pytest_workflow.workflow import Executor, Workflow, WorkflowQueue
+
+# A scheduler that runs the job script in the background in its own process
+# group. The process id is the job id.
+SUBMIT_SCRIPT = textwrap.dedent("""\
+    #!/bin/sh
+    setsid sh "$1" > /dev/null 2>&1 < /dev/null &
+    echo "Submitted batch job $!"
+    """)
+
+
+class FakeExecutor(Executor):
+    """Finishes workflows by writing their logs itself."""
+    poll_interval = 0.01
+
+    def __init__(self, stdout: bytes = b"", exit_code: int = 0,
+                 polls: int = 1):
+        self.stdout = stdout
+        self.returncode = exit_code
+        self.polls = polls
+        self.cancelled: List[Workflow] = []
+
+    def submit(self, workflow):
+        workflow.stdout_file.write_bytes(self.stdout)
+        workflow.stderr_file.write_bytes(b"")
+
+    def poll(self, workflow):
+        self.polls -= 1
+        return self.polls <= 0
+
+    def cancel(self, workflow):
+        self.cancelled.append(workflow)
+        self.polls = 0
+
+    def exit_code(self, workflow):
+        return self.returncode
+
+
+def test_executor_exit_code_and_scanning(tmp_path):
+    workflow = Workflow("echo moo", cwd=tmp_path,
+                        stdout_scanner=ContentScanner(["moo"]))
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(
+        executor=FakeExecutor(stdout=b"moo\n", exit_code=3, polls=3))
+    assert workflow.exit_code == 3
+    assert workflow.duration is not None
+    assert workflow.resource_usage is None
+    assert workflow.stdout_scanner.found_strings == {"moo"}
+
+
+def test_executor_abort_cancels(tmp_path):
+    workflow = Workflow("echo moo", cwd=tmp_path,
+                        stdout_scanner=ContentScanner(
+                            abort_patterns=["ERROR"]))
+    executor = FakeExecutor(stdout=b"ERROR\n", polls=1000)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(executor=executor)
+    assert executor.cancelled == [workflow]
+    assert workflow.abort_reason == "'ERROR' was found in its stdout"
+
+
+def test_executor_timeout_cancels(tmp_path):
+    workflow = Workflow("echo moo", cwd=tmp_path, timeout=0.05)
+    executor = FakeExecutor(polls=1000)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(executor=executor)
+    assert executor.cancelled == [workflow]
+    assert workflow.timed_out
+
+
+def stub_scheduler(directory: Path) -> str:
+    script = directory / "submit.sh"
+    script.write_text(SUBMIT_SCRIPT)
+    script.chmod(0o755)
+    return f"{script} {{script}}"
+
+
+def test_batch_executor(tmp_path):
+    workflow = Workflow("bash -c 'echo moo; echo boo >&2; exit 3'",
+                        cwd=tmp_path)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(executor=BatchExecutor(
+        stub_scheduler(tmp_path), poll_interval=0.05))
+    assert workflow.exit_code == 3
+    assert workflow.stdout == b"moo\n"
+    assert workflow.stderr == b"boo\n"
+
+
+def test_batch_executor_lost_job(tmp_path):
+    workflow = Workflow("echo moo", cwd=tmp_path)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(executor=BatchExecutor(
+        "echo 42", poll_command="false", poll_interval=0.05))
+    assert workflow.exit_code == -signal.SIGKILL
+
+
+def test_batch_executor_job_script(tmp_path, monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    workflow = Workflow("echo 'moo boo'", cwd=tmp_path / "my dir",
+                        limit_threads=True)
+    script = BatchExecutor("sbatch {script}").job_script(workflow)
+    assert f"cd '{tmp_path}/my dir' && echo 'moo boo' > " in script
+    assert " OMP_NUM_THREADS=1 " in script
+
+
+def test_batch_executor_option(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: sleeping
+          command: sleep 30
+          timeout: 0.5
+        - name: moo
+          command: echo moo
+          stdout:
+            contains:
+              - moo
+        """))
+    result = pytester.runpytest(
+        "-v", "--workflow-executor", "batch",
+        "--workflow-submit-command", stub_scheduler(pytester.path),
+        "--workflow-poll-command", "kill -0 {job_id}",
+        "--workflow-cancel-command", "kill -TERM -- -{job_id}",
+        "--workflow-poll-interval", "0.05")
+    result.stdout.fnmatch_lines([
+        "*'sleeping' timed out after 0.5 seconds and was terminated.*"])
+    assert result.parseoutcomes() == {"passed": 2, "failed": 1}
+
+
+def test_batch_executor_requires_submit_command(pytester):
+    pytester.makefile(".yml", test="- name: moo\n  command: echo moo\n")
+    result = pytester.runpytest("--workflow-executor", "batch")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*--workflow-submit-command is required*"])
+
+
+def test_executor_hook(pytester, tmp_path):
+    submit_command = stub_scheduler(pytester.path)
+    pytester.makeconftest(textwrap.dedent(f"""\
+        from pytest_workflow.batch import BatchExecutor
+
+        def pytest_workflow_executor(config):
+            return BatchExecutor("{submit_command}", poll_interval=0.05)
+        """))
+    pytester.makefile(".yml", test="- name: moo\n  command: echo moo\n")
+    result = pytester.runpytest("-v", "--kwd", "--basetemp", str(tmp_path))
+    assert result.ret == 0
+    assert (tmp_path / "moo" / "log.job").exists()
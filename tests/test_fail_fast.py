@@ -0,0 +1,58 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for stopping the workflow queue after failures"""
+
+import textwrap
+
+import pytest
+
+FAIL_FAST_TESTS = textwrap.dedent("""\
+- name: failing
+  command: bash -c "exit 1"
+- name: not started
+  command: echo moo
+  depends_on:
+    - other
+- name: other
+  command: echo other
+""")
+
+
+def test_fail_fast(pytester):
+    pytester.makefile(".yml", test=FAIL_FAST_TESTS)
+    result = pytester.runpytest("-v", "-rs", "--workflow-fail-fast")
+    result.stdout.fnmatch_lines([
+        "Stopping the workflow queue because 'failing' failed.",
+        "*'other' was not run because the session was stopped after "
+        "'failing' failed.*"])
+    assert result.parseoutcomes() == {"failed": 1, "skipped": 2}
+
+
+def test_fail_fast_maxfail(pytester):
+    pytester.makefile(".yml", test=FAIL_FAST_TESTS)
+    result = pytester.runpytest("-v", "-x")
+    result.stdout.fnmatch_lines([
+        "Stopping the workflow queue because 'failing' failed."])
+    assert "'other' done." not in result.stdout.str()
+
+
+@pytest.mark.parametrize("option", [[], ["--maxfail", "2"]])
+def test_no_fail_fast(pytester, option):
+    pytester.makefile(".yml", test=FAIL_FAST_TESTS)
+    result = pytester.runpytest("-v", *option)
+    assert "Stopping the workflow queue" not in result.stdout.str()
+    assert result.parseoutcomes()["passed"] == 2
@@ -146,6 +146,20 @@ FAILURE_MESSAGE_TESTS: List[Tuple[str, str]] = [
             - "^He.*"
      """,
      "to file::file.txt::content::does not contain '^He.*"),
+    ("""\
+    - name: hanging workflow
+      command: sleep 10
+      timeout: 0.2
+    """,
+     "'hanging workflow' timed out after 0.2 seconds and was terminated."),
+    ("""\
+    - name: out of memory
+      command: bash -c 'echo "java.lang.OutOfMemoryError" >&2; sleep 10'
+      abort_on:
+        - OutOfMemoryError
+    """,
+     "'out of memory' was terminated because 'OutOfMemoryError' was found in "
+     "its stderr."),
 ]
 
 
@@ -179,3 +193,13 @@ def test_messages_exitcode(test: str, message: str, pytester):
     # possible due to multiple levels of process launching.
     result = pytester.runpytest("-v", "--sb", "5")
     assert message in result.stdout.str()
+
+
+def test_messages_workflow_timeout_option(pytester):
+    pytester.makefile(".yml", textwrap.dedent("""\
+    - name: hanging workflow
+      command: sleep 10
+    """))
+    result = pytester.runpytest("-v", "--workflow-timeout", "0.2")
+    assert ("'hanging workflow' timed out after 0.2 seconds and was "
+            "terminated.") in result.stdout.str()
@@ -0,0 +1,81 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for the duration history and longest-first scheduling"""
+
+import json
+import textwrap
+
+from pytest_workflow.history import DURATIONS_CACHE_KEY, WorkflowHistory
+
+
+def test_history_no_cache():
+    history = WorkflowHistory()
+    assert history.estimate("unknown") == 0.0
+    history.record("known", 2.0)
+    history.save()
+    assert history.estimate("known") == 2.0
+
+
+def test_history_default_estimate_is_median():
+    history = WorkflowHistory()
+    for name, duration in (("a", 1.0), ("b", 10.0), ("c", 3.0)):
+        history.record(name, duration)
+    assert history.estimate("new") == 3.0
+
+
+def test_history_estimate_from_similar_workflows():
+    history = WorkflowHistory()
+    for name, duration in (("a", 1.0), ("m[1]", 20.0), ("m[2]", 30.0)):
+        history.record(name, duration)
+    assert history.estimate("m[3]", ["m[1]", "m[2]", "m[3]"]) == 25.0
+    assert history.estimate("new", ["other"]) == 20.0
+    assert history.estimate("m[4]", ["m[1]", "m[2]", "m[4]"], "m") == 25.0
+    # Durations recorded later are taken into account.
+    history.record("m[1]", 40.0)
+    assert history.estimate("m[4]", ["m[1]", "m[2]", "m[4]"], "m") == 35.0
+
+
+HISTORY_TESTS = textwrap.dedent("""\
+- name: short
+  command: sleep 0.1
+- name: long
+  command: sleep 0.5
+""")
+
+
+def test_history_longest_first(pytester):
+    pytester.makefile(".yml", test=HISTORY_TESTS)
+    first_run = pytester.runpytest("-v").stdout.str()
+    assert first_run.index("short:") < first_run.index("long:")
+    cache_file = (pytester.path / ".pytest_cache" / "v" /
+                  DURATIONS_CACHE_KEY)
+    durations = json.loads(cache_file.read_text())
+    assert durations["long"] > durations["short"]
+    # The second time the longest workflow is started first.
+    second_run = pytester.runpytest("-v").stdout.str()
+    assert second_run.index("long:") < second_run.index("short:")
+
+
+def test_history_failing_workflow_not_recorded(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: failing
+      command: bash -c 'exit 1'
+    """))
+    pytester.runpytest("-v")
+    cache_file = (pytester.path / ".pytest_cache" / "v" /
+                  DURATIONS_CACHE_KEY)
+    assert json.loads(cache_file.read_text()) == {}
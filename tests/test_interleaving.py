@@ -0,0 +1,75 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for running the tests of a workflow as soon as it has finished"""
+
+import textwrap
+import time
+
+INTERLEAVING_TESTS = textwrap.dedent("""\
+- name: slow
+  command: sleep {sleep}
+- name: fast
+  command: bash -c "exit {exit_code}"
+""")
+
+
+def test_tests_run_when_workflow_finishes(pytester):
+    pytester.makefile(".yml", test=INTERLEAVING_TESTS.format(sleep=2,
+                                                             exit_code=0))
+    pytester.makepyfile(test_plain="def test_plain():\n    pass\n")
+    result = pytester.runpytest("-v", "--wt", "2")
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        "*test_plain.py::test_plain PASSED*",
+        "*test.yml::fast::exit code should be 0 PASSED*",
+        "'slow' done.",
+        "*test.yml::slow::exit code should be 0 PASSED*"])
+
+
+def test_first_failure_stops_session(pytester):
+    pytester.makefile(".yml", test=INTERLEAVING_TESTS.format(sleep=30,
+                                                             exit_code=1))
+    start = time.monotonic()
+    result = pytester.runpytest("-v", "--wt", "2", "-x")
+    assert time.monotonic() - start < 15
+    result.stdout.fnmatch_lines([
+        "*test.yml::fast::exit code should be 0 FAILED*"])
+    assert result.parseoutcomes() == {"failed": 1}
+
+
+def test_session_fixtures_are_kept(pytester):
+    pytester.makefile(".yml", test=INTERLEAVING_TESTS.format(sleep=0.5,
+                                                             exit_code=0))
+    pytester.makeconftest(textwrap.dedent("""\
+        import pytest
+
+        SETUPS = []
+
+        @pytest.fixture(scope="session")
+        def session_fixture():
+            SETUPS.append(1)
+            return len(SETUPS)
+        """))
+    pytester.makepyfile(test_custom=textwrap.dedent("""\
+        import pytest
+
+        @pytest.mark.workflow("slow", "fast")
+        def test_workflow(workflow_dir, session_fixture):
+            assert session_fixture == 1
+        """))
+    result = pytester.runpytest("-v", "--wt", "2")
+    assert result.parseoutcomes() == {"passed": 4}
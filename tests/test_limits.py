@@ -0,0 +1,107 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for the limits that are enforced while a workflow runs"""
+
+import os
+import resource
+import sys
+import textwrap
+import time
+
+from pytest_workflow import workflow as workflow_module
+from pytest_workflow.schema import WorkflowTest
+from pytest_workflow.workflow import (Workflow, WorkflowQueue, session_rss,
+                                      session_stats)
+
+ALLOCATE_COMMAND = (
+    f"{sys.executable} -c \"import time; data = bytearray(200 * 2 ** 20); "
+    f"time.sleep(30)\"")
+
+
+def test_session_rss():
+    assert session_rss(os.getsid(0)) > 0
+    assert session_rss(-1) == 0
+
+
+def test_limits_from_schema():
+    workflow_test = WorkflowTest.from_schema(dict(
+        name="limited", command="echo limited",
+        limits=dict(memory="1G", address_space="2G", file_size=1024,
+                    open_files=64)))
+    assert workflow_test.limits.memory == 1024 ** 3
+    assert workflow_test.limits.address_space == 2 * 1024 ** 3
+    assert workflow_test.limits.file_size == 1024
+    assert workflow_test.limits.open_files == 64
+
+
+def test_workflow_rlimits():
+    workflow = Workflow("bash -c 'ulimit -n; ulimit -f'",
+                        rlimits={resource.RLIMIT_NOFILE: 64,
+                                 resource.RLIMIT_FSIZE: 1024 ** 2})
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+    # ulimit -f reports the file size in blocks of 1024 bytes.
+    assert workflow.stdout.decode().split() == ["64", "1024"]
+
+
+def test_workflow_memory_limit():
+    workflow = Workflow(ALLOCATE_COMMAND, memory_limit=50 * 2 ** 20)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    start = time.monotonic()
+    workflow_queue.process()
+    assert time.monotonic() - start < 15
+    assert workflow.abort_reason is not None
+    assert workflow.abort_reason.startswith("memory limit exceeded")
+
+
+def test_memory_limits_share_one_scan(monkeypatch):
+    scans = []
+
+    def counting_session_stats(session_ids):
+        scans.append(set(session_ids))
+        return session_stats(session_ids)
+
+    monkeypatch.setattr(workflow_module, "session_stats",
+                        counting_session_stats)
+    workflows = [Workflow("sleep 1", memory_limit=2 ** 30) for _ in range(3)]
+    hungry = Workflow(ALLOCATE_COMMAND, memory_limit=50 * 2 ** 20)
+    workflow_queue = WorkflowQueue()
+    for workflow in workflows + [hungry]:
+        workflow_queue.put(workflow)
+    workflow_queue.process(number_of_threads=4)
+    # All running workflows are measured in the same scan of /proc.
+    assert max(len(session_ids) for session_ids in scans) == 4
+    assert hungry.abort_reason is not None
+    assert all(workflow.succeeded() for workflow in workflows)
+
+
+def test_memory_limit_reported(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent(f"""\
+        - name: hungry
+          command: {ALLOCATE_COMMAND}
+          limits:
+            memory: 50M
+        """))
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines([
+        "'hungry' aborted because memory limit exceeded: its processes used "
+        "* of 50.0 MiB.",
+        "*'hungry' was terminated because memory limit exceeded*"])
+    assert result.parseoutcomes() == {"failed": 1}
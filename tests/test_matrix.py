@@ -0,0 +1,135 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for expanding the matrix of a workflow test"""
+
+import textwrap
+
+import jsonschema
+
+import pytest
+
+from pytest_workflow.schema import (expand_matrix, validate_schema,
+                                    variant_names, workflow_tests_from_schema)
+
+MATRIX_TEST = dict(
+    name="align {aligner}",
+    command="echo {aligner} {reads} ${HOME}",
+    matrix=dict(aligner=["bwa", "bowtie"], reads=[1, 2]),
+    files=[dict(path="{aligner}/{reads}.bam", contains=["{aligner}"])])
+
+
+def test_expand_matrix():
+    variants = list(expand_matrix(MATRIX_TEST))
+    assert [variant["name"] for variant in variants] == [
+        "align bwa[1]", "align bwa[2]", "align bowtie[1]", "align bowtie[2]"]
+    assert variants[0]["command"] == "echo bwa 1 ${HOME}"
+    assert variants[0]["files"] == [dict(path="bwa/1.bam", contains=["bwa"])]
+    assert "matrix" not in variants[0]
+    assert variant_names(MATRIX_TEST) == [v["name"] for v in variants]
+
+
+def test_expand_matrix_without_matrix():
+    test = dict(name="plain {aligner}", command="echo {aligner}")
+    assert list(expand_matrix(test)) == [test]
+
+
+def test_expand_matrix_booleans():
+    test = dict(name="flag", command="tool --fast={fast}",
+                matrix=dict(fast=[True, False]))
+    assert [v["command"] for v in expand_matrix(test)] == [
+        "tool --fast=true", "tool --fast=false"]
+
+
+def test_workflow_tests_from_schema_matrix():
+    workflow_tests = workflow_tests_from_schema([MATRIX_TEST])
+    assert len(workflow_tests) == 4
+    first = workflow_tests[0]
+    assert first.name == "align bwa[1]"
+    assert first.matrix_name == "align {aligner}"
+    assert first.matrix_variants == variant_names(MATRIX_TEST)
+    assert first.files[0].contains == ["bwa"]
+
+
+def test_matrix_variant_names_must_be_unique():
+    test = dict(name="same", command="echo {a}", matrix=dict(a=["x"]))
+    with pytest.raises(jsonschema.ValidationError) as error:
+        validate_schema([test, dict(name="same[x]", command="echo")])
+    assert error.match("Some names were not unique")
+
+
+def test_matrix_variants_are_validated():
+    test = dict(name="concordance", command="echo",
+                matrix=dict(word=["bla"]),
+                stdout=dict(contains=["{word}"], must_not_contain=["bla"]))
+    with pytest.raises(jsonschema.ValidationError) as error:
+        validate_schema([test])
+    assert error.match("Common members: {'bla'}")
+
+
+@pytest.mark.parametrize("matrix", [{}, dict(a=[]), {"a b": ["c"]},
+                                    dict(a=[["nested"]])])
+def test_invalid_matrix(matrix):
+    test = dict(name="invalid", command="echo", matrix=matrix)
+    with pytest.raises(jsonschema.ValidationError):
+        validate_schema([test])
+
+
+MATRIX_YAML = textwrap.dedent("""\
+- name: count {number}
+  command: bash -c "echo {number} > number.txt"
+  matrix:
+    number: [1, 2, 3]
+  files:
+    - path: number.txt
+      contains:
+        - "{number}"
+- name: other
+  command: echo other
+""")
+
+
+def test_matrix_workflows_run(pytester):
+    pytester.makefile(".yml", test=MATRIX_YAML)
+    result = pytester.runpytest("-v", "--wt", "3", "--tag", "count {number}")
+    result.assert_outcomes(passed=9)
+    result.stdout.fnmatch_lines_random([
+        "*test.yml::count 1::number.txt::content::contains '1' PASSED*",
+        "*test.yml::count 2::number.txt::content::contains '2' PASSED*",
+        "*test.yml::count 3::number.txt::content::contains '3' PASSED*"])
+    assert "'other' done." not in result.stdout.str()
+
+
+def test_custom_tests_of_matrix_variants(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: echo {word}
+          command: bash -c "echo {word} > word.txt"
+          matrix:
+            word: [a, b]
+            repeat: [1]
+        """))
+    pytester.makepyfile(test_custom=textwrap.dedent("""\
+        import pytest
+
+        @pytest.mark.workflow("echo a[1]", "echo b[1]")
+        @pytest.mark.parametrize("suffix", ["[x]"])
+        def test_word(workflow_dir, suffix):
+            word = (workflow_dir / "word.txt").read_text().strip()
+            assert workflow_dir.name == f"echo_{word}[1]"
+        """))
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=4)
@@ -58,3 +58,18 @@ def test_multithreaded(threads, pytester):
     # If the completion time is longer than (iterations * SLEEP_TIME + 1) then
     # the code is probably not threaded properly.
     assert completion_time < ((iterations + 1) * SLEEP_TIME)
+
+
+@pytest.mark.parametrize(["group_limit", "iterations"], [(None, 4), (2, 2)])
+def test_concurrency_group(group_limit, iterations, pytester):
+    test = [dict(workflow, concurrency_group="sleeping beauty")
+            for workflow in MULTHITHREADED_TEST]
+    pytester.makefile(".yml", test=yaml.safe_dump(test))
+    options = ([] if group_limit is None else
+               ["--workflow-group-limit", f"sleeping beauty={group_limit}"])
+    start_time = time.time()
+    result = pytester.runpytest("-v", "--wt", "4", *options)
+    completion_time = time.time() - start_time
+    assert result.ret == 0
+    assert completion_time > (iterations * SLEEP_TIME)
+    assert completion_time < ((iterations + 1) * SLEEP_TIME)
@@ -0,0 +1,136 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for placing workflows on cpus, nice levels and I/O classes"""
+
+import os
+import platform
+import shutil
+import sys
+import textwrap
+
+import pytest
+
+from pytest_workflow.placement import (IOPRIO_SET_SYSCALLS, Placement,
+                                       format_cpu_set, parse_ionice)
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+
+@pytest.mark.parametrize(["ionice", "expected"], [
+    ("idle", (3, 4)),
+    ("best-effort", (2, 4)),
+    ("best-effort:7", (2, 7)),
+    ("realtime:0", (1, 0))])
+def test_parse_ionice(ionice, expected):
+    assert parse_ionice(ionice) == expected
+
+
+@pytest.mark.parametrize("ionice", ["fast", "best-effort:8", "idle:3"])
+def test_parse_ionice_invalid(ionice):
+    with pytest.raises(ValueError):
+        parse_ionice(ionice)
+
+
+def test_format_cpu_set():
+    assert format_cpu_set([6, 0, 1, 2, 3, 8, 9]) == "0-3,6,8-9"
+
+
+def test_placement_cpus_are_disjoint():
+    placement = Placement(cpus=range(4))
+    first = Workflow("echo first", cpus=2)
+    second = Workflow("echo second", cpus=2)
+    third = Workflow("echo third")
+    for workflow in (first, second, third):
+        placement.claim(workflow)
+    assert first.allocation == {"cpus": "0-1"}
+    assert second.allocation == {"cpus": "2-3"}
+    assert third.allocation == {"cpus": "not pinned, too few free cpus"}
+    placement.release(first)
+    fourth = Workflow("echo fourth", cpus=2)
+    placement.claim(fourth)
+    assert fourth.allocation == {"cpus": "0-1"}
+
+
+def test_placement_no_cgroup_dir(tmp_path):
+    with pytest.raises(ValueError) as error:
+        Placement(cgroup_root=tmp_path)
+    error.match("is not a cgroup v2 directory")
+
+
+def test_workflow_queue_placement():
+    cpu = min(os.sched_getaffinity(0))
+    workflow = Workflow(
+        f"{sys.executable} -c \"import os; "
+        f"print(sorted(os.sched_getaffinity(0)), os.nice(0))\"")
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(placement=Placement(cpus=[cpu], nice=5))
+    assert workflow.stdout.decode().split() == [
+        f"[{cpu}]", str(os.nice(0) + 5)]
+    assert workflow.allocation == {"cpus": str(cpu), "nice": "5"}
+
+
+@pytest.mark.skipif(shutil.which("ionice") is None or
+                    platform.machine() not in IOPRIO_SET_SYSCALLS,
+                    reason="ionice is not installed or not supported")
+def test_workflow_ionice():
+    workflow = Workflow("ionice")
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(placement=Placement(ionice="idle"))
+    assert workflow.stdout.decode().strip() == "idle"
+    assert workflow.allocation == {"ionice": "idle"}
+
+
+PLACEMENT_TESTS = textwrap.dedent("""\
+- name: pinned
+  command: echo pinned
+""")
+
+
+def test_placement_reported(pytester):
+    pytester.makefile(".yml", test=PLACEMENT_TESTS)
+    result = pytester.runpytest("-v", "--workflow-pin-cpus",
+                                "--workflow-nice", "3")
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        "pinned:",
+        "*cpus:*",
+        "*nice:      3"])
+
+
+def test_placement_not_used_with_batch_executor(pytester):
+    pytester.makefile(".yml", test=PLACEMENT_TESTS)
+    with pytest.warns(UserWarning, match="only apply to workflows that run "
+                                         "as local processes"):
+        pytester.runpytest_inprocess(
+            "--workflow-executor", "batch", "--workflow-nice", "3",
+            "--workflow-submit-command", "false", "--collect-only")
+
+
+def test_cpus_in_command(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: threads
+          command: bash -c "echo --threads {cpus} $OMP_NUM_THREADS"
+          resources:
+            cpus: 3
+          stdout:
+            contains:
+              - "--threads 3 3"
+        """))
+    result = pytester.runpytest("-v")
+    assert result.ret == 0
@@ -0,0 +1,131 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for the progress reports"""
+
+import textwrap
+import threading
+import time
+
+import pytest
+
+from pytest_workflow import progress as progress_module
+from pytest_workflow.progress import (ProgressReporter, directory_size,
+                                      format_bytes, format_duration,
+                                      format_rate)
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+
+@pytest.mark.parametrize(["seconds", "formatted"], [
+    (0, "0:00:00"), (59.9, "0:00:59"), (3661, "1:01:01")])
+def test_format_duration(seconds, formatted):
+    assert format_duration(seconds) == formatted
+
+
+@pytest.mark.parametrize(["number", "formatted"], [
+    (0, "0.0 B"), (1536, "1.5 KiB"), (3 * 1024 ** 3, "3.0 GiB"),
+    (2 * 1024 ** 4, "2.0 TiB")])
+def test_format_bytes(number, formatted):
+    assert format_bytes(number) == formatted
+
+
+def test_format_rate():
+    assert format_rate(2048) == "+2.0 KiB/s"
+    assert format_rate(-512) == "-512.0 B/s"
+
+
+def test_directory_size(tmp_path):
+    (tmp_path / "a").write_bytes(b"a" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(b"b" * 5)
+    (tmp_path / "link").symlink_to(tmp_path / "a")
+    assert directory_size(tmp_path) == 15
+    assert directory_size(tmp_path / "missing") == 0
+
+
+def test_estimated_remaining():
+    queued = [Workflow("echo moo", estimated_duration=duration)
+              for duration in (10, 20, 30)]
+    reporter = ProgressReporter(WorkflowQueue(), interval=1, slots=2)
+    assert reporter.estimated_remaining([], queued) == 30
+    reporter.slots = 6
+    # The longest workflow can not be split over multiple slots.
+    assert reporter.estimated_remaining([], queued) == 30
+    assert reporter.estimated_remaining(
+        [], [Workflow("echo moo")]) is None
+
+
+def test_progress_report(tmp_path):
+    workflow_queue = WorkflowQueue()
+    running = Workflow("bash -c 'echo moo; sleep 10'", cwd=tmp_path,
+                       name="running")
+    workflow_queue.put(running)
+    workflow_queue.put(Workflow("echo moo", name="queued"))
+    thread = threading.Thread(target=workflow_queue.process)
+    thread.start()
+    while running.start_time is None:
+        time.sleep(0.01)
+    reporter = ProgressReporter(workflow_queue, interval=1)
+    first = reporter.report()
+    second = reporter.report()
+    workflow_queue.cancel()
+    thread.join()
+    assert first.splitlines()[0].endswith(
+        "running: 1, queued: 1, finished: 0, ETA: unknown")
+    assert first.splitlines()[1].startswith("\t'running': 0:00:00, log ")
+    assert "/s), workspace " in second
+
+
+def test_progress_workspace_walk_throttled(tmp_path, monkeypatch):
+    walks = []
+
+    def slow_directory_size(path):
+        walks.append(path)
+        time.sleep(0.05)
+        return 1024
+
+    monkeypatch.setattr(progress_module, "directory_size",
+                        slow_directory_size)
+    workflow_queue = WorkflowQueue()
+    running = Workflow("sleep 10", cwd=tmp_path, name="running")
+    workflow_queue.put(running)
+    thread = threading.Thread(target=workflow_queue.process)
+    thread.start()
+    while running.start_time is None:
+        time.sleep(0.01)
+    reporter = ProgressReporter(workflow_queue, interval=1)
+    first = reporter.report()
+    # The walk took 0.05 seconds, so the next one is after 0.5 seconds.
+    second = reporter.report()
+    time.sleep(0.5)
+    third = reporter.report()
+    workflow_queue.cancel()
+    thread.join()
+    assert len(walks) == 2
+    assert first.endswith("workspace 1.0 KiB")
+    assert second.endswith("workspace 1.0 KiB")
+    assert third.endswith("workspace 1.0 KiB (+0.0 B/s)")
+
+
+def test_progress_option(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: slow
+      command: sleep 0.5
+    """))
+    result = pytester.runpytest("-v", "--workflow-progress", "0.2")
+    result.stdout.fnmatch_lines([
+        "*] running: 1, queued: 0, finished: 0, ETA: *"])
+    assert result.ret == 0
@@ -0,0 +1,133 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for the resource usage of workflows"""
+
+import json
+import textwrap
+
+from pytest_workflow.workflow import Workflow
+
+
+def test_workflow_resource_usage():
+    # Keep the cpu busy for a while.
+    workflow = Workflow(
+        "bash -c 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'")
+    workflow.run()
+    usage = workflow.resource_usage
+    assert usage is not None
+    assert usage.max_rss > 0
+    assert usage.cpu_time > 0
+    assert usage.cpu_time == usage.user_time + usage.system_time
+    assert usage.wall_time > 0
+    assert usage.wall_time == workflow.duration
+
+
+def test_workflow_resource_usage_not_finished():
+    workflow = Workflow("echo moo")
+    assert workflow.resource_usage is None
+
+
+RESOURCE_TESTS = textwrap.dedent("""\
+- name: resource test
+  command: sleep 0.2
+  max_rss: 1G
+  max_wall_time: 10
+  max_cpu_time: 10
+""")
+
+
+def test_resource_usage_tests_pass(pytester):
+    pytester.makefile(".yml", test=RESOURCE_TESTS)
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=4)
+    assert "resource test::max_rss PASSED" in result.stdout.str()
+
+
+def test_resource_usage_tests_fail(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: slow
+      command: sleep 0.2
+      max_wall_time: 0.01
+      max_rss: 1K
+    """))
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=1, failed=2)
+    assert "'slow' used a wall time of" in result.stdout.str()
+    assert ("which is more than the maximum of 0.01 seconds."
+            in result.stdout.str())
+    assert "'slow' used a peak resident set size of" in result.stdout.str()
+
+
+def test_resource_usage_tests_skipped_on_wrong_exit_code(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: failing
+      command: bash -c 'exit 1'
+      max_wall_time: 10
+    """))
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(failed=1, skipped=1)
+
+
+BASELINE_TESTS = textwrap.dedent("""\
+- name: baseline test
+  command: sleep 0.1
+""")
+
+
+def test_baseline_save_and_compare(pytester):
+    pytester.makefile(".yml", test=BASELINE_TESTS)
+    pytester.runpytest("--workflow-perf-baseline", "save",
+                       "--workflow-perf-baseline-file", "baseline.json")
+    baseline = json.loads((pytester.path / "baseline.json").read_text())
+    assert baseline["baseline test"]["wall_time"] >= 0.1
+    assert "cpu_time" in baseline["baseline test"]
+    # Make sure the session is well within the tolerance.
+    result = pytester.runpytest(
+        "-v", "--workflow-perf-baseline", "compare",
+        "--workflow-perf-baseline-file", "baseline.json",
+        "--workflow-perf-tolerance", "1000")
+    assert "baseline test::wall_time baseline PASSED" in result.stdout.str()
+
+
+def test_baseline_compare_degraded(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+    - name: baseline test
+      command: sleep 0.3
+    """))
+    (pytester.path / "baseline.json").write_text(json.dumps(
+        {"baseline test": {"cpu_time": 1000.0, "wall_time": 0.01}}))
+    result = pytester.runpytest(
+        "-v", "--workflow-perf-baseline", "compare",
+        "--workflow-perf-baseline-file", "baseline.json")
+    result.assert_outcomes(passed=2, failed=1)
+    assert "more than the baseline of 0.010 seconds, while 20.0% is allowed" \
+           in result.stdout.str()
+
+
+def test_baseline_compare_no_baseline(pytester):
+    pytester.makefile(".yml", test=BASELINE_TESTS)
+    result = pytester.runpytest("-v", "--workflow-perf-baseline", "compare")
+    result.assert_outcomes(passed=1, skipped=2)
+
+
+def test_baseline_in_cache(pytester):
+    pytester.makefile(".yml", test=BASELINE_TESTS)
+    pytester.runpytest("--workflow-perf-baseline", "save")
+    result = pytester.runpytest(
+        "-v", "--workflow-perf-baseline", "compare",
+        "--workflow-perf-tolerance", "1000")
+    result.assert_outcomes(passed=3)
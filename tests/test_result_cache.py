@@ -0,0 +1,133 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for restoring workflows from the result cache"""
+
+import textwrap
+
+from pytest_workflow.result_cache import ResultCache
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+CACHED_TESTS = textwrap.dedent("""\
+- name: cached
+  command: >-
+    bash -c "echo run >> {runs} &&
+    cat input.txt > output.txt &&
+    echo moo &&
+    exit {exit_code}"
+  exit_code: {exit_code}
+  files:
+    - path: output.txt
+      contains:
+        - input
+  stdout:
+    contains:
+      - moo
+""")
+
+
+def run_cached(pytester, cache_dir, *args):
+    # With a separate argument pytest would take the directory into account
+    # when determining the rootdir.
+    return pytester.runpytest("-v", f"--workflow-result-cache={cache_dir}",
+                              *args)
+
+
+def test_result_cache_restores(pytester, tmp_path):
+    runs = tmp_path / "runs"
+    pytester.makefile(".yml", test=CACHED_TESTS.format(runs=runs,
+                                                       exit_code=0))
+    pytester.makefile(".txt", input="input")
+    cache_dir = tmp_path / "cache"
+    assert run_cached(pytester, cache_dir).ret == 0
+    result = run_cached(pytester, cache_dir)
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(["'cached' restored from the result cache."])
+    assert result.parseoutcomes() == {"passed": 4}
+    assert runs.read_text() == "run\n"
+
+
+def test_result_cache_resource_tests_skipped(pytester, tmp_path):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: cached
+          command: echo moo
+          max_wall_time: 60
+        """))
+    cache_dir = tmp_path / "cache"
+    result = run_cached(pytester, cache_dir)
+    assert result.parseoutcomes() == {"passed": 2}
+    result = run_cached(pytester, cache_dir, "-rs")
+    result.stdout.fnmatch_lines([
+        "SKIPPED * 'cached' was restored from the result cache."])
+    assert result.parseoutcomes() == {"passed": 1, "skipped": 1}
+
+
+def test_result_cache_changed_input(pytester, tmp_path):
+    runs = tmp_path / "runs"
+    pytester.makefile(".yml", test=CACHED_TESTS.format(runs=runs,
+                                                       exit_code=0))
+    pytester.makefile(".txt", input="input")
+    cache_dir = tmp_path / "cache"
+    run_cached(pytester, cache_dir)
+    pytester.makefile(".txt", input="input changed")
+    result = run_cached(pytester, cache_dir)
+    assert result.ret == 0
+    assert runs.read_text() == "run\nrun\n"
+
+
+def test_result_cache_environment(pytester, tmp_path, monkeypatch):
+    runs = tmp_path / "runs"
+    pytester.makefile(".yml", test=CACHED_TESTS.format(runs=runs,
+                                                       exit_code=0))
+    pytester.makefile(".txt", input="input")
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("REFERENCE", "hg19")
+    run_cached(pytester, cache_dir, "--workflow-cache-env", "REFERENCE")
+    run_cached(pytester, cache_dir, "--workflow-cache-env", "REFERENCE")
+    assert runs.read_text() == "run\n"
+    monkeypatch.setenv("REFERENCE", "hg38")
+    run_cached(pytester, cache_dir, "--workflow-cache-env", "REFERENCE")
+    assert runs.read_text() == "run\nrun\n"
+
+
+def test_result_cache_failures_not_stored(pytester, tmp_path):
+    runs = tmp_path / "runs"
+    pytester.makefile(".yml", test=CACHED_TESTS.format(runs=runs,
+                                                       exit_code=0).replace(
+        "cat input.txt", "cat missing.txt"))
+    cache_dir = tmp_path / "cache"
+    run_cached(pytester, cache_dir)
+    run_cached(pytester, cache_dir)
+    assert runs.read_text() == "run\nrun\n"
+
+
+def test_result_cache_eviction(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_size=150)
+    keys = []
+    for number in range(3):
+        workflow_dir = tmp_path / str(number)
+        workflow_dir.mkdir()
+        workflow = Workflow(f"bash -c 'head -c 100 /dev/zero > {number}'",
+                            cwd=workflow_dir, fingerprint=str(number))
+        key, inputs = cache.key(workflow)
+        workflow_queue = WorkflowQueue()
+        workflow_queue.put(workflow)
+        workflow_queue.process()
+        cache.store(key, workflow, inputs)
+        keys.append(key)
+    # Only the most recent entry fits.
+    assert [(cache.directory / key).exists() for key in keys] == [
+        False, False, True]
@@ -0,0 +1,163 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for retrying workflows that fail"""
+
+import textwrap
+
+from pytest_workflow.scanner import ContentScanner
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+# Fails the first time, because the counter is kept outside of the
+# directory of the workflow.
+FLAKY_COMMAND = ("bash -c 'test -e {counter} || "
+                 "{{ touch {counter}; exit 1; }}; touch done'")
+
+
+def test_workflow_queue_retry(tmp_path):
+    workflow = Workflow(FLAKY_COMMAND.format(counter=tmp_path / "counter"),
+                        cwd=tmp_path, name="flaky", retries=2)
+    messages = []
+    workflow_queue = WorkflowQueue()
+    workflow_queue.report = messages.append
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+    assert workflow.succeeded()
+    assert [status for status, _ in workflow.attempts] == [
+        "failed with exit code 1"]
+    assert any(message.startswith("'flaky' failed with exit code 1 after ")
+               and message.endswith("Retrying, attempt 2 of 3.")
+               for message in messages)
+    assert messages[-1] == "'flaky' done after 2 attempts."
+    assert workflow_queue.finished == [workflow]
+
+
+def test_workflow_queue_retries_exhausted():
+    workflow = Workflow("bash -c 'exit 3'", retries=2)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+    assert workflow.exit_code == 3
+    assert len(workflow.attempts) == 2
+
+
+def test_workflow_queue_retry_fresh_directory(tmp_path):
+    def prepare():
+        (tmp_path / "workflow").mkdir()
+
+    workflow = Workflow("bash -c 'test ! -e old || exit 1; touch old; exit 1'",
+                        cwd=tmp_path / "workflow", prepare=prepare,
+                        retries=1)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+    # Both attempts exit with 1 because they found no old file.
+    assert [status for status, _ in workflow.attempts] == [
+        "failed with exit code 1"]
+    assert workflow.exit_code == 1
+    # The directory of the first attempt is removed.
+    assert [path.name for path in tmp_path.iterdir()] == ["workflow"]
+
+
+def test_workflow_queue_retry_alone(tmp_path):
+    flaky = Workflow(FLAKY_COMMAND.format(counter=tmp_path / "counter"),
+                     cwd=tmp_path, name="flaky", retries=1)
+    others = [Workflow("sleep 0.3", name=f"other {number}")
+              for number in range(2)]
+    workflow_queue = WorkflowQueue()
+    for workflow in [flaky] + others:
+        workflow_queue.put(workflow)
+    workflow_queue.process(2, retry_alone=True)
+    assert flaky.succeeded()
+    assert all(other.end_time <= flaky.start_time or
+               flaky.end_time <= other.start_time for other in others)
+
+
+def test_workflow_queue_retry_aborted_again():
+    workflow = Workflow("bash -c 'echo ERROR; sleep 10'",
+                        stdout_scanner=ContentScanner(
+                            abort_patterns=["ERROR"]),
+                        retries=1)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+    assert [status for status, _ in workflow.attempts] == [
+        "aborted because 'ERROR' was found in its stdout"]
+    assert workflow.status() == (
+        "aborted because 'ERROR' was found in its stdout")
+    assert workflow.duration < 5
+
+
+def test_retry_content_checks(pytester, tmp_path):
+    counter = tmp_path / "counter"
+    pytester.makefile(".yml", test=textwrap.dedent(f"""\
+        - name: flaky
+          command: >-
+            bash -c 'test -e {counter} || {{ touch {counter};
+            echo BADWORD; exit 1; }}; echo GOODWORD'
+          retries: 1
+          stdout:
+            contains:
+              - GOODWORD
+            must_not_contain:
+              - BADWORD
+        - name: flaky contains
+          command: >-
+            bash -c 'test -e {counter}2 || {{ touch {counter}2;
+            echo BADWORD; exit 1; }}; echo GOODWORD'
+          retries: 1
+          stdout:
+            contains:
+              - BADWORD
+        """))
+    result = pytester.runpytest("-v")
+    # Only the output of the last attempt is checked.
+    result.stdout.fnmatch_lines([
+        "test.yml::flaky::stdout::contains 'GOODWORD' PASSED*",
+        "test.yml::flaky::stdout::does not contain 'BADWORD' PASSED*",
+        "test.yml::flaky contains::stdout::contains 'BADWORD' FAILED*"])
+    assert result.parseoutcomes() == {"passed": 4, "failed": 1}
+
+
+def test_retries_reported(pytester, tmp_path):
+    pytester.makefile(".yml", test=textwrap.dedent(f"""\
+        - name: flaky
+          command: >-
+            {FLAKY_COMMAND.format(counter=tmp_path / "counter")}
+          files:
+            - path: done
+        - name: broken
+          command: bash -c 'exit 1'
+        """))
+    result = pytester.runpytest("-v", "--workflow-retries", "1")
+    result.stdout.fnmatch_lines([
+        "*= workflow retries =*",
+        "flaky: attempt 1 failed with exit code 1 in * seconds; "
+        "attempt 2 succeeded in * seconds",
+        "broken: attempt 1 failed with exit code 1 in * seconds; "
+        "attempt 2 failed with exit code 1 in * seconds"])
+    assert result.parseoutcomes() == {"passed": 2, "failed": 1}
+
+
+def test_retries_key_takes_precedence(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: broken
+          command: bash -c 'exit 1'
+          retries: 0
+        """))
+    result = pytester.runpytest("-v", "--workflow-retries", "2")
+    assert "workflow retries" not in result.stdout.str()
@@ -0,0 +1,112 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for sampling the resources used by running workflows"""
+
+import json
+import os
+import sys
+import textwrap
+
+import pytest
+
+from pytest_workflow.sampling import ResourceSampler, read_io
+from pytest_workflow.workflow import (ResourceSamples, Workflow,
+                                      WorkflowQueue, session_stats)
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"),
+                                reason="Samples are read from /proc")
+
+# Uses a cpu and 50 MiB of memory and writes 10 MiB for a second.
+BUSY_COMMAND = (
+    f"{sys.executable} -c \"import os, time; data = bytearray(50 << 20); "
+    f"open('out', 'wb').write(os.urandom(10 << 20)); "
+    f"end = time.time() + 1\nwhile time.time() < end: pass\"")
+
+
+def test_session_stats():
+    session_id = os.getsid(0)
+    stats = session_stats({session_id})
+    assert os.getpid() in stats[session_id]
+    assert session_stats({-1}) == {}
+
+
+def test_read_io():
+    read_bytes, write_bytes = read_io(os.getpid())
+    assert read_bytes >= 0 and write_bytes >= 0
+    assert read_io(-1) == (0, 0)
+
+
+def test_resource_samples():
+    samples = ResourceSamples()
+    samples.add(1.0, 2.0, 1024, 2048.4, 0.0)
+    samples.add(2.0, 1.0, 3072, 0.0, 0.0)
+    assert len(samples) == 2
+    assert samples.to_dict()["read"] == [2048, 0]
+    assert samples.summary() == (
+        "cpus: peak 2.00, average 1.50; "
+        "rss: peak 3.0 KiB, average 2.0 KiB; "
+        "read: peak 2.0 KiB/s, average 1.0 KiB/s; "
+        "write: peak 0.0 B/s, average 0.0 B/s")
+
+
+def test_resource_sampler(tmp_path):
+    workflow = Workflow(BUSY_COMMAND, cwd=tmp_path, name="busy")
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    sampler = ResourceSampler(workflow_queue, 0.1)
+    sampler.start()
+    try:
+        workflow_queue.process()
+    finally:
+        sampler.stop()
+    assert workflow.succeeded()
+    samples = workflow.samples
+    assert len(samples) > 3
+    assert samples.time == sorted(samples.time)
+    assert max(samples.cpu) > 0.5
+    assert max(samples.rss) > 50 << 20
+    assert sum(samples.write) > 0
+
+
+def test_samples_shown_and_reported(pytester, tmp_path):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: slow failure
+          command: bash -c 'sleep 0.5; exit 1'
+        - name: quick
+          command: "true"
+        """))
+    report = tmp_path / "report.json"
+    result = pytester.runpytest("-v", "--workflow-sample-interval", "0.1",
+                                "--workflow-report", str(report))
+    result.stdout.fnmatch_lines(
+        ["resources: cpus: peak *, average *; rss: peak *"])
+    workflows = {entry["name"]: entry
+                 for entry in json.loads(report.read_text())["workflows"]}
+    assert workflows["slow failure"]["status"] == "failed with exit code 1"
+    assert len(workflows["slow failure"]["samples"]["time"]) > 1
+    assert workflows["quick"]["status"] == "succeeded"
+    assert workflows["quick"]["attempts"] == []
+
+
+def test_no_samples_without_interval(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: failure
+          command: bash -c 'exit 1'
+        """))
+    result = pytester.runpytest("-v")
+    assert "resources:" not in result.stdout.str()
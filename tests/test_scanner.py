@@ -0,0 +1,72 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for scanning workflow output while it is produced"""
+
+from pathlib import Path
+
+import pytest
+
+from pytest_workflow.content_tests import check_content
+from pytest_workflow.scanner import ContentScanner
+
+LICENSE = Path(__file__).parent / "content_files" / "LICENSE"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1000000])
+def test_scanner_same_as_check_content(chunk_size):
+    strings = ["When we speak of free software", "GNU Affero",
+               "All hail Google, Guardian of our privacy"]
+    patterns = ["^  When we speak", ".*Google.*", "version 3\n$"]
+    with LICENSE.open("rt") as license_h:
+        expected = check_content(strings, patterns, license_h)
+    scanner = ContentScanner(strings, patterns)
+    data = LICENSE.read_bytes()
+    for start in range(0, len(data), chunk_size):
+        scanner.feed(data[start:start + chunk_size])
+    scanner.close()
+    assert (scanner.found_strings, scanner.found_patterns) == expected
+
+
+def test_scanner_multibyte_character_split():
+    scanner = ContentScanner(["kaasbrötje"], encoding="utf-8")
+    data = "een kaasbrötje\n".encode("utf-8")
+    split = data.index(b"\xc3") + 1
+    scanner.feed(data[:split])
+    scanner.feed(data[split:])
+    scanner.close()
+    assert scanner.found_strings == {"kaasbrötje"}
+
+
+def test_scanner_does_not_match_across_lines():
+    scanner = ContentScanner(["moo\nmoo"])
+    scanner.feed(b"moo\nmoo\n")
+    scanner.close()
+    assert scanner.found_strings == set()
+
+
+def test_scanner_abort():
+    scanner = ContentScanner(abort_patterns=["OutOfMemoryError"])
+    assert not scanner.feed(b"starting\nException in thread: java.lang.")
+    assert scanner.feed(b"OutOfMemoryError: Java heap space\nmore")
+    assert scanner.abort_match == "OutOfMemoryError"
+    assert not scanner.feed(b"OutOfMemoryError\n")
+
+
+def test_scanner_abort_last_line_without_newline():
+    scanner = ContentScanner(abort_patterns=["^fatal"])
+    assert not scanner.feed(b"fatal")
+    assert scanner.close()
@@ -50,6 +50,14 @@ def test_workflowtest():
         assert tests[0].stdout.contains == ["bla"]
         assert tests[0].exit_code == 127
         assert tests[0].tags == ["simple", "use_echo"]
+        assert tests[0].resources.cpus == 4
+        assert tests[0].resources.memory == 2 * 1024 ** 3
+        assert tests[1].resources.cpus == 1
+        assert tests[1].resources.memory == 0
+        assert tests[0].max_rss == 512 * 1024 ** 2
+        assert tests[0].max_wall_time == 60
+        assert tests[0].max_cpu_time == 120.5
+        assert tests[1].max_rss is None
 
 
 def test_workflowtest_regex():
@@ -203,3 +211,15 @@ def test_filetest_with_regex():
                          must_not_contain_regex=["Should not contain"])
     assert file_test.contains_regex == ["Should contain"]
     assert file_test.must_not_contain_regex == ["Should not contain"]
+
+
+@pytest.mark.parametrize(["concurrency_group", "groups"], [
+    (None, []),
+    ("database", ["database"]),
+    (["database", "disk"], ["database", "disk"])])
+def test_workflow_test_concurrency_groups(concurrency_group, groups):
+    schema = dict(name="grouped", command="echo grouped")
+    if concurrency_group is not None:
+        schema["concurrency_group"] = concurrency_group
+    validate_schema([schema])
+    assert WorkflowTest.from_schema(schema).concurrency_groups == groups
@@ -0,0 +1,119 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for setup workflows that are shared read-only with the workflows
+that depend on them"""
+
+import os
+import stat
+import textwrap
+import time
+
+from pytest_workflow import workflow as workflow_module
+from pytest_workflow.util import make_read_only, make_writable
+from pytest_workflow.workflow import Workflow, WorkflowQueue
+
+SETUP_TESTS = textwrap.dedent("""\
+- name: build index
+  setup: true
+  command: bash -c "echo indexed > index.txt"
+- name: use index
+  command: bash -c "cat $PYTEST_WORKFLOW_SETUP_BUILD_INDEX/index.txt"
+  depends_on:
+    - build index
+  stdout:
+    contains:
+      - indexed
+  files:
+    - path: index.txt
+      should_exist: false
+""")
+
+SETUP_CUSTOM_TESTS = textwrap.dedent("""\
+import pytest
+
+@pytest.mark.workflow("use index")
+def test_setup_is_read_only(workflow_dir):
+    index = workflow_dir.parent / "build_index" / "index.txt"
+    assert index.stat().st_mode & 0o222 == 0
+""")
+
+
+def test_make_read_only(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    target = project / "target.txt"
+    target.write_text("target")
+    shared = tmp_path / "shared"
+    (shared / "sub").mkdir(parents=True)
+    (shared / "sub" / "file.txt").write_text("file")
+    (shared / "link.txt").symlink_to(target)
+    make_read_only(shared)
+    for path in (shared, shared / "sub", shared / "sub" / "file.txt"):
+        assert stat.S_IMODE(path.stat().st_mode) & 0o222 == 0
+    # The targets of symbolic links are left alone.
+    assert target.stat().st_mode & stat.S_IWUSR
+    make_writable(shared)
+    assert (shared / "sub" / "file.txt").stat().st_mode & stat.S_IWUSR
+
+
+def test_workflow_environment_setup_directory(tmp_path):
+    setup = Workflow("echo setup", cwd=tmp_path, name="build index 2",
+                     setup=True)
+    workflow = Workflow("echo moo", name="moo")
+    workflow.dependencies = [setup]
+    assert (workflow.environment()["PYTEST_WORKFLOW_SETUP_BUILD_INDEX_2"] ==
+            str(tmp_path.absolute()))
+
+
+def test_make_read_only_outside_event_loop(tmp_path, monkeypatch):
+    # The timeout of a running workflow is enforced while the directory of
+    # a setup workflow is made read-only.
+    monkeypatch.setattr(workflow_module, "make_read_only",
+                        lambda path: time.sleep(2))
+    hanging = Workflow("sleep 10", timeout=0.5, estimated_duration=10.0)
+    setup = Workflow("true", cwd=tmp_path, setup=True)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(hanging)
+    workflow_queue.put(setup)
+    workflow_queue.process(2)
+    assert hanging.timed_out
+    assert hanging.duration is not None and hanging.duration < 1.5
+
+
+def test_setup_workflow(pytester):
+    pytester.makefile(".yml", test=SETUP_TESTS)
+    pytester.makepyfile(test_custom=SETUP_CUSTOM_TESTS)
+    result = pytester.runpytest("-v", "--kwd")
+    assert result.parseoutcomes() == {"passed": 5}
+    result.stdout.fnmatch_lines([
+        "*= workflow setup =*",
+        "build index: succeeded in * seconds"])
+    # The directory is writable again after the session.
+    workflow_dir = [line for line in result.stdout.lines
+                    if line.strip().startswith("directory:")][0]
+    directory = workflow_dir.split(":", 1)[1].strip()
+    assert os.stat(directory).st_mode & stat.S_IWUSR
+
+
+def test_setup_workflow_failure_reported(pytester):
+    pytester.makefile(".yml", test=SETUP_TESTS.replace(
+        'bash -c "echo indexed > index.txt"', "bash -c 'exit 2'"))
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines([
+        "*= workflow setup =*",
+        "build index: failed with exit code 2 in * seconds"])
@@ -0,0 +1,102 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for running a shard of the workflows"""
+
+import json
+import textwrap
+
+from pytest_workflow.plugin import assign_shards
+
+SHARD_TESTS = textwrap.dedent("""\
+- name: long
+  command: bash -c 'echo long >> {log}'
+- name: medium
+  command: bash -c 'echo medium >> {log}'
+- name: short
+  command: bash -c 'echo short >> {log}'
+- name: first step
+  command: bash -c 'echo first step >> {log}; touch step.txt'
+- name: second step
+  command: bash -c 'echo second step >> {log}; cat step.txt'
+  depends_on:
+    - first step
+""")
+
+PYTHON_TEST = textwrap.dedent("""\
+def test_python():
+    pass
+""")
+
+
+def test_assign_shards():
+    assert assign_shards({"a": 10, "b": 6, "c": 5, "d": 4, "e": 1}, 2) == {
+        "a": 1, "b": 2, "c": 2, "d": 1, "e": 2}
+
+
+def test_assign_shards_equal_weights():
+    # Equal groups are divided in collection order.
+    assert assign_shards(dict.fromkeys("abcde", 1.0), 3) == {
+        "a": 1, "b": 2, "c": 3, "d": 1, "e": 2}
+
+
+def test_shards_balanced_by_duration(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makefile(".yml", test=SHARD_TESTS.format(log=log))
+    pytester.makepyfile(test_python=PYTHON_TEST)
+    cache = pytester.path / ".pytest_cache" / "v" / "pytest_workflow"
+    cache.mkdir(parents=True)
+    durations = {"long": 100, "medium": 60, "short": 10,
+                 "first step": 30, "second step": 30}
+    shards = []
+    for shard in ("1/2", "2/2"):
+        (cache / "durations").write_text(json.dumps(durations))
+        result = pytester.runpytest("-v", "--workflow-shard", shard)
+        assert result.ret == 0
+        shards.append((result, set(log.read_text().splitlines())))
+        log.unlink()
+    (first, first_runs), (second, second_runs) = shards
+    # long: 100 + short 10 and medium 60 + the steps 60.
+    assert first_runs == {"long", "short"}
+    assert second_runs == {"medium", "first step", "second step"}
+    first.stdout.fnmatch_lines([
+        "workflow shard 1/2: 2 of 5 workflows, estimated 110.0 of 230.0 "
+        "seconds"])
+    assert "test_python.py::test_python PASSED" in first.stdout.str()
+    assert "test_python" not in second.stdout.str()
+    assert second.parseoutcomes()["deselected"] == 3
+
+
+def test_shards_without_durations(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makefile(".yml", test=SHARD_TESTS.format(log=log))
+    runs = []
+    for shard in ("1/3", "2/3", "3/3"):
+        result = pytester.runpytest("-v", "-p", "no:cacheprovider",
+                                    "--workflow-shard", shard)
+        assert result.ret == 0
+        runs.append(set(log.read_text().splitlines()))
+        log.unlink()
+    # The connected steps count as two workflows.
+    assert runs == [{"first step", "second step"}, {"long", "short"},
+                    {"medium"}]
+
+
+def test_invalid_shard(pytester):
+    result = pytester.runpytest("--workflow-shard", "3/2")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*argument --workflow-shard*'3/2'"])
@@ -0,0 +1,280 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for sharing workflows between sessions through a directory"""
+
+import os
+import textwrap
+import time
+from typing import Dict
+
+import pytest
+
+from pytest_workflow import shared_queue as shared_queue_module
+from pytest_workflow.result_cache import directory_manifest
+from pytest_workflow.shared_queue import SharedQueue, SharedQueueExecutor
+from pytest_workflow.workflow import LocalExecutor, Workflow, WorkflowQueue
+
+
+def test_claim(tmp_path):
+    first = SharedQueue(tmp_path, "run", "first")
+    second = SharedQueue(tmp_path, "run", "second")
+    workflow = Workflow("true", name="a")
+    assert first.claim(workflow) == "first"
+    assert first.claim(workflow) == "first"
+    assert second.claim(workflow) == "first"
+    first.release(workflow)
+    assert second.claim(workflow) == "second"
+    assert not list((tmp_path / "run" / "claims").glob(".tmp-*"))
+
+
+def test_claim_group(tmp_path):
+    first = SharedQueue(tmp_path, "run", "first")
+    second = SharedQueue(tmp_path, "run", "second")
+    for shared_queue in (first, second):
+        shared_queue.groups = {"a": "a", "b": "a"}
+    assert first.claim(Workflow("true", name="a")) == "first"
+    assert second.claim(Workflow("true", name="b")) == "first"
+
+
+def test_remove_stale_claim(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_queue_module, "STALE_CLAIM_SECS", 0.2)
+    first = SharedQueue(tmp_path, "run", "first")
+    second = SharedQueue(tmp_path, "run", "second")
+    workflow = Workflow("true", name="a")
+    first.claim(workflow)
+    # The claim is judged by the clock of the second session, so an old
+    # modification time does not make it stale.
+    os.utime(tmp_path / "run" / "claims" / "a", (0, 0))
+    assert not second.remove_stale_claim(workflow)
+    time.sleep(0.15)
+    first.heartbeat(workflow)
+    time.sleep(0.15)
+    assert not second.remove_stale_claim(workflow)
+    time.sleep(0.25)
+    assert second.remove_stale_claim(workflow)
+    assert second.claim(workflow) == "second"
+    # The first session does not mark the claim of the second one as alive.
+    first.heartbeat(workflow)
+    assert (tmp_path / "run" / "claims" / "a").read_text() == (
+        f"second\n{0:020d}\n")
+
+
+def test_publish_and_restore(tmp_path):
+    (tmp_path / "run").mkdir()
+    (tmp_path / "run" / "input.txt").write_text("input")
+    workflow = Workflow("bash -c 'echo out > output.txt; echo log'",
+                        cwd=tmp_path / "run", name="a")
+    inputs = directory_manifest(workflow)
+    workflow.run()
+    shared_queue = SharedQueue(tmp_path / "shared", "run", "first")
+    assert shared_queue.restore(workflow) is None
+    shared_queue.publish(workflow, inputs)
+    (tmp_path / "restored").mkdir()
+    restored = Workflow("true", cwd=tmp_path / "restored", name="a")
+    metadata = shared_queue.restore(restored)
+    assert metadata["node"] == "first"
+    assert metadata["exit_code"] == 0
+    assert metadata["outputs"] == ["output.txt"]
+    assert (tmp_path / "restored" / "output.txt").read_text() == "out\n"
+    assert restored.stdout_file.read_text() == "log\n"
+
+
+def run_session(tmp_path, node: str, wait: bool = False):
+    """Runs two independent workflows and a dependent one in a session of
+    the shared queue."""
+    workflows = []
+    for name, command, depends_on in (
+            ("first", "bash -c 'echo first > first.txt'", []),
+            ("second", "bash -c 'exit 3'", []),
+            ("dependent", "bash -c 'cat first.txt'", ["first"])):
+        cwd = tmp_path / node / name
+        cwd.mkdir(parents=True)
+        workflows.append(Workflow(command, cwd=cwd, name=name,
+                                  depends_on=depends_on,
+                                  desired_exit_code=3 * (name == "second")))
+    shared_queue = SharedQueue(tmp_path / "shared", "run", node)
+    shared_queue.groups = {"first": "first", "second": "second",
+                           "dependent": "first"}
+    workflow_queue = WorkflowQueue()
+    for workflow in workflows:
+        workflow_queue.put(workflow)
+    workflow_queue.process(executor=SharedQueueExecutor(
+        LocalExecutor(), shared_queue, wait=wait))
+    return {workflow.name: workflow for workflow in workflows}
+
+
+def test_sessions_share_workflows(tmp_path):
+    first = run_session(tmp_path, "first")
+    assert all(workflow.succeeded() for workflow in first.values())
+    assert first["dependent"].stdout == b"first\n"
+    second = run_session(tmp_path, "second")
+    assert second["first"].skip_reason == "'first' is run by first."
+    assert second["second"].skip_reason == "'second' is run by first."
+    assert second["dependent"].skip_reason is not None
+    collector = run_session(tmp_path, "collector", wait=True)
+    for name, workflow in collector.items():
+        assert workflow.run_by == "first"
+        assert workflow.exit_code == first[name].exit_code
+        assert workflow.duration == first[name].duration
+    assert collector["dependent"].stdout == b"first\n"
+    assert (tmp_path / "collector" / "first" / "first.txt").exists()
+
+
+def test_waiting_session_runs_unclaimed_workflows(tmp_path):
+    collector = run_session(tmp_path, "collector", wait=True)
+    assert all(workflow.run_by is None and workflow.succeeded()
+               for workflow in collector.values())
+
+
+def group_session(tmp_path, commands: Dict[str, str],
+                  claimed_when_finished: Dict[str, bool]):
+    """Runs a group of workflows that depend on 'root' in a session of the
+    shared queue. Records whether the group was claimed when each workflow
+    had finished."""
+    shared_queue = SharedQueue(tmp_path / "shared", "run", "first")
+    shared_queue.groups = {name: "root" for name in commands}
+    workflow_queue = WorkflowQueue()
+    for name, command in commands.items():
+        cwd = tmp_path / name
+        cwd.mkdir()
+        workflow_queue.put(Workflow(
+            command, cwd=cwd, name=name,
+            depends_on=[] if name == "root" else ["root"]))
+
+    def on_finished(workflow: Workflow):
+        claimed_when_finished[workflow.name] = (
+            tmp_path / "shared" / "run" / "claims" / "root").exists()
+
+    workflow_queue.process(number_of_threads=3, executor=SharedQueueExecutor(
+        LocalExecutor(), shared_queue), on_finished=on_finished)
+
+
+def test_group_claim_kept_alive_between_members(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_queue_module, "HEARTBEAT_SECS", 0.1)
+    heartbeats = []
+    monkeypatch.setattr(SharedQueue, "heartbeat",
+                        lambda self, workflow: heartbeats.append(
+                            time.monotonic()))
+    start = time.monotonic()
+    claimed_when_finished = {}
+    group_session(tmp_path, {"root": "true", "dependent": "sleep 1"},
+                  claimed_when_finished)
+    # The claim was kept alive while only the dependent workflow ran.
+    assert len([heartbeat for heartbeat in heartbeats
+                if heartbeat - start > 0.5]) >= 3
+    assert claimed_when_finished == {"root": True, "dependent": True}
+    # All members were published, so the group stays claimed.
+    assert (tmp_path / "shared" / "run" / "claims" / "root").exists()
+
+
+def test_group_claim_released_after_last_member(tmp_path):
+    claimed_when_finished = {}
+    with pytest.raises(FileNotFoundError):
+        group_session(tmp_path, {"root": "true",
+                                 "not_started": "this_command_does_not_exist",
+                                 "running": "sleep 1"},
+                      claimed_when_finished)
+    # The member that could not be started did not release the claim while
+    # another member was still running. It was released after the last one.
+    assert claimed_when_finished == {"root": True, "not_started": True,
+                                     "running": False}
+    assert not (tmp_path / "shared" / "run" / "claims" / "root").exists()
+
+
+def test_group_claim_released_when_member_not_run(tmp_path):
+    claimed_when_finished = {}
+    group_session(tmp_path, {"root": "false", "dependent": "true"},
+                  claimed_when_finished)
+    # The dependent workflow was skipped by the queue, so the group was
+    # released when the queue stopped.
+    assert claimed_when_finished == {"root": True, "dependent": True}
+    assert not (tmp_path / "shared" / "run" / "claims" / "root").exists()
+
+
+SHARED_TESTS = textwrap.dedent("""\
+    - name: write
+      command: bash -c 'echo hello > hello.txt'
+      files:
+        - path: hello.txt
+          contains:
+            - hello
+    - name: read
+      command: cat hello.txt
+      depends_on:
+        - write
+      stdout:
+        contains:
+          - hello
+    """)
+
+
+def run_shared(pytester, shared, node, *args, run="run 1"):
+    # With a separate argument pytest would take the directory into account
+    # when determining the rootdir.
+    return pytester.runpytest("-v", f"--workflow-shared-queue={shared}",
+                              "--workflow-shared-queue-run", run,
+                              "--workflow-node-name", node, *args)
+
+
+def test_shared_queue_sessions(pytester, tmp_path):
+    pytester.makefile(".yml", test=SHARED_TESTS)
+    shared = tmp_path / "shared"
+    result = run_shared(pytester, shared, "node 1")
+    assert result.parseoutcomes()["passed"] == 5
+    result = run_shared(pytester, shared, "node 2", "-rs")
+    result.stdout.fnmatch_lines(["*'write' is run by node 1.*"])
+    assert result.parseoutcomes() == {"skipped": 5}
+    result = run_shared(pytester, shared, "collector",
+                        "--workflow-shared-queue-wait")
+    result.stdout.fnmatch_lines(["'write' run by node 1.",
+                                 "'read' run by node 1."])
+    assert result.parseoutcomes()["passed"] == 5
+
+
+def test_shared_queue_resource_tests_skipped(pytester, tmp_path):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: shared
+          command: echo moo
+          max_cpu_time: 60
+        """))
+    shared = tmp_path / "shared"
+    result = run_shared(pytester, shared, "node 1")
+    assert result.parseoutcomes() == {"passed": 2}
+    result = run_shared(pytester, shared, "collector", "-rs",
+                        "--workflow-shared-queue-wait")
+    result.stdout.fnmatch_lines(["SKIPPED * 'shared' was run by node 1."])
+    assert result.parseoutcomes() == {"passed": 1, "skipped": 1}
+
+
+def test_shared_queue_runs_separated(pytester, tmp_path):
+    pytester.makefile(".yml", test=SHARED_TESTS)
+    shared = tmp_path / "shared"
+    assert run_shared(pytester, shared, "node 1").ret == 0
+    # The results of the first run are not used by the second.
+    result = run_shared(pytester, shared, "node 2", run="run 2")
+    result.stdout.fnmatch_lines(["'write' done."])
+    assert result.parseoutcomes()["passed"] == 5
+
+
+def test_shared_queue_requires_run(pytester, tmp_path):
+    pytester.makefile(".yml", test=SHARED_TESTS)
+    result = pytester.runpytest(
+        f"--workflow-shared-queue={tmp_path / 'shared'}")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(
+        ["*--workflow-shared-queue requires --workflow-shared-queue-run*"])
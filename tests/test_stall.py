@@ -0,0 +1,110 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+
+"""Tests for terminating workflows that make no progress"""
+
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from pytest_workflow.workflow import Workflow, WorkflowQueue, process_tree
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"),
+                                reason="The cpu time is read from /proc")
+
+
+def run(workflow: Workflow):
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process()
+
+
+def test_stalled_workflow_is_terminated(tmp_path):
+    workflow = Workflow("bash -c 'echo started; sleep 30'", cwd=tmp_path,
+                        stall_timeout=0.5)
+    run(workflow)
+    assert workflow.abort_reason == (
+        "it stalled: its logs, files and cpu time did not change for 0.5 "
+        "seconds")
+    assert workflow.duration < 5
+    assert workflow.status().startswith("aborted because it stalled")
+    assert workflow.stall_report is not None
+    assert "sleep 30" in workflow.stall_report
+
+
+@pytest.mark.parametrize("command", [
+    # Writes output
+    "bash -c 'for i in $(seq 15); do echo $i; sleep 0.1; done'",
+    # Writes files
+    "bash -c 'for i in $(seq 15); do touch $i; sleep 0.1; done'",
+    # Only uses cpu
+    f"{sys.executable} -c \"import time\nend = time.time() + 1.5\n"
+    f"while time.time() < end: pass\""
+])
+def test_workflow_making_progress_is_not_terminated(tmp_path, command):
+    workflow = Workflow(command, cwd=tmp_path, stall_timeout=0.5)
+    run(workflow)
+    assert workflow.abort_reason is None
+    assert workflow.succeeded()
+
+
+def test_process_tree():
+    process = subprocess.Popen(["bash", "-c", "sleep 5 & wait"],
+                               start_new_session=True)
+    try:
+        # Wait until the background process has executed sleep.
+        for _ in range(100):
+            lines = process_tree(process.pid).splitlines()
+            if any(line.startswith("  ") and line.endswith("] sleep 5")
+                   for line in lines):
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail("sleep was not started")
+        assert lines[0].startswith(f"{process.pid} [")
+        assert lines[0].endswith("bash -c sleep 5 & wait")
+    finally:
+        process.kill()
+        process.wait()
+    assert process_tree(-1) == ""
+
+
+def test_stall_reported(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: hanging
+          command: sleep 30
+          stall_timeout: 0.5
+        """))
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines([
+        "'hanging' was terminated because it stalled: its logs, files and "
+        "cpu time did not change for 0.5 seconds.",
+        "processes when it stalled:",
+        "* sleep 30"])
+
+
+def test_stall_timeout_option(pytester):
+    pytester.makefile(".yml", test=textwrap.dedent("""\
+        - name: hanging
+          command: sleep 30
+        """))
+    result = pytester.runpytest("-v", "--workflow-stall-timeout", "0.5")
+    result.stdout.fnmatch_lines(["*was terminated because it stalled*"])
+    assert result.parseoutcomes()["failed"] == 1
@@ -27,7 +27,8 @@ import pytest
 
 from pytest_workflow.util import decode_unaligned, duplicate_tree, \
     extract_md5sum, file_md5sum, git_check_submodules_cloned, git_root, \
-    is_in_dir, link_tree, replace_whitespace
+    is_in_dir, link_new_files, link_tree, newest_mtime, parse_group_limit, \
+    parse_memory, parse_shard, replace_whitespace
 
 WHITESPACE_TESTS = [
     ("bla\nbla", "bla_bla"),
@@ -43,6 +44,52 @@ def test_replace_whitespace(string, result):
     assert replace_whitespace(string) == result
 
 
+MEMORY_TESTS = [
+    (1000, 1000),
+    ("1000", 1000),
+    ("2K", 2048),
+    ("1.5m", 1536 * 1024),
+    ("4G", 4 * 1024 ** 3),
+    ("1T", 1024 ** 4),
+]
+
+
+@pytest.mark.parametrize(["memory", "result"], MEMORY_TESTS)
+def test_parse_memory(memory, result):
+    assert parse_memory(memory) == result
+
+
+def test_parse_memory_invalid():
+    with pytest.raises(ValueError) as error:
+        parse_memory("4 gigabytes")
+    error.match("Invalid memory specification: '4 gigabytes'")
+
+
+def test_parse_group_limit():
+    assert parse_group_limit("cromwell=2") == ("cromwell", 2)
+    assert parse_group_limit("a=b=3") == ("a=b", 3)
+
+
+@pytest.mark.parametrize("group_limit", ["database", "=1", "database=0",
+                                         "database=one"])
+def test_parse_group_limit_invalid(group_limit):
+    with pytest.raises(ValueError) as error:
+        parse_group_limit(group_limit)
+    error.match("Invalid group limit")
+
+
+def test_parse_shard():
+    assert parse_shard("1/1") == (1, 1)
+    assert parse_shard("3/4") == (3, 4)
+
+
+@pytest.mark.parametrize("shard", ["0/2", "3/2", "2", "1/", "a/b", "-1/2"])
+def test_parse_shard_invalid(shard):
+    with pytest.raises(ValueError) as error:
+        parse_shard(shard)
+    error.match("Invalid shard")
+
+
 IN_DIR_TESTS = [
     ("/my/parent/subdir/subdir/child", "/my/parent", True),
     ("/my/parent-dir/child", "/my/parent", False),  # Issue 95
@@ -255,3 +302,34 @@ def test_decode_unaligned_wrong_encoding_throws_error():
     data = "hello".encode("utf-8")
     with pytest.raises(UnicodeDecodeError):
         decode_unaligned(data, "utf-32-le")
+
+
+def test_link_new_files(tmp_path):
+    src = tmp_path / "src"
+    dest = tmp_path / "dest"
+    (src / "subdir").mkdir(parents=True)
+    dest.mkdir()
+    (src / "new.txt").write_text("new")
+    (src / "subdir" / "nested.txt").write_text("nested")
+    (src / "existing.txt").write_text("upstream version")
+    (dest / "existing.txt").write_text("downstream version")
+    (src / "excluded.txt").write_text("excluded")
+    (src / "link").symlink_to("new.txt")
+    link_new_files(src, dest, exclude=[src / "excluded.txt"])
+    assert (dest / "new.txt").stat().st_ino == (src / "new.txt").stat().st_ino
+    assert (dest / "subdir" / "nested.txt").read_text() == "nested"
+    assert (dest / "existing.txt").read_text() == "downstream version"
+    assert not (dest / "excluded.txt").exists()
+    assert os.readlink(dest / "link") == "new.txt"
+
+
+def test_newest_mtime(tmp_path):
+    (tmp_path / "subdir").mkdir()
+    (tmp_path / "old.txt").write_text("old")
+    (tmp_path / "subdir" / "new.txt").write_text("new")
+    os.utime(tmp_path, (100, 100))
+    os.utime(tmp_path / "subdir", (100, 100))
+    os.utime(tmp_path / "old.txt", (200, 200))
+    os.utime(tmp_path / "subdir" / "new.txt", (300, 300))
+    assert newest_mtime(tmp_path) == 300
+    assert newest_mtime(tmp_path / "missing") == 0.0
@@ -15,11 +15,16 @@
 # along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
 
 """Tests the Workflow class"""
+import os
+import signal
 import subprocess
+import time
+from pathlib import Path
 
 import pytest
 
-from pytest_workflow.workflow import Workflow
+from pytest_workflow.scanner import ContentScanner
+from pytest_workflow.workflow import Workflow, WorkflowQueue
 
 
 def test_stdout():
@@ -62,6 +67,16 @@ def test_wait_timeout_workflow_started():
     assert error.match("timed out after 0.1 seconds")
 
 
+def test_wait_without_waitid(monkeypatch):
+    # os.waitid is not available on macOS before python 3.13.
+    monkeypatch.delattr("os.waitid")
+    workflow = Workflow("bash -c 'sleep 0.2; exit 3'")
+    workflow.start()
+    workflow.wait()
+    assert workflow.exit_code == 3
+    assert workflow.resource_usage is not None
+
+
 def test_start_lock():
     workflow = Workflow("echo moo")
     workflow.start()
@@ -105,3 +120,147 @@ def test_workflow_matching_exit_code():
     workflow2 = Workflow("grep", desired_exit_code=2)
     workflow2.run()
     assert workflow2.matching_exitcode()
+
+
+def test_workflow_timeout():
+    workflow = Workflow("sleep 10", timeout=0.2)
+    start_time = time.time()
+    workflow.run()
+    assert time.time() - start_time < 2
+    assert workflow.timed_out
+    assert workflow.exit_code == -signal.SIGTERM
+
+
+def test_workflow_no_timeout():
+    workflow = Workflow("echo moo", timeout=5)
+    workflow.run()
+    assert not workflow.timed_out
+    assert workflow.exit_code == 0
+
+
+def process_running(pid: int) -> bool:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+    # A zombie process has already exited, but is not yet reaped.
+    return stat.rsplit(")", maxsplit=1)[1].split()[0] != "Z"
+
+
+def test_workflow_terminate_process_group(tmp_path):
+    # The background sleep is not a direct child of pytest-workflow but
+    # should be terminated as well.
+    workflow = Workflow(
+        "bash -c 'sleep 30 & echo $! > sleep.pid; wait'", cwd=tmp_path)
+    workflow.start()
+    pid_file = tmp_path / "sleep.pid"
+    while not pid_file.exists() or not pid_file.read_text():
+        time.sleep(0.01)
+    pid = int(pid_file.read_text())
+    assert process_running(pid)
+    workflow.terminate()
+    time.sleep(0.1)
+    assert not process_running(pid)
+
+
+def test_workflow_terminate_sigkill():
+    # SIGTERM is ignored, so SIGKILL is needed after the grace period.
+    workflow = Workflow("bash -c 'trap \"\" TERM; sleep 10'")
+    workflow.start()
+    # Give bash some time to set the trap.
+    time.sleep(0.2)
+    start_time = time.time()
+    workflow.terminate(grace_secs=0.2)
+    assert time.time() - start_time < 2
+    assert workflow.exit_code == -signal.SIGKILL
+
+
+def test_workflow_scanned_output(tmp_path):
+    stdout_scanner = ContentScanner(["moo"])
+    workflow = Workflow("bash -c 'for i in 1 2 3; do echo moo$i; done'",
+                        cwd=tmp_path, stdout_scanner=stdout_scanner)
+    workflow.run()
+    assert workflow.stdout == b"moo1\nmoo2\nmoo3\n"
+    assert stdout_scanner.found_strings == {"moo"}
+
+
+def test_workflow_abort_on_pattern(tmp_path):
+    workflow = Workflow(
+        "bash -c 'echo OutOfMemoryError >&2; sleep 30'", cwd=tmp_path,
+        stderr_scanner=ContentScanner(abort_patterns=["OutOfMemoryError"]))
+    start = time.monotonic()
+    workflow.run()
+    assert time.monotonic() - start < 5
+    assert workflow.exit_code == -signal.SIGTERM
+    assert workflow.abort_reason == ("'OutOfMemoryError' was found in its "
+                                     "stderr")
+    assert workflow.stderr == b"OutOfMemoryError\n"
+
+
+def test_workflow_background_process_keeps_pipe_open(tmp_path):
+    workflow = Workflow("bash -c '(sleep 3 &) ; echo done'", cwd=tmp_path,
+                        stdout_scanner=ContentScanner(["done"]))
+    start = time.monotonic()
+    workflow.run()
+    assert time.monotonic() - start < 5
+    assert workflow.stdout == b"done\n"
+
+
+THREAD_COUNT_COMMAND = ("bash -c 'echo ${OMP_NUM_THREADS-unset} "
+                        "${MKL_NUM_THREADS-unset} "
+                        "${OPENBLAS_NUM_THREADS-unset} "
+                        "$PYTEST_WORKFLOW_CPUS $HOME'")
+
+
+def test_workflow_thread_count_hints(monkeypatch):
+    for variable in ("MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv("OMP_NUM_THREADS", "32")
+    workflow = Workflow(THREAD_COUNT_COMMAND, cpus=4, limit_threads=True)
+    workflow.run()
+    # Variables that are set already are not overridden.
+    assert workflow.stdout.decode().split()[:4] == ["32", "4", "4", "4"]
+    # The rest of the environment is passed on.
+    assert len(workflow.stdout.decode().split()) == 5
+
+
+def test_workflow_thread_count_hints_not_limited(monkeypatch):
+    for variable in ("MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv("OMP_NUM_THREADS", "16")
+    workflow = Workflow(THREAD_COUNT_COMMAND, cpus=4)
+    workflow.run()
+    assert workflow.stdout.decode().split()[:4] == [
+        "16", "unset", "unset", "4"]
+
+
+def test_workflow_queue_threads_shared(monkeypatch):
+    for variable in ("MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv("OMP_NUM_THREADS", "16")
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    unclaimed = Workflow(THREAD_COUNT_COMMAND, name="unclaimed")
+    claimed = Workflow(THREAD_COUNT_COMMAND, cpus=3, limit_threads=True,
+                       name="claimed")
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(unclaimed)
+    workflow_queue.put(claimed)
+    workflow_queue.process(number_of_threads=3)
+    # The workflows that do not claim cpus get an equal share of the
+    # machine. Variables that are set already are not overridden.
+    assert unclaimed.stdout.decode().split()[:4] == ["16", "2", "2", "1"]
+    assert claimed.stdout.decode().split()[:4] == ["16", "3", "3", "3"]
+    workflow_queue = WorkflowQueue()
+    many = Workflow(THREAD_COUNT_COMMAND)
+    workflow_queue.put(many)
+    workflow_queue.process(number_of_threads=16)
+    assert many.stdout.decode().split()[:4] == ["16", "1", "1", "1"]
+
+
+def test_workflow_queue_cpu_budget_limits_threads(monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    workflow = Workflow("bash -c 'echo $OMP_NUM_THREADS'", cpus=2)
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(workflow)
+    workflow_queue.process(cpus=4)
+    assert workflow.stdout == b"2\n"
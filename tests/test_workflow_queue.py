@@ -14,10 +14,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
 
+import os
+import signal
+import threading
 import time
 
 import pytest
 
+from pytest_workflow.scanner import ContentScanner
 from pytest_workflow.workflow import Workflow, WorkflowQueue
 
 
@@ -71,3 +75,211 @@ def test_workflow_queue(workflow_number: int, sleep_time: float, threads: int):
     # If the completion time is longer than (iterations * sleep_time + 1) then
     # the code is probably not threaded properly.
     assert completion_time < (iterations + 1) * sleep_time
+
+
+def test_workflow_queue_cpu_budget():
+    # Both workflows need the entire budget so they can not run together,
+    # even though there are enough threads.
+    workflow_queue = WorkflowQueue()
+    for _ in range(2):
+        workflow_queue.put(Workflow("sleep 0.2", cpus=2))
+    start_time = time.time()
+    workflow_queue.process(2, cpus=2)
+    completion_time = time.time() - start_time
+    assert completion_time > 0.4
+    assert completion_time < 0.6
+
+
+def test_workflow_queue_memory_budget_packing():
+    # The large workflow runs alone, the two small ones fit in the budget
+    # together.
+    workflow_queue = WorkflowQueue()
+    workflow_queue.put(Workflow("sleep 0.2", memory=1000))
+    workflow_queue.put(Workflow("sleep 0.2", memory=500))
+    workflow_queue.put(Workflow("sleep 0.2", memory=500))
+    start_time = time.time()
+    workflow_queue.process(3, memory=1000)
+    completion_time = time.time() - start_time
+    assert completion_time > 0.4
+    assert completion_time < 0.6
+
+
+def test_workflow_queue_workflow_exceeds_budget():
+    workflow_queue = WorkflowQueue()
+    workflow = Workflow("echo moo", cpus=4)
+    workflow_queue.put(workflow)
+    with pytest.warns(UserWarning, match="requires more resources than the "
+                                         "budget allows"):
+        workflow_queue.process(2, cpus=2)
+    assert workflow.exit_code == 0
+
+
+def overlapping(first: Workflow, second: Workflow) -> bool:
+    assert first.start_time is not None and first.end_time is not None
+    assert second.start_time is not None and second.end_time is not None
+    return (first.start_time < second.end_time and
+            second.start_time < first.end_time)
+
+
+def test_workflow_queue_mutually_exclusive_group():
+    # The database workflows run one at a time, the other workflow runs next
+    # to them.
+    workflow_queue = WorkflowQueue()
+    database = [Workflow("sleep 0.2", name=f"database {number}",
+                         concurrency_groups=["database"])
+                for number in range(2)]
+    other = Workflow("sleep 0.2", name="other")
+    for workflow in database + [other]:
+        workflow_queue.put(workflow)
+    workflow_queue.process(3)
+    assert not overlapping(*database)
+    assert overlapping(database[0], other)
+
+
+def test_workflow_queue_group_limit():
+    workflow_queue = WorkflowQueue()
+    workflows = [Workflow("sleep 0.2", name=f"io {number}",
+                          concurrency_groups=["io"])
+                 for number in range(3)]
+    for workflow in workflows:
+        workflow_queue.put(workflow)
+    workflow_queue.process(3, group_limits={"io": 2})
+    assert overlapping(workflows[0], workflows[1])
+    # The third workflow starts when one of the first two has finished.
+    assert (max(workflow.start_time for workflow in workflows) >=
+            min(workflow.end_time for workflow in workflows))
+
+
+def test_workflow_queue_longest_first():
+    workflow_queue = WorkflowQueue()
+    short = Workflow("echo short", estimated_duration=1.0)
+    long = Workflow("echo long", estimated_duration=10.0)
+    workflow_queue.put(short)
+    workflow_queue.put(long)
+    workflow_queue.process(1)
+    assert workflow_queue.finished == [long, short]
+
+
+def test_workflow_queue_timeout_frees_slot():
+    workflow_queue = WorkflowQueue()
+    hanging = Workflow("sleep 10", timeout=0.2)
+    normal = Workflow("echo moo")
+    workflow_queue.put(hanging)
+    workflow_queue.put(normal)
+    start_time = time.time()
+    workflow_queue.process(1)
+    assert time.time() - start_time < 2
+    assert hanging.timed_out
+    assert normal.exit_code == 0
+
+
+def test_workflow_queue_slow_prepare(tmp_path):
+    # The timeout of a running workflow is enforced while another workflow
+    # prepares its directory.
+    workflow_queue = WorkflowQueue()
+    hanging = Workflow("sleep 10", timeout=0.3, estimated_duration=10.0)
+    slow = Workflow("echo moo", cwd=tmp_path,
+                    prepare=lambda: time.sleep(2))
+    workflow_queue.put(hanging)
+    workflow_queue.put(slow)
+    workflow_queue.process(2)
+    assert hanging.timed_out
+    assert hanging.duration is not None and hanging.duration < 1.5
+    assert slow.exit_code == 0
+
+
+def test_workflow_queue_cancel():
+    workflow_queue = WorkflowQueue()
+    running = Workflow("sleep 10")
+    queued = Workflow("sleep 10")
+    workflow_queue.put(running)
+    workflow_queue.put(queued)
+    thread = threading.Thread(target=workflow_queue.process)
+    thread.start()
+    while running.start_time is None:
+        time.sleep(0.01)
+    workflow_queue.cancel()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert running.exit_code == -signal.SIGTERM
+    assert queued.start_time is None
+
+
+def test_workflow_queue_fail_fast():
+    workflow_queue = WorkflowQueue()
+    failing = Workflow("false", name="failing", estimated_duration=2)
+    queued = Workflow("echo moo", name="queued", estimated_duration=1)
+    workflow_queue.put(failing)
+    workflow_queue.put(queued)
+    workflow_queue.process(max_failures=1)
+    assert queued.start_time is None
+    assert queued.skip_reason == ("'queued' was not run because the session "
+                                  "was stopped after 'failing' failed.")
+
+
+def test_workflow_queue_fail_fast_terminate():
+    workflow_queue = WorkflowQueue()
+    running = Workflow("sleep 10", name="running", estimated_duration=2)
+    failing = Workflow("false", name="failing", estimated_duration=1)
+    workflow_queue.put(running)
+    workflow_queue.put(failing)
+    start = time.monotonic()
+    workflow_queue.process(number_of_threads=2, max_failures=1,
+                           terminate_on_failure=True)
+    assert time.monotonic() - start < 5
+    assert running.exit_code == -signal.SIGTERM
+    assert running.skip_reason == ("'running' was terminated because the "
+                                   "session was stopped after 'failing' "
+                                   "failed.")
+
+
+def test_workflow_queue_max_failures():
+    workflow_queue = WorkflowQueue()
+    workflows = [Workflow("false", name=str(i), estimated_duration=3 - i)
+                 for i in range(3)]
+    for workflow in workflows:
+        workflow_queue.put(workflow)
+    workflow_queue.process(max_failures=2)
+    assert [workflow.skip_reason is None for workflow in workflows] == [
+        True, True, False]
+
+
+def test_workflow_queue_single_thread():
+    workflow_queue = WorkflowQueue()
+    workflows = [Workflow("bash -c 'echo moo; sleep 0.5'", name=str(i),
+                          stdout_scanner=ContentScanner(["moo"]))
+                 for i in range(50)]
+    for workflow in workflows:
+        workflow_queue.put(workflow)
+    thread_counts = []
+    done = threading.Event()
+
+    def count_threads():
+        while not done.wait(0.05):
+            thread_counts.append(threading.active_count())
+
+    counter = threading.Thread(target=count_threads)
+    counter.start()
+    start = time.monotonic()
+    workflow_queue.process(number_of_threads=50)
+    done.set()
+    counter.join()
+    assert time.monotonic() - start < 5
+    # The main thread and the counter. No thread per workflow or stream.
+    assert max(thread_counts) == 2
+    for workflow in workflows:
+        assert workflow.exit_code == 0
+        assert workflow.stdout_scanner.found_strings == {"moo"}
+
+
+def test_workflow_queue_keyboard_interrupt():
+    workflow_queue = WorkflowQueue()
+    workflow = Workflow("sleep 10")
+    workflow_queue.put(workflow)
+    timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGINT))
+    timer.start()
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        workflow_queue.process()
+    assert time.monotonic() - start < 5
+    assert workflow.exit_code == -signal.SIGTERM
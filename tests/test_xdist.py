@@ -0,0 +1,127 @@
+# Copyright (C) 2018 Leiden University Medical Center
+# This file is part of pytest-workflow
+#
+# pytest-workflow is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# pytest-workflow is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with pytest-workflow.  If not, see <https://www.gnu.org/licenses/
+
+"""Tests for running workflows on pytest-xdist workers"""
+
+import json
+import re
+import textwrap
+
+import pytest
+
+from pytest_workflow.plugin import workflow_groups
+from pytest_workflow.workflow import Workflow
+
+pytest.importorskip("xdist")
+
+XDIST_TESTS = textwrap.dedent("""\
+- name: one
+  command: bash -c 'echo one >> {log}'
+- name: two
+  command: bash -c 'echo two >> {log}'
+- name: three
+  command: bash -c 'echo three >> {log}'
+- name: four
+  command: bash -c 'echo four > four.txt'
+  files:
+    - path: four.txt
+- name: after four
+  command: bash -c 'cat four.txt'
+  depends_on:
+    - four
+  stdout:
+    contains:
+      - four
+""")
+
+CUSTOM_TEST = textwrap.dedent("""\
+import pytest
+
+@pytest.mark.workflow("four")
+def test_four(workflow_dir):
+    assert (workflow_dir / "four.txt").read_text() == "four\\n"
+""")
+
+
+def test_workflows_run_once_on_workers(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makefile(".yml", test=XDIST_TESTS.format(log=log))
+    pytester.makepyfile(test_custom=CUSTOM_TEST)
+    result = pytester.runpytest("-v", "-n", "2")
+    assert result.ret == 0
+    assert sorted(log.read_text().split()) == ["one", "three", "two"]
+    assert result.parseoutcomes()["passed"] == 8
+    # The workflow and its tests are sent to the same worker.
+    workers = {
+        match.group(2): match.group(1) for match in re.finditer(
+            r"\[(gw\d)\] .* PASSED (.+?)@workflows-\d", result.stdout.str())}
+    assert (workers["test_custom.py::test_four[four]"] ==
+            workers["test.yml::four::four.txt::should exist"])
+
+
+def test_worker_runs_its_workflows_at_once(pytester):
+    log = pytester.path / "runs.log"
+    pytester.makefile(".yml", test="".join(
+        f"- name: sleep {number}\n"
+        f"  command: bash -c 'echo start >> {log}; sleep 1; "
+        f"echo end >> {log}'\n" for number in range(4)))
+    result = pytester.runpytest("-n", "1", "--wt", "4")
+    assert result.ret == 0
+    # All workflows were started before the first one finished.
+    assert log.read_text().split() == ["start"] * 4 + ["end"] * 4
+
+
+def test_durations_and_cleanup_on_controller(pytester, tmp_path):
+    pytester.makefile(".yml", test=XDIST_TESTS.format(log="/dev/null"))
+    result = pytester.runpytest("-n", "2", "--basetemp", str(tmp_path))
+    assert result.ret == 0
+    durations = json.loads(
+        (pytester.path / ".pytest_cache" / "v" / "pytest_workflow" /
+         "durations").read_text())
+    assert set(durations) == {"one", "two", "three", "four", "after four"}
+    result.stdout.fnmatch_lines(["*Removing temporary directories and logs*"])
+    assert not list(tmp_path.glob("*/four"))
+
+
+def test_report_on_controller(pytester, tmp_path):
+    pytester.makefile(".yml", test=XDIST_TESTS.format(log="/dev/null"))
+    report = tmp_path / "report.json"
+    result = pytester.runpytest("-n", "2", "--workflow-report", str(report))
+    assert result.ret == 0
+    assert {entry["name"] for entry in json.loads(
+        report.read_text())["workflows"]} == {
+        "one", "two", "three", "four", "after four"}
+
+
+def test_dist_mode_is_replaced(pytester):
+    pytester.makefile(".yml", test=XDIST_TESTS.format(log="/dev/null"))
+    with pytest.warns(UserWarning,
+                      match="uses '--dist loadgroup' instead of "
+                            "'--dist loadfile'"):
+        result = pytester.runpytest("-n", "2", "--dist", "loadfile")
+    assert result.ret == 0
+
+
+def test_workflow_groups():
+    workflows = {
+        "a": Workflow("true", name="a"),
+        "b": Workflow("true", name="b", depends_on=["c"]),
+        "c": Workflow("true", name="c", depends_on=["a"]),
+        "d": Workflow("true", name="d"),
+        "e": Workflow("true", name="e", depends_on=["d", "missing"]),
+    }
+    assert workflow_groups(workflows) == {
+        "a": "a", "b": "a", "c": "a", "d": "d", "e": "d"}